@@ -17,7 +17,7 @@ from matplotlib import colors
 from datetime import datetime
 
 from deepMIMO5 import get_deepMIMOdata, DeepMIMODataset, flatten_last_dims, myexpand_to_rank
-from deepMIMO5 import count_errors, count_block_errors
+from deepMIMO5 import sim_ber_mc, run_mc_jobs, TransceiverRunner
 from deepMIMO5 import StreamManagement, MyResourceGrid, Mapper, MyResourceGridMapper, MyDemapper, BinarySource, ebnodb2no, hard_decisions, calculate_BER
 from deepMIMO5 import complex_normal, mygenerate_OFDMchannel, RemoveNulledSubcarriers, \
     MyApplyOFDMChannel, MyApplyTimeChannel
@@ -33,9 +33,14 @@ from deepMIMO5 import OFDMModulator, OFDMDemodulator
 from channel import MyLSChannelEstimator #, LSChannelEstimator, ApplyTimeChannel#, time_lag_discrete_time_channel #, ApplyTimeChannel #cir_to_time_channel
 from ldpc.encoding import LDPC5GEncoder
 from ldpc.decoding import LDPC5GDecoder
+from datastore import save_dict
+from cirbank import CIRBank, open_cir_bank
+from equalizer_numpy import OFDMEqualizer
 
 import scipy
 import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 IMG_FORMAT=".pdf" #".png"
 
 def ber_plot(ebno_dbs, bers, legend="", ylabel="BER", title="Bit Error Rate", ebno=True, xlim=None,
@@ -165,51 +170,21 @@ def ber_plot_single2(ebno_dbs, bers, is_bler= False, title = "BER Simulation", s
         plt.close(fig)
 
 
-def sim_ber(ebno_dbs, eval_transceiver, b, batch_size):
-    #num_points = 100  # Example value, replace with the actual value
-    ebno_dbs_np = np.array(ebno_dbs, dtype=np.float64)  # Cast to the desired data type
-    batch_size_np = np.array(batch_size, dtype=np.int32)  # Cast to the desired data type
-    num_points = ebno_dbs_np.shape[0] #20
-
-    bit_n = np.size(b) #272384
-    block_n = np.size(b[..., -1]) #128, b: (128, 1, 1, 2128)
-
-    bers = []
-    blers = []
-    BERs= []
-
-    for ebno_db in ebno_dbs:
-        #b_hat, BER = eval_transceiver(b=b, ebno_db = ebno_db, channeltype=channeltype)
-        b_hat, BER = eval_transceiver(b=b, ebno_db = ebno_db)
-        BERs.append(BER)
-        # count errors
-        bit_e = count_errors(b, b_hat)
-        block_e = count_block_errors(b, b_hat)
-
-        # Initialize NumPy arrays bit_errors, block_errors, nb_bits, and nb_blocks (if not already initialized)
-        nb_bits = np.zeros_like(bit_n, dtype=np.int64)
-        nb_blocks = np.zeros_like(block_n, dtype=np.int64)
-        #bit_errors = 0
-        #block_errors = 0
-        bit_errors = np.zeros_like(bit_e, dtype=np.int64)
-        block_errors = np.zeros_like(block_e, dtype=np.int64)
-
-        # Update variables
-        bit_errors = bit_errors + np.int64(bit_e)
-        block_errors = block_errors + np.int64(block_e)
-        nb_bits = nb_bits+ np.int64(bit_n)
-        nb_blocks = nb_blocks+ np.int64(block_n)
-
-        ber = np.divide(bit_errors.astype(np.float64), nb_bits.astype(np.float64))
-        bler = np.divide(block_errors.astype(np.float64), nb_blocks.astype(np.float64))
-
-        # Replace NaN values with zeros
-        ber = np.where(np.isnan(ber), np.zeros_like(ber), ber)
-        bler = np.where(np.isnan(bler), np.zeros_like(bler), bler)
-
-        bers.append(ber)
-        blers.append(bler)
-
+def sim_ber(ebno_dbs, eval_transceiver, b, batch_size, perfect_csi=False, max_mc_iter=1, num_target_bit_errors=None, num_target_block_errors=None, \
+            early_stop=True, csvpath=None, num_workers=0, seed=None):
+    #Monte-Carlo sweep: up to max_mc_iter batches per Eb/No point (fresh bits after the first batch of b) until the target errors are reached,
+    #stops once a point is error free, each finished point is appended to csvpath
+    #num_workers>0 runs the points in a process pool, pass a TransceiverRunner as eval_transceiver in that case
+    #batch_size is not used (the batch is the shape of b), kept only for call compatibility
+    if isinstance(eval_transceiver, TransceiverRunner):
+        eval_fn = eval_transceiver
+    else:
+        eval_fn = lambda b, ebno_db: eval_transceiver(b=b, ebno_db=ebno_db, perfect_csi=perfect_csi)
+    results = sim_ber_mc(ebno_dbs, eval_fn, b, max_mc_iter=max_mc_iter, num_target_bit_errors=num_target_bit_errors, \
+                         num_target_block_errors=num_target_block_errors, early_stop=early_stop, csvpath=csvpath, num_workers=num_workers, seed=seed)
+    bers = [np.float64(result['ber']) for result in results]
+    blers = [np.float64(result['bler']) for result in results]
+    BERs = [result['BER'] for result in results]
     return bers, blers, BERs
 
 def simulationloop(ebno_dbs, eval_transceiver, b=None, perfect_csi=False):
@@ -221,164 +196,160 @@ def simulationloop(ebno_dbs, eval_transceiver, b=None, perfect_csi=False):
     return bers_np
 
 
-class NearestNeighborInterpolator:
+class PilotInterpolator:
     # pylint: disable=line-too-long
-    r"""NearestNeighborInterpolator(pilot_pattern)
+    r"""PilotInterpolator(pilot_pattern, interpolation_type="nn")
 
-    Nearest-neighbor channel estimate interpolation on a resource grid.
+    Numpy channel estimate interpolation on a resource grid with a precomputed operator.
 
-    This class assigns to each element of an OFDM resource grid one of
-    ``num_pilots`` provided channel estimates and error
-    variances according to the nearest neighbor method. It is assumed
-    that the measurements were taken at the nonzero positions of a
-    :class:`~sionna.ofdm.PilotPattern`.
+    All interpolators of the LS estimator are linear in the pilot estimates, so every resource element is
+    a weighted sum of a few pilot estimates of its stream. The pilot indices and weights of these sums
+    are computed once for the :class:`PilotPattern`; an interpolation is then one gather and one weighted
+    sum over the last axis for the whole batch.
 
-    The figure below shows how four channel estimates are interpolated
-    accross a resource grid. Grey fields indicate measurement positions
-    while the colored regions show which resource elements are assigned
-    to the same measurement value.
-
-    .. image:: ../figures/nearest_neighbor_interpolation.png
+    "nn" assigns the nearest pilot (Manhattan distance, zero-energy pilots skipped) as
+    :class:`~sionna.ofdm.NearestNeighborInterpolator`, one pilot per resource element.
+    "lin" and "lin_time_avg" interpolate linearly across subcarriers and then across OFDM symbols
+    (optionally averaging over the OFDM symbols carrying pilots) as :class:`~sionna.ofdm.LinearInterpolator`.
 
     Parameters
     ----------
     pilot_pattern : PilotPattern
         An instance of :class:`~sionna.ofdm.PilotPattern`
 
+    interpolation_type : One of ["nn", "lin", "lin_time_avg"], string
+
     Input
     -----
-    h_hat : [batch_size, num_rx, num_rx_ant, num_tx, num_streams_per_tx, num_pilot_symbols], tf.complex
+    h_hat : [batch_size, num_rx, num_rx_ant, num_tx, num_streams_per_tx, num_pilot_symbols], complex
         Channel estimates for the pilot-carrying resource elements
 
-    err_var : [batch_size, num_rx, num_rx_ant, num_tx, num_streams_per_tx, num_pilot_symbols], tf.complex
+    err_var : [batch_size, num_rx, num_rx_ant, num_tx, num_streams_per_tx, num_pilot_symbols] or broadcastable leading dims, float
         Channel estimation error variances for the pilot-carrying resource elements
 
     Output
     ------
-    h_hat : [batch_size, num_rx, num_rx_ant, num_tx, num_streams_per_tx, num_ofdm_symbols, fft_size], tf.complex
+    h_hat : [batch_size, num_rx, num_rx_ant, num_tx, num_streams_per_tx, num_ofdm_symbols, num_effective_subcarriers], complex
         Channel estimates accross the entire resource grid for all
         transmitters and streams
 
-    err_var : Same shape as ``h_hat``, tf.float
+    err_var : Same leading dims as the input ``err_var``, float
         Channel estimation error variances accross the entire resource grid
         for all transmitters and streams
     """
-    def __init__(self, pilot_pattern):
-        #super().__init__()
-
+    def __init__(self, pilot_pattern, interpolation_type="nn"):
         assert(pilot_pattern.num_pilot_symbols>0),\
             """The pilot pattern cannot be empty"""
+        assert interpolation_type in ["nn","lin","lin_time_avg"], \
+            "Unsupported `interpolation_type`"
 
-        # Reshape mask to shape [-1,num_ofdm_symbols,num_effective_subcarriers]
         mask = np.array(pilot_pattern.mask) #(1, 2, 14, 64)
-        mask_shape = mask.shape # Store to reconstruct the original shape (1, 2, 14, 64)
-        mask = np.reshape(mask, [-1] + list(mask_shape[-2:])) #(2, 14, 64)
-
-        # Reshape the pilots to shape [-1, num_pilot_symbols]
-        pilots = pilot_pattern.pilots #(1, 2, 128)
+        self._mask_shape = mask.shape
+        mask = np.reshape(mask, [-1] + list(mask.shape[-2:])) #(2, 14, 64)
+        pilots = np.array(pilot_pattern.pilots) #(1, 2, 128)
         pilots = np.reshape(pilots, [-1] + [pilots.shape[-1]]) #(2, 128)
-
-        max_num_zero_pilots = np.max(np.sum(np.abs(pilots)==0, -1)) #64
+        max_num_zero_pilots = np.max(np.sum(np.abs(pilots)==0, -1))
         assert max_num_zero_pilots<pilots.shape[-1],\
             """Each pilot sequence must have at least one nonzero entry"""
 
-        # Compute gather indices for nearest neighbor interpolation
-        gather_ind = np.zeros_like(mask, dtype=np.int32) #(2, 14, 64)
-        for a in range(gather_ind.shape[0]): # For each pilot pattern...
-            i_p, j_p = np.where(mask[a]) # ...determine the pilot indices
-
-            for i in range(mask_shape[-2]): # Iterate over...
-                for j in range(mask_shape[-1]): # ... all resource elements
-
-                    # Compute Manhattan distance to all pilot positions
-                    d = np.abs(i-i_p) + np.abs(j-j_p)
-
-                    # Set the distance at all pilot positions with zero energy
-                    # equal to the maximum possible distance
-                    d[np.abs(pilots[a])==0] = np.sum(mask_shape[-2:])
-
-                    # Find the pilot index with the shortest distance...
-                    ind = np.argmin(d)
-
-                    # ... and store it in the index tensor
-                    gather_ind[a, i, j] = ind
-
-        # Reshape to the original shape of the mask, i.e.:
-        # [num_tx, num_streams_per_tx, num_ofdm_symbols,...
-        #  ..., num_effective_subcarriers]
-        #self._gather_ind = tf.reshape(gather_ind, mask_shape)
-        self._gather_ind = np.reshape(gather_ind, mask_shape) #_gather_ind: (1, 2, 14, 64)
-        np.save('data/inter_gather_ind.npy', self._gather_ind)
- 
-    def mygather(self, inputs, method='tf'):
-        # Interpolate through gather. Shape:
-        # [num_tx, num_streams_per_tx, num_ofdm_symbols,
-        #  ..., num_effective_subcarriers, k, l, m]
-        if method == 'tf':
-            outputs = tf.gather(inputs, self._gather_ind, 2, batch_dims=2)
-        #batch_dims: An optional parameter that specifies the number of batch dimensions. It controls how many leading dimensions are considered as batch dimensions.
-        elif method == 'np':
-            result = inputs.copy()
-            # Gather along each dimension
-            # for dim in range(batch_dims, len(inputs.shape)): #2-6
-            #     result = np.take(result, indices, axis=dim)
-
-            #gather_ind_nobatch = indices[0, 0] #ignore first two dimensions as batch (14, 64)
-            #result = np.take(result, gather_ind_nobatch, axis=2) #(1, 2, 14, 64, 2, 1, 16)
-            gather_ind_nobatch = self._gather_ind[0, 0] #ignore first two dimensions as batch (14, 64)
-            result1 = np.take(result, gather_ind_nobatch, axis=2) #(1, 2, 14, 64, 2, 1, 16)
-            gather_ind_nobatch = self._gather_ind[0, 1] #ignore first two dimensions as batch (14, 64)
-            outputs = np.take(result, gather_ind_nobatch, axis=2) #(1, 2, 14, 64, 2, 1, 16)
-            outputs[0,0,:,:,:,:,:]=result1[0,0,:,:,:,:,:]
-        else: #Wrong result
-            #outputs = np.take(inputs, self._gather_ind, axis=2, mode='wrap') #(1, 2, 1, 2, 14, 64, 2, 1, 16), _gather_ind: (1, 2, 14, 64)
-            #outputs: (1, 2, 14, 64, 2, 1, 16)
-            self._gather_ind_nobatch = self._gather_ind[0, 0] #ignore first two dimensions as batch (14, 64)
-            outputs = np.take(inputs, self._gather_ind_nobatch, axis=2) #(1, 2, 14, 64, 2, 1, 16)
-            np.save('data/outputs_inter.npy', outputs)
-            #outputs = inputs[:, :, self._gather_ind, :, :, :] #(1, 2, 1, 2, 14, 64, 2, 1, 16)
-            # Perform the gathe
-            # axis = 2
-            # batch_dims = 2
-            # outputs = np.take_along_axis(inputs, self._gather_ind, axis=axis, batch_dims=batch_dims)
-        return outputs
-    
-    def _interpolate(self, inputs):
-        # inputs has shape: (1, 2, 128, 2, 1, 16)
-        # [k, l, m, num_tx, num_streams_per_tx, num_pilots]
-
-        # Transpose inputs to bring batch_dims for gather last. New shape:
-        # [num_tx, num_streams_per_tx, num_pilots, k, l, m]
-        #perm = tf.roll(tf.range(tf.rank(inputs)), -3, 0)
-        #inputs = tf.transpose(inputs, perm)
-        perm = np.roll(np.arange(np.ndim(inputs)), -3, 0) # shift the dimensions. (2, 1, 16, 1, 2, 128)
-        inputs = np.transpose(inputs, perm) #(1, 2, 128, 2, 1, 16)
-
-        #np.save('inputs_inter.npy', inputs)
-        outputs = self.mygather(inputs)
-        
-
-        # Transpose outputs to bring batch_dims first again. New shape:
-        # [k, l, m, num_tx, num_streams_per_tx,...
-        #  ..., num_ofdm_symbols, num_effective_subcarriers]
-        #perm = tf.roll(tf.range(tf.rank(outputs)), 3, 0)
-        #outputs = tf.transpose(outputs, perm)
-        perm = np.roll(np.arange(np.ndim(outputs)), 3, 0) #[4, 5, 6, 0, 1, 2, 3]
-        outputs = np.transpose(outputs, perm) #(2, 1, 16, 1, 2, 14, 64)
+        # Dense operator [num_streams, num_ofdm_symbols*num_effective_subcarriers, num_pilots], only used here
+        if interpolation_type == "nn":
+            weights = self._nn_operator(mask, pilots)
+        else:
+            weights = self._linear_operator(mask, pilots, time_avg=(interpolation_type=="lin_time_avg"))
+
+        # Keep the nonzero weights of every resource element: [num_streams, num_re, k]
+        k = max(1, int(np.max(np.sum(weights!=0, axis=-1))))
+        ind = np.argsort(weights==0, axis=-1, kind="stable")[...,:k]
+        self._weights = np.take_along_axis(weights, ind, axis=-1)
+        # Indices into the flattened [num_streams*num_pilots] axis of the inputs
+        num_pilots = pilots.shape[-1]
+        self._gather_ind = ind + num_pilots*np.arange(mask.shape[0])[:,None,None]
+        self._unit_weights = bool(np.all(self._weights==1)) # nn: pure gather
+
+    @staticmethod
+    def _nn_operator(mask, pilots):
+        num_streams, num_ofdm_symbols, num_sc = mask.shape
+        i, j = np.meshgrid(np.arange(num_ofdm_symbols), np.arange(num_sc), indexing="ij")
+        weights = np.zeros([num_streams, num_ofdm_symbols*num_sc, pilots.shape[-1]])
+        for a in range(num_streams):
+            i_p, j_p = np.where(mask[a]) # pilot positions in the order of the pilots
+            # Manhattan distance of every resource element to every pilot
+            d = np.abs(i.reshape(-1,1)-i_p) + np.abs(j.reshape(-1,1)-j_p)
+            # Pilots with zero energy get the maximum possible distance
+            d[:, np.abs(pilots[a])==0] = num_ofdm_symbols + num_sc
+            weights[a, np.arange(d.shape[0]), np.argmin(d, axis=-1)] = 1
+        return weights
+
+    @staticmethod
+    def _linear_operator(mask, pilots, time_avg):
+        # Linear interpolation of the unit vectors of every pilot, first across subcarriers
+        # then across OFDM symbols, same index logic as LinearInterpolator
+        num_streams, num_ofdm_symbols, num_sc = mask.shape
+        num_pilots = pilots.shape[-1]
+        x = np.arange(num_sc)
+        t = np.arange(num_ofdm_symbols)
+        weights = np.zeros([num_streams, num_ofdm_symbols*num_sc, num_pilots])
+        def interp1d(x, x0, x1, y0, y1):
+            slope = np.divide(y1-y0, x1-x0, out=np.zeros_like(y0), where=(x1-x0)!=0)
+            return (x-x0)*slope + y0
+        for a in range(num_streams):
+            z = np.zeros([num_ofdm_symbols, num_sc], pilots.dtype)
+            z[np.where(mask[a])] = pilots[a]
+            eye = np.eye(num_pilots) # [pilot, pilot estimate]
+            pilot_ind = np.where(np.abs(pilots[a]))[0] # nonzero pilots within the pilots vector
+            h_freq = np.zeros([num_pilots, num_ofdm_symbols, num_sc])
+            pilot_count = 0
+            for i in range(num_ofdm_symbols):
+                pilot_ind_ofdm = np.where(np.abs(z[i]))[0] # nonzero pilots within the OFDM symbol
+                n = len(pilot_ind_ofdm)
+                if n == 1:
+                    h_freq[:,i,:] = eye[:, pilot_ind[pilot_count], None]
+                elif n >= 2:
+                    # Index of the pilot pair enclosing (or closest to) every subcarrier, a pilot belongs to the pair on its left
+                    seg = np.clip(np.searchsorted(pilot_ind_ofdm, x, side="left")-1, 0, n-2)
+                    x0 = pilot_ind_ofdm[seg]
+                    x1 = pilot_ind_ofdm[seg+1]
+                    y0 = eye[:, pilot_ind[pilot_count+seg]]
+                    y1 = eye[:, pilot_ind[pilot_count+seg+1]]
+                    h_freq[:,i,:] = interp1d(x, x0, x1, y0, y1)
+                pilot_count += n
+            ofdm_ind = np.where(np.sum(np.abs(z), axis=-1))[0] # OFDM symbols carrying pilots
+            if time_avg:
+                h_freq[:] = np.sum(h_freq, axis=1, keepdims=True)/len(ofdm_ind)
+            if len(ofdm_ind) == 1:
+                h_time = np.repeat(h_freq[:, ofdm_ind[0:1], :], num_ofdm_symbols, axis=1)
+            else:
+                n = len(ofdm_ind)
+                seg = np.clip(np.searchsorted(ofdm_ind, t, side="left")-1, 0, n-2)
+                x0 = ofdm_ind[seg][:,None]
+                x1 = ofdm_ind[seg+1][:,None]
+                h_time = interp1d(t[:,None], x0, x1, h_freq[:, ofdm_ind[seg], :], h_freq[:, ofdm_ind[seg+1], :])
+            weights[a] = np.reshape(h_time, [num_pilots, -1]).T
+        return weights
 
-        return outputs
+    def _interpolate(self, inputs):
+        # inputs: [..., num_tx, num_streams_per_tx, num_pilots]
+        lead_shape = inputs.shape[:-3]
+        inputs = np.reshape(inputs, lead_shape + (-1,)) # [..., num_streams*num_pilots]
+        outputs = inputs[..., self._gather_ind] # [..., num_streams, num_re, k]
+        if self._unit_weights:
+            outputs = outputs[...,0]
+        else:
+            outputs = np.sum(outputs*self._weights.astype(outputs.real.dtype), axis=-1)
+        return np.reshape(outputs, lead_shape + self._mask_shape)
 
     def __call__(self, h_hat, err_var):
-
         h_hat = self._interpolate(h_hat)
         err_var = self._interpolate(err_var)
         return h_hat, err_var
-    
+
 class MyLSChannelEstimatorNP():
     # pylint: disable=line-too-long
-    r"""LSChannelEstimator(resource_grid, interpolation_type="nn", interpolator=None, dtype=tf.complex64, **kwargs)
+    r"""MyLSChannelEstimatorNP(resource_grid, interpolation_type="nn", interpolator=None, debug=False)
 
-    Layer implementing least-squares (LS) channel estimation for OFDM MIMO systems.
+    Numpy least-squares (LS) channel estimation for OFDM MIMO systems, same interface and outputs as
+    ``channel.MyLSChannelEstimator``.
 
     After LS channel estimation at the pilot positions, the channel estimates
     and error variances are interpolated accross the entire resource grid using
@@ -414,198 +385,114 @@ class MyLSChannelEstimatorNP():
     The channel estimates and error variances are then interpolated accross
     the entire resource grid.
 
+    The pilot gather indices, :math:`\mathbf{p}^\star/|\mathbf{p}|^2`, :math:`1/|\mathbf{p}|^2`
+    and the interpolation operator are computed once in the constructor.
+
     Parameters
     ----------
     resource_grid : ResourceGrid
         An instance of :class:`~sionna.ofdm.ResourceGrid`.
 
     interpolation_type : One of ["nn", "lin", "lin_time_avg"], string
-        The interpolation method to be used.
+        The interpolation method to be used, see :class:`PilotInterpolator`.
         It is ignored if ``interpolator`` is not `None`.
-        Available options are :class:`~sionna.ofdm.NearestNeighborInterpolator` (`"nn`")
-        or :class:`~sionna.ofdm.LinearInterpolator` without (`"lin"`) or with
-        averaging across OFDM symbols (`"lin_time_avg"`).
+        `None` returns the estimates at the pilot positions.
         Defaults to "nn".
 
-    interpolator : BaseChannelInterpolator
-        An instance of :class:`~sionna.ofdm.BaseChannelInterpolator`,
-        such as :class:`~sionna.ofdm.LMMSEInterpolator`,
-        or `None`. In the latter case, the interpolator specfied
-        by ``interpolation_type`` is used.
-        Otherwise, the ``interpolator`` is used and ``interpolation_type``
-        is ignored.
-        Defaults to `None`.
+    interpolator : callable
+        Called as ``interpolator(h_hat, err_var)`` instead of the :class:`PilotInterpolator`
+        specified by ``interpolation_type``. Defaults to `None`.
 
-    dtype : tf.Dtype
-        Datatype for internal calculations and the output dtype.
-        Defaults to `tf.complex64`.
+    debug : bool
+        Save the intermediate arrays to ``data/*_np.npy`` on every call. Defaults to `False`.
 
     Input
     -----
     (y, no) :
         Tuple:
 
-    y : [batch_size, num_rx, num_rx_ant, num_ofdm_symbols,fft_size], tf.complex
+    y : [batch_size, num_rx, num_rx_ant, num_ofdm_symbols,fft_size], complex
         Observed resource grid
 
-    no : [batch_size, num_rx, num_rx_ant] or only the first n>=0 dims, tf.float
+    no : [batch_size, num_rx, num_rx_ant] or only the first n>=0 dims, float
         Variance of the AWGN
 
     Output
     ------
-    h_ls : [batch_size, num_rx, num_rx_ant, num_tx, num_streams_per_tx, num_ofdm_symbols,fft_size], tf.complex
+    h_ls : [batch_size, num_rx, num_rx_ant, num_tx, num_streams_per_tx, num_ofdm_symbols,fft_size], complex
         Channel estimates accross the entire resource grid for all
         transmitters and streams
 
-    err_var : Same shape as ``h_ls``, tf.float
+    err_var : Same shape as ``h_ls`` or broadcastable to it, float
         Channel estimation error variance accross the entire resource grid
         for all transmitters and streams
     """
 
-    def __init__(self, resource_grid, interpolation_type="nn", interpolator=None,**kwargs):
-        #super().__init__(dtype=dtype, **kwargs)
-
-        # assert isinstance(resource_grid, ResourceGrid),\
-        #     "You must provide a valid instance of ResourceGrid."
+    def __init__(self, resource_grid, interpolation_type="nn", interpolator=None, debug=False, **kwargs):
         self._pilot_pattern = resource_grid.pilot_pattern
-
-        #added test code
-        mask = np.array(self._pilot_pattern.mask) #(1, 2, 14, 64)
-        mask_shape = mask.shape # Store to reconstruct the original shape
-        # Reshape the pilots to shape [-1, num_pilot_symbols]
-        pilots = self._pilot_pattern.pilots #(1, 2, 128)
-        print(mask_shape) #(1, 2, 14, 64)
-        #print('mask:', mask[0,0,0,:]) #all 0
-        #print('pilots:', pilots[0,0,:]) #(1, 2, 128) -0.99999994-0.99999994j 0.        +0.j          0.99999994+0.99999994j
-        #0.99999994-0.99999994j  0.        +0.j          0.99999994-0.99999994j
         self._removed_nulled_scs = RemoveNulledSubcarriers(resource_grid)
+        self._debug = debug
 
         assert interpolation_type in ["nn","lin","lin_time_avg",None], \
             "Unsupported `interpolation_type`"
         self._interpolation_type = interpolation_type
-
-        #if self._interpolation_type == "nn":
-        self._interpol = NearestNeighborInterpolator(self._pilot_pattern)
-        # elif self._interpolation_type == "lin":
-        #     self._interpol = LinearInterpolator(self._pilot_pattern)
-        # elif self._interpolation_type == "lin_time_avg":
-        #     self._interpol = LinearInterpolator(self._pilot_pattern,
-        #                                         time_avg=True)
+        if interpolator is not None:
+            self._interpol = interpolator
+        elif self._interpolation_type is not None:
+            self._interpol = PilotInterpolator(self._pilot_pattern, self._interpolation_type)
 
         # Precompute indices to gather received pilot signals
         num_pilot_symbols = self._pilot_pattern.num_pilot_symbols #128
-        mask = flatten_last_dims(self._pilot_pattern.mask) #(1, 2, 896)
-        #np.save('mask.npy', mask)
-        #pilot_ind = tf.argsort(mask, axis=-1, direction="DESCENDING") #(1, 2, 896)
-        ##np.argsort is small to bigger (index of 0s first, index of 1s later), add [..., ::-1] to flip the results from bigger to small (index 1s first, index 0s later)
-        pilot_ind = np.argsort(mask, axis=-1)[..., ::-1] #(1, 2, 896) reverses the order of the indices along the last axis
-        #select num_pilot_symbols, i.e., get all index of 1s in mask, due to the np.argsort(small to bigger), the order for these 1s index is not sorted
-        self._pilot_ind = pilot_ind[...,:num_pilot_symbols] #(1, 2, 128)
-        #add sort again for these 1s index (small index to bigger)
-        #analysis in tfnumpy.py
-        self._pilot_ind = np.sort(self._pilot_ind)
-        print(self._pilot_ind)
+        mask = flatten_last_dims(np.array(self._pilot_pattern.mask)) #(1, 2, 896)
+        # Positions of the pilots in the order of the pilots vector, i.e., ascending flat index
+        self._pilot_ind = np.argsort(mask==0, axis=-1, kind="stable")[...,:num_pilot_symbols] #(1, 2, 128)
 
+        # LS scaling p*/|p|^2 and error variance scaling 1/|p|^2, 0 for zero pilots
+        pilots = np.array(self._pilot_pattern.pilots) #(1, 2, 128)
+        pilotssquare = np.abs(pilots)**2
+        self._pilots_inv = np.divide(np.conj(pilots), pilotssquare, out=np.zeros_like(pilots), where=pilotssquare != 0)
+        self._err_scale = np.divide(1., pilotssquare, out=np.zeros_like(pilotssquare), where=pilotssquare != 0)
 
     def estimate_at_pilot_locations(self, y_pilots, no):
+        # y_pilots : [batch_size, num_rx, num_rx_ant, num_tx, num_streams, num_pilot_symbols] (b, 1, 16, 1, 2, 128)
+        # no : [batch_size, num_rx, num_rx_ant] or only the first n>=0 dims
 
-        # y_pilots : [batch_size, num_rx, num_rx_ant, num_tx, num_streams,
-        #               num_pilot_symbols], tf.complex
-        #     The observed signals for the pilot-carrying resource elements.
-
-        # no : [batch_size, num_rx, num_rx_ant] or only the first n>=0 dims,
-        #   tf.float
-        #     The variance of the AWGN.
-
-        # Compute LS channel estimates
-        # Note: Some might be Inf because pilots=0, but we do not care
-        # as only the valid estimates will be considered during interpolation.
-        # We do a save division to replace Inf by 0.
-        # Broadcasting from pilots here is automatic since pilots have shape
-        # [num_tx, num_streams, num_pilot_symbols]
-        #h_ls = tf.math.divide_no_nan(y_pilots, self._pilot_pattern.pilots)
-        #h_ls = np.divide(y_pilots, self._pilot_pattern.pilots) #(2, 1, 16, 1, 2, 128)
-        #h_ls = np.nan_to_num(h_ls) #replaces NaN (Not-a-Number) values with zeros.
-
-        h_ls = np.divide(y_pilots, self._pilot_pattern.pilots, out=np.zeros_like(y_pilots), where=self._pilot_pattern.pilots != 0)
-        #h_ls: (2, 1, 16, 1, 2, 128)
-        # Compute error variance and broadcast to the same shape as h_ls
-        # Expand rank of no for broadcasting
-        #no = expand_to_rank(no, tf.rank(h_ls), -1)
-        #no = myexpand_to_rank(no, h_ls.ndim, -1) #(1, 1, 1, 1, 1, 1)
-        
-
-        # Expand rank of pilots for broadcasting
-        #pilots = expand_to_rank(self._pilot_pattern.pilots, tf.rank(h_ls), 0)
-        pilots = myexpand_to_rank(self._pilot_pattern.pilots, h_ls.ndim, 0) #(1, 1, 1, 1, 2, 128)
-
-        # Compute error variance, broadcastable to the shape of h_ls
-        #err_var = tf.math.divide_no_nan(no, tf.abs(pilots)**2)
-        pilotssquare = np.abs(pilots)**2
-        #err_var = np.divide(no, pilotssquare)
-        #err_var = np.nan_to_num(err_var) #replaces NaN (Not-a-Number) values with zeros. (1, 1, 1, 1, 2, 128)
-        no_array = np.full(pilots.shape, no, dtype=np.float32) #(1, 1, 1, 1, 2, 128)
-        err_var = np.divide(no_array, pilotssquare, out=np.zeros_like(no_array), where=pilotssquare != 0) #(1, 1, 1, 1, 2, 128)
+        # LS estimates, zero for the pilots with zero energy
+        h_ls = y_pilots*self._pilots_inv.astype(y_pilots.dtype) #(b, 1, 16, 1, 2, 128)
 
+        # Error variance broadcastable to the shape of h_ls
+        no = myexpand_to_rank(no, h_ls.ndim, -1) #(1, 1, 1, 1, 1, 1)
+        err_var = no*self._err_scale.astype(no.dtype) #(1, 1, 1, 1, 2, 128)
         return h_ls, err_var
 
-    #def call(self, inputs):
     def __call__(self, inputs):
-
-        y, no = inputs #y: (64, 1, 1, 14, 76) complex64
-        y = to_numpy(y) #(2, 1, 16, 14, 76)
-        no = np.array(no, dtype=np.float32)
-
-        # y has shape:
-        # [batch_size, num_rx, num_rx_ant, num_ofdm_symbols,..
-        # ... fft_size]
-        #
-        # no can have shapes [], [batch_size], [batch_size, num_rx]
-        # or [batch_size, num_rx, num_rx_ant]
+        y, no = inputs #y: (64, 1, 16, 14, 76) complex64
+        y = to_numpy(y)
+        no = np.asarray(no, dtype=y.real.dtype)
 
         # Removed nulled subcarriers (guards, dc)
-        y_eff = self._removed_nulled_scs(y) #(2, 1, 16, 14, 64) complex64
+        y_eff = self._removed_nulled_scs(y) #(64, 1, 16, 14, 64)
 
         # Flatten the resource grid for pilot extraction
-        # New shape: [...,num_ofdm_symbols*num_effective_subcarriers]
-        y_eff_flat = flatten_last_dims(y_eff) #(2, 1, 16, 896)
-        # plt.figure()
-        # plt.plot(np.real(y_eff_flat[0,0,0,:]))
-        # plt.plot(np.imag(y_eff_flat[0,0,0,:]))
-        # plt.title('y_eff_flat')
+        y_eff_flat = flatten_last_dims(y_eff) #(64, 1, 16, 896)
 
         # Gather pilots along the last dimensions
-        # Resulting shape: y_eff_flat.shape[:-1] + pilot_ind.shape, i.e.:
-        # [batch_size, num_rx, num_rx_ant, num_tx, num_streams,...
-        #  ..., num_pilot_symbols]
-        #y_pilots = tf.gather(y_eff_flat, self._pilot_ind, axis=-1)
-        #y_pilots = y_eff_flat[self._pilot_ind] #(2, 1, 16, 896)
-        #y_pilots = np.take(y_eff_flat, self._pilot_ind, axis=-1) #y_eff_flat:(2, 1, 16, 896), _pilot_ind:(1, 2, 128) => y_pilots(2, 1, 16, 1, 2, 128)
-        # Gather elements from y_eff_flat based on pilot_ind
-        y_pilots = y_eff_flat[..., self._pilot_ind] #(2, 1, 16, 1, 2, 128)
+        # [batch_size, num_rx, num_rx_ant, num_tx, num_streams, num_pilot_symbols]
+        y_pilots = y_eff_flat[..., self._pilot_ind] #(64, 1, 16, 1, 2, 128)
+
+        h_hat, err_var = self.estimate_at_pilot_locations(y_pilots, no)
+        if self._debug:
+            np.save('data/y_eff_flat_np.npy', y_eff_flat)
+            np.save('data/pilot_ind_np.npy', self._pilot_ind)
+            np.save('data/h_hat_beforeinter_np.npy', h_hat)
 
-        # plt.figure()
-        # plt.plot(np.real(y_pilots[0,0,0,0,0,:]))
-        # plt.plot(np.imag(y_pilots[0,0,0,0,0,:]))
-        # plt.title('y_pilots')
-        # np.save('y_eff_flat.npy', y_eff_flat)
-        # np.save('pilot_ind.npy', self._pilot_ind)
-        # np.save('y_pilots.npy', y_pilots)
-
-        # Compute LS channel estimates
-        # Note: Some might be Inf because pilots=0, but we do not care
-        # as only the valid estimates will be considered during interpolation.
-        # We do a save division to replace Inf by 0.
-        # Broadcasting from pilots here is automatic since pilots have shape
-        # [num_tx, num_streams, num_pilot_symbols]
-        h_hat, err_var = self.estimate_at_pilot_locations(y_pilots, no) #y_pilots: (2, 1, 16, 1, 2, 128), h_hat:(2, 1, 16, 1, 2, 128)
-        #np.save('h_hat_pilot.npy', h_hat) #(2, 1, 16, 1, 2, 128)
         # Interpolate channel estimates over the resource grid
         if self._interpolation_type is not None:
-            h_hat, err_var = self._interpol(h_hat, err_var) #h_hat: (2, 1, 16, 1, 2, 128)=>
-            #np.save('h_hat_inter.npy', h_hat)
-            #err_var = tf.maximum(err_var, tf.cast(0, err_var.dtype))
+            h_hat, err_var = self._interpol(h_hat, err_var) #(64, 1, 16, 1, 2, 14, 64)
             err_var = np.maximum(err_var, 0)
+            if self._debug:
+                np.save('data/h_hat_inter_np.npy', h_hat)
+                np.save('data/err_var_inter_np.npy', err_var)
 
         return h_hat, err_var
 
@@ -632,13 +519,64 @@ def to_numpy(input_array):
     
     raise TypeError("Input type not supported. Please provide a NumPy array, TensorFlow tensor, or PyTorch tensor.")
 
+class CIRProvider():
+    #Channel impulse response source for Transmitter.get_channelcir
+    #source is a DataLoader (persistent iterator, restarted at the end of every epoch) or a callable returning (h_b, tau_b) such as the CDL generator
+    #with prefetch, the next batch is generated in a background thread while the current one is processed,
+    #that thread draws from the global random generators concurrently with the caller, so runs are no longer reproducible
+    def __init__(self, source, prefetch=False):
+        self.source = source
+        self.prefetch = prefetch
+        self.iterator = None
+        self.executor = None
+        self.pending = None
+
+    def _next(self):
+        if not isinstance(self.source, DataLoader):
+            return self.source()
+        if self.iterator is None:
+            self.iterator = iter(self.source)
+        try:
+            return next(self.iterator)
+        except StopIteration: #next epoch
+            self.iterator = iter(self.source)
+            return next(self.iterator)
+
+    def get(self):
+        if self.pending is not None:
+            h_b, tau_b = self.pending.result()
+            self.pending = None
+        else:
+            h_b, tau_b = self._next()
+        if self.prefetch:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=1) #one thread keeps the iterator and generator calls ordered
+            self.pending = self.executor.submit(self._next)
+        return h_b, tau_b
+
+    def reset(self):
+        #drop the prefetched batch and restart the epoch, e.g., after reseeding the random generators
+        if self.pending is not None:
+            self.pending.result()
+            self.pending = None
+        self.iterator = None
+
 class Transmitter():
     def __init__(self, channeldataset='deepmimo', channeltype="ofdm", scenario='O1_60', dataset_folder='data/DeepMIMO', \
                  direction="uplink", num_ut = 1, num_ut_ant=2, num_bs = 1, num_bs_ant=16,\
                  batch_size =64, fft_size = 76, num_ofdm_symbols=14, num_bits_per_symbol = 4,  \
                  subcarrier_spacing=15e3, num_guard_carriers=None, pilot_ofdm_symbol_indices=None, \
-                USE_LDPC = True, pilot_pattern = "kronecker", guards = True, showfig = True, savedata=True, outputpath=None) -> None:
+                USE_LDPC = True, pilot_pattern = "kronecker", guards = True, showfig = True, savedata=True, outputpath=None, cdl_backend='tf', \
+                cirbank=None, cirbank_size=10000, equalizer='lmmse') -> None:
                 #num_guard_carriers=[15,16]
+                #cdl_backend: 'tf' (sionna_tf_cdl) or 'numpy' (cdl_numpy, no TensorFlow, static terms cached)
+                #cirbank: folder of an offline CIR bank (cirbank.py), get_channelcir draws random batches from it,
+                #the bank is generated with cirbank_size examples of this channel configuration when the folder does not exist
+                #equalizer: 'lmmse', 'zf' or 'mrc' (equalizer_numpy), 'tf' for the TensorFlow MyLMMSEEqualizer
+        self.cdl_backend = cdl_backend
+        self.cirbank = cirbank
+        self.cirbank_size = cirbank_size
+        self.equalizer = equalizer
         self.channeltype = channeltype
         self.channeldataset = channeldataset
         self.fft_size = fft_size
@@ -785,6 +723,10 @@ class Transmitter():
         self.mydemapper = MyDemapper("app", constellation_type="qam", num_bits_per_symbol=num_bits_per_symbol)
 
         #Channel part
+        self.cirprovider = None #created by get_channelcir
+        self.cirprefetch = False #True generates the next CIR batch in the background (faster, but not deterministic)
+        self.cirbank_phase = False #CIR bank: random phase per drawn path
+        self.cirbank_doppler = 0. #CIR bank: max random Doppler shift [Hz] per drawn path
         if self.channeldataset=='deepmimo':
             self.create_DeepMIMOchanneldataset() #get self.data_loader
         elif self.channeldataset=='cdl':
@@ -815,10 +757,13 @@ class Transmitter():
         if self.pilot_pattern != "empty":
             self.remove_nulled_scs = RemoveNulledSubcarriers(self.RESOURCE_GRID)
             #ls_est = LSChannelEstimator(self.RESOURCE_GRID, interpolation_type="lin_time_avg")
-            self.ls_est = MyLSChannelEstimator(self.RESOURCE_GRID, interpolation_type="nn")#"lin_time_avg")
-            #self.ls_est = MyLSChannelEstimatorNP(self.RESOURCE_GRID, interpolation_type="nn")#"lin_time_avg")
+            #self.ls_est = MyLSChannelEstimator(self.RESOURCE_GRID, interpolation_type="nn")#"lin_time_avg")
+            self.ls_est = MyLSChannelEstimatorNP(self.RESOURCE_GRID, interpolation_type="nn")#"lin_time_avg")
             #lmmse_equ = LMMSEEqualizer(self.RESOURCE_GRID, self.STREAM_MANAGEMENT)
-            self.lmmse_equ = MyLMMSEEqualizer(self.RESOURCE_GRID, self.STREAM_MANAGEMENT)
+            if self.equalizer == 'tf':
+                self.lmmse_equ = MyLMMSEEqualizer(self.RESOURCE_GRID, self.STREAM_MANAGEMENT)
+            else:
+                self.lmmse_equ = OFDMEqualizer(self.equalizer, self.RESOURCE_GRID, self.STREAM_MANAGEMENT)
 
     def create_DeepMIMOchanneldataset(self):
         num_rx = self.num_rx
@@ -848,7 +793,9 @@ class Transmitter():
         #print(tau.shape) #[num_rx, num_tx, num_paths]
 
         # torch dataloaders
-        self.data_loader = DataLoader(dataset=self.deepmimodataset, batch_size=self.batch_size, shuffle=True, pin_memory=True)
+        #drop_last: the persistent iterator in get_channelcir cycles epochs, a short last batch would not match the batch size of b
+        self.data_loader = self.deepmimodataset.batch_loader(self.batch_size, shuffle=True, pin_memory=True, \
+                                                             drop_last=len(self.deepmimodataset) >= self.batch_size)
         if self.showfig:
             #self.plotchimpulse()
             h_b, tau_b = next(iter(self.data_loader)) #h_b: [64, 1, 1, 1, 16, 10, 1], tau_b=[64, 1, 1, 10]
@@ -872,7 +819,10 @@ class Transmitter():
         #     from sionna_tf_cdl import AntennaArray, CDL
         # except ImportError:
         #     pass
-        from sionna_tf_cdl import AntennaArray, CDL
+        if self.cdl_backend=='numpy':
+            from cdl_numpy import AntennaArray, CDL #same (h, delays) output as sionna_tf_cdl.CDL
+        else:
+            from sionna_tf_cdl import AntennaArray, CDL
         # Define the number of UT and BS antennas.
         # For the CDL model, a single UT and BS are supported.
         #The CDL model only works for systems with a single transmitter and a single receiver. The transmitter and receiver can be equipped with multiple antennas.
@@ -923,9 +873,10 @@ class Transmitter():
     def get_channelcir(self,returnformat='numpy'):
         if self.channeldataset=='deepmimo':
             #https://github.com/DeepMIMO/DeepMIMO-python/blob/master/src/DeepMIMOv3/sionna_adapter.py
-            h_b, tau_b = next(iter(self.data_loader)) #h_b: [64, 1, 1, 1, 16, 10, 1], tau_b=[64, 1, 1, 10]
             num_time_steps = self.deepmimodataset.num_time_steps #1
             sampling_frequency=1/self.RESOURCE_GRID.ofdm_symbol_duration
+            if self.cirprovider is None:
+                self.cirprovider = CIRProvider(self.data_loader, prefetch=self.cirprefetch)
         elif self.channeldataset=='cdl':
             if self.channeltype=='ofdm':
                 num_time_steps = self.RESOURCE_GRID.num_ofdm_symbols
@@ -933,7 +884,20 @@ class Transmitter():
             elif self.channeltype=='time':
                 num_time_steps = self.RESOURCE_GRID.num_time_samples+self.l_tot-1
                 sampling_frequency=self.RESOURCE_GRID.bandwidth
-            h_b, tau_b = self.cdl(batch_size=self.batch_size, num_time_steps=num_time_steps, sampling_frequency=sampling_frequency)
+            if self.cirprovider is None:
+                self.cirprovider = CIRProvider(partial(self.cdl, batch_size=self.batch_size, num_time_steps=num_time_steps, sampling_frequency=sampling_frequency), \
+                                               prefetch=self.cirprefetch)
+        if self.cirbank is not None and not isinstance(self.cirprovider.source, CIRBank):
+            #draw from the offline bank, it is generated from the channel source above on first use
+            num_samples = self.cirbank_size
+            if self.channeldataset=='deepmimo':
+                num_samples = min(num_samples, len(self.deepmimodataset)//self.batch_size*self.batch_size or len(self.deepmimodataset)) #one epoch at most
+            meta = {'channeldataset': self.channeldataset, 'num_time_steps': num_time_steps, 'sampling_frequency': sampling_frequency}
+            bank = open_cir_bank(self.cirbank, self.cirprovider.get, num_samples, meta=meta, batch_size=self.batch_size, \
+                                 random_phase=self.cirbank_phase, max_doppler=self.cirbank_doppler)
+            self.cirprovider.reset()
+            self.cirprovider = CIRProvider(bank, prefetch=self.cirprefetch)
+        h_b, tau_b = self.cirprovider.get() #h_b: [64, 1, 1, 1, 16, 10, 1], tau_b=[64, 1, 1, 10]
         self.num_time_steps = num_time_steps
         self.sampling_frequency = sampling_frequency
         # In CDL, Direction = "uplink" the UT is transmitting.
@@ -1502,8 +1466,8 @@ class Transmitter():
             x_hat, no_eff = self.lmmse_equ([y, h_hat, err_var, no]) 
             #Estimated symbols x_hat : [batch_size, num_tx, num_streams, num_data_symbols], tf.complex
             #Effective noise variance for each estimated symbol no_eff : [batch_size, num_tx, num_streams, num_data_symbols], tf.float
-            x_hat=x_hat.numpy() #x_hat: (2, 1, 2, 768), no_eff: (2, 1, 2, 768)
-            no_eff=no_eff.numpy() 
+            x_hat=to_numpy(x_hat) #x_hat: (2, 1, 2, 768), no_eff: (2, 1, 2, 768)
+            no_eff=to_numpy(no_eff) 
             no_eff=np.mean(no_eff)
 
         return x_hat, no_eff, h_hat, err_var, h_perfect, err_var_perfect
@@ -1560,8 +1524,8 @@ class Transmitter():
             x_hat, no_eff = self.lmmse_equ([y, h_hat, err_var, no]) 
             #Estimated symbols x_hat : [batch_size, num_tx, num_streams, num_data_symbols], tf.complex
             #Effective noise variance for each estimated symbol no_eff : [batch_size, num_tx, num_streams, num_data_symbols], tf.float
-            x_hat=x_hat.numpy() #x_hat: (2, 1, 2, 768), no_eff: (2, 1, 2, 768)
-            no_eff=no_eff.numpy() 
+            x_hat=to_numpy(x_hat) #x_hat: (2, 1, 2, 768), no_eff: (2, 1, 2, 768)
+            no_eff=to_numpy(no_eff) 
             no_eff=np.mean(no_eff)
 
             llr_est = self.mydemapper([x_hat, no_eff]) #(2, 1, 2, 3072)
@@ -1627,7 +1591,13 @@ class Transmitter():
             saved_data['b_hat']=b_hat
             saved_data['llr_est']=llr_est
             saved_data['BER']=BER
-            np.save(datapath, saved_data)
+            if datapath.endswith('.npy'):
+                np.save(datapath, saved_data)
+            else: #sharded store folder, every call appends one batch of samples
+                sample_keys = ['h_b', 'tau_b', 'h_out', 'y', 'x_rg', 'x', 'b', 'x_hat', 'h_hat', 'h_perfect', 'b_hat', 'llr_est']
+                if np.ndim(no_eff) > 0 and np.shape(no_eff)[0] == self.batch_size:
+                    sample_keys.append('no_eff')
+                save_dict(datapath, saved_data, sample_keys)
             #np.load d2.item() to retrieve the actual dict object first:
         return b_hat, BER
     
@@ -1752,9 +1722,9 @@ def sim_bersingle(channeldataset='cdl', channeltype='time'):
 
     b_hat, BER = eval_transceiver(ebno_db = 25.0, perfect_csi=False)
     
-    bers, blers, BERs = sim_ber(ebno_dbs, eval_transceiver, b, BATCH_SIZE)
-    #ber_plot_single(ebno_dbs, bers, title = "BER Simulation", savefigpath='./data/bernew.jpg')
     figpath = './data/'+channeldataset+'_'+channeltype
+    bers, blers, BERs = sim_ber(ebno_dbs, eval_transceiver, b, BATCH_SIZE, max_mc_iter=100, num_target_block_errors=100, csvpath=figpath+'_ber.csv')
+    #ber_plot_single(ebno_dbs, bers, title = "BER Simulation", savefigpath='./data/bernew.jpg')
     ber_plot_single2(ebno_dbs=ebno_dbs, bers=bers, is_bler = False, title = "BER Simulation", savefigpath=figpath+'_ber.pdf')
     ber_plot_single2(ebno_dbs=ebno_dbs, bers=blers, is_bler = True, title = "BER Simulation", savefigpath=figpath+'_ber.pdf')
 
@@ -1880,13 +1850,41 @@ def sim_bersingle2(channeldataset='deepmimo', channeltype='ofdm', NUM_BITS_PER_S
 
     b_hat, BER = eval_transceiver(ebno_db = 25.0, perfect_csi=False, datapath=datapath+"_ebno25.npy")
     
-    bers, blers, BERs = sim_ber(ebno_dbs, eval_transceiver, b, BATCH_SIZE)
+    bers, blers, BERs = sim_ber(ebno_dbs, eval_transceiver, b, BATCH_SIZE, max_mc_iter=100, num_target_block_errors=100, csvpath=datapath+'_ber.csv')
     #ber_plot_single(ebno_dbs, bers, title = "BER Simulation", savefigpath='./data/bernew.jpg')
     ber_plot_single2(ebno_dbs, bers, is_bler= False, title = "BER Simulation", savefigpath=datapath+'_ber.pdf')
     ber_plot_single2(ebno_dbs, blers, is_bler=True, title = "BLER Simulation", savefigpath=datapath+'_blers.pdf')
     return bers, blers, BERs
 
 
+#Parallel SNR sweep: the (ebno_db, channeldataset, channeltype, perfect_csi, seed) jobs of all configurations run in one process pool,
+#every worker process builds one Transmitter per configuration (TransceiverRunner cache) under the base seed and reuses it.
+#All random generators are reseeded per job, so the numbers do not depend on which process ran the job, and num_workers=0
+#reproduces the pool results.
+def sweep_snr(ebno_dbs, channeldatasets=('cdl',), channeltypes=('ofdm',), perfect_csis=(False,), seed=0, num_workers=0, max_inflight=None, \
+              num_threads=1, max_mc_iter=1, num_target_bit_errors=None, num_target_block_errors=None, early_stop=False, csvpath=None, **transmitter_kwargs):
+    #returns one row (dict) per (channeldataset, channeltype, perfect_csi, ebno_db), in that order; transmitter_kwargs go to Transmitter (batch_size, num_bs_ant, ...)
+    #max_inflight caps the submitted jobs (batches held in memory), defaults to 2*num_workers
+    assert max_mc_iter >= 1, "max_mc_iter must be at least 1"
+    transmitter_kwargs.setdefault('showfig', False)
+    transmitter_kwargs.setdefault('savedata', False)
+    jobs = []
+    run = 0
+    for channeldataset in channeldatasets:
+        for channeltype in channeltypes:
+            kwargs = dict(transmitter_kwargs, channeldataset=channeldataset, channeltype=channeltype)
+            transmitter = TransceiverRunner(Transmitter, kwargs, build_seed=seed).build() #for the bit shape, the workers build their own copy
+            b = BinarySource(seed=seed)([transmitter.batch_size, 1, transmitter.num_streams_per_tx, transmitter.k])
+            for perfect_csi in perfect_csis:
+                runner = TransceiverRunner(Transmitter, kwargs, build_seed=seed, perfect_csi=perfect_csi)
+                tags = {'channeldataset': channeldataset, 'channeltype': channeltype, 'perfect_csi': perfect_csi}
+                #job seeds only depend on the base seed and the position of the job
+                seeds = np.random.SeedSequence([seed, run]).spawn(len(ebno_dbs))
+                jobs += [(tags, runner, float(ebno_db), b, max_mc_iter, num_target_bit_errors, num_target_block_errors, seeds[i]) \
+                         for i, ebno_db in enumerate(ebno_dbs)]
+                run += 1
+    return run_mc_jobs(jobs, early_stop=early_stop, csvpath=csvpath, num_workers=num_workers, max_inflight=max_inflight, num_threads=num_threads)
+
 if __name__ == '__main__':
 
     #testOFDMModulatorDemodulator()
@@ -1909,6 +1907,12 @@ if __name__ == '__main__':
     bers, blers, BERs = sim_bersingle2(channeldataset='deepmimo', channeltype='time', NUM_BITS_PER_SYMBOL = 2, EBN0_DB_MIN = -5.0, EBN0_DB_MAX = 25.0, \
                    BATCH_SIZE = 32, NUM_UT = 1, NUM_BS = 1, NUM_UT_ANT = 1, NUM_BS_ANT = 16, showfigure = showfigure, datapathbase='data/')
     
+    sweeptest = False
+    if sweeptest is True:
+        rows = sweep_snr(np.linspace(-5.0, 25.0, 30), channeldatasets=('cdl', 'deepmimo'), channeltypes=('ofdm',), perfect_csis=(False, True), \
+                         seed=0, num_workers=4, csvpath='data/sweep_ber.csv', scenario=scenario, dataset_folder=dataset_folder, direction='uplink', \
+                         num_ut = 1, num_ut_ant=1, num_bs = 1, num_bs_ant=16, batch_size =128, fft_size = 76, num_ofdm_symbols=14, \
+                         num_bits_per_symbol = 2, subcarrier_spacing=60e3, USE_LDPC = False, pilot_pattern = "kronecker", guards=True)
     if cdltest is True:
         test_CDLchannel()
     if bertest is True:
@@ -6,6 +6,7 @@ matplotlib.use("TkAgg")
 import matplotlib.pyplot as plt
 from deepMIMO5 import hard_decisions, calculate_BER
 import random
+from datastore import ShardDataset, is_store
 
 IMG_FORMAT=".pdf" #".png"
 
@@ -45,8 +46,15 @@ class OFDMDataset(Dataset):
         # in case SDR not available, for channel simulation
         self.ch_SINR_min = ch_SINR_min # channel emulation min SINR
         self.ch_SINR_max = ch_SINR_max # channel emulation max SINR
-        saved_data = np.load(datapath, allow_pickle=True)
-        saved_data = saved_data.item()
+        self.store = None
+        if is_store(datapath): #sharded store folder, samples are read from memory mapped shards in __getitem__
+            self.store = ShardDataset(datapath)
+            saved_data = dict(self.store.meta)
+            for key in self.store.keys: #the full arrays are only needed by the testing checks
+                saved_data[key] = self.store.array(key) if testing else None
+        else:
+            saved_data = np.load(datapath, allow_pickle=True)
+            saved_data = saved_data.item()
         # for k, v in saved_data.items():
         #     if isinstance(v, np.ndarray):
         #         print(f"{k}'s shape: {v.shape}")
@@ -57,6 +65,7 @@ class OFDMDataset(Dataset):
         self.channeldataset = saved_data['channeldataset'] #cdl
         self.fft_size = saved_data['fft_size'] #76
         self.batch_size = saved_data['batch_size']
+        self.num_samples = len(self.store) if self.store is not None else self.batch_size
         self.num_ofdm_symbols = saved_data['num_ofdm_symbols'] #14
         self.num_bits_per_symbol = saved_data['num_bits_per_symbol'] #2
         self.num_ut = saved_data['num_ut'] #1
@@ -145,20 +154,22 @@ class OFDMDataset(Dataset):
         rx_antenna_id=0
         returnbatch=False
 
-        if self.training:
+        self.TTI_mask_indices = np.where(self.TTI_mask_RE==1)
+        if self.training and self.store is None:
             data = self.b[:,tx_id, tx_streams_id, :] #[batch_size, num_tx, num_streams_per_tx, num_data_bits] #[self.batch_size, 1, self.num_streams_per_tx, self.k]
             #(128, 1, 2, 1536)=>(128, 1536) [batch_size, num_data_bits]
             self.labels_data = data.reshape(-1, self.effectiveofdmsymbols, self.effectivesubcarrier, self.num_bits_per_symbol) #(128, 12, 64, 2)
             #(128, 12, 64, 2)
             #labelsize = (self.num_ofdm_symbols, self.fft_size, self.num_bits_per_symbol) #14, 76, 2
         #(128, 1, 16, 14, 76) [batch size, num_rx, num_rx_ant, num_ofdm_symbols, fft_size]
-        rx_samples = self.y[:,rx_id, rx_antenna_id, :, :] #(128, 1, 16, 14, 76)=>(128, 14, 76) [batch_size, num_ofdm_symbols, fft_size]
+        if self.store is None:
+            rx_samples = self.y[:,rx_id, rx_antenna_id, :, :] #(128, 1, 16, 14, 76)=>(128, 14, 76) [batch_size, num_ofdm_symbols, fft_size]
 
-        #self.TTI_mask_RE #(14, 76)
-        TTI_mask_indices = np.where(self.TTI_mask_RE==1)
-        rx_samples_eff = rx_samples[:, TTI_mask_indices[0], TTI_mask_indices[1]]
-        #print(rx_samples_eff.shape) #(128, 768)
-        self.rx_samples_eff= rx_samples_eff.reshape(-1, self.effectiveofdmsymbols, self.effectivesubcarrier) #(128, 12, 64)
+            #self.TTI_mask_RE #(14, 76)
+            TTI_mask_indices = self.TTI_mask_indices
+            rx_samples_eff = rx_samples[:, TTI_mask_indices[0], TTI_mask_indices[1]]
+            #print(rx_samples_eff.shape) #(128, 768)
+            self.rx_samples_eff= rx_samples_eff.reshape(-1, self.effectiveofdmsymbols, self.effectivesubcarrier) #(128, 12, 64)
 
         if testing:
             from deepMIMO5 import StreamManagement, MyResourceGrid, MyResourceGridMapper, MyDemapper, RemoveNulledSubcarriers
@@ -506,12 +517,25 @@ class OFDMDataset(Dataset):
     def __len__(self):
         return self.maxdatalen
     
+    def readsample(self, index, rx_id=0, tx_id=0, tx_streams_id=0, rx_antenna_id=0):
+        #one sample from the sharded store, same layout as labels_data[index] and rx_samples_eff[index]
+        b = self.store.get('b', index) #(1, 2, 1536)
+        labels_data = b[tx_id, tx_streams_id].reshape(self.effectiveofdmsymbols, self.effectivesubcarrier, self.num_bits_per_symbol) #(12, 64, 2)
+        y = self.store.get('y', index) #(1, 16, 14, 76)
+        rx_samples_eff = y[rx_id, rx_antenna_id][self.TTI_mask_indices[0], self.TTI_mask_indices[1]]
+        rx_samples_eff = rx_samples_eff.reshape(self.effectiveofdmsymbols, self.effectivesubcarrier) #(12, 64)
+        return labels_data, rx_samples_eff
+
     def __getitem__(self, item_id=0):
         ch_SINR = int(random.uniform(self.ch_SINR_min, self.ch_SINR_max)) # SINR generation for adding noise to the channel
         
         batch={}
         returnbatch=False
-        if self.training:
+        if self.store is not None:
+            labels_data, rx_samples_eff = self.readsample(self.index)
+            if self.training:
+                batch['labels'] = labels_data
+        elif self.training:
             if returnbatch:
                 labels_data= self.labels_data #(128, 12, 64, 2)
             else:
@@ -520,7 +544,8 @@ class OFDMDataset(Dataset):
         if returnbatch:
             self.feature_2d_data = self.rx_samples_eff #(128, 12, 64)
         else:
-            rx_samples_eff = self.rx_samples_eff[self.index,:] #(12, 64)
+            if self.store is None:
+                rx_samples_eff = self.rx_samples_eff[self.index,:] #(12, 64)
             y_real = rx_samples_eff.real #(12, 64)
             y_imag = rx_samples_eff.imag #(12, 64)
             # Stack the tensors along a new dimension (axis 0)
@@ -534,7 +559,7 @@ class OFDMDataset(Dataset):
         feature_2d_data_noise = self.feature_2d_data + noise.astype(np.float32)
         
         batch['feature_2d'] = feature_2d_data_noise.astype(np.float32) #self.feature_2d_data
-        self.index = (self.index +1) % self.batch_size
+        self.index = (self.index +1) % self.num_samples
         return batch #'labels':(12, 64, 2) HWbits, 'feature_2d'(2, 12, 64) CHW
     
 def testdataset():
@@ -0,0 +1,355 @@
+#Numpy port of the 3GPP TR 38.901 CDL channel model in sionna_tf_cdl.py (no TensorFlow needed)
+#Everything that is fixed by (model, delay_spread, carrier_frequency, arrays, orientations, direction) is computed once in __init__:
+#the ray angles, the element field patterns in the GCS and the array phase offsets for every (zenith, azimuth) ray pair of a cluster.
+#A call then only draws the random coupling, the initial phases and the velocities, gathers the cached terms and sums the rays.
+#CDL(...)(batch_size, num_time_steps, sampling_frequency) returns the same (h, delays) as sionna_tf_cdl.CDL:
+#   h: [batch size, num_rx = 1, num_rx_ant, num_tx = 1, num_tx_ant, num_paths, num_time_steps], delays: [batch size, num_rx = 1, num_tx = 1, num_paths]
+import json
+from importlib.resources import files
+import numpy as np
+import matplotlib.pyplot as plt
+import cdlmodels
+
+PI = 3.141592653589793
+SPEED_OF_LIGHT = 299792458
+
+#Basis vector of offset angle from table 7.5-3 of TR38.901
+RAY_OFFSETS = np.array([0.0447, -0.0447, 0.1413, -0.1413, 0.2492, -0.2492, 0.3715, -0.3715, 0.5129, -0.5129,
+                        0.6797, -0.6797, 0.8844, -0.8844, 1.1481, -1.1481, 1.5195, -1.5195, 2.1551, -2.1551])
+
+class AntennaElement:
+    #pattern: "omni" or "38.901", slant_angle: polarization slant angle [radian]
+    def __init__(self, pattern, slant_angle=0.0):
+        assert pattern in ["omni", "38.901"], \
+            "The radiation_pattern must be one of [\"omni\", \"38.901\"]."
+        self._pattern = pattern
+        self._slant_angle = slant_angle
+
+    def radiation_pattern(self, theta, phi):
+        #theta: zenith wrapped within (0,pi), phi: azimuth wrapped within (-pi,pi) [radian]
+        if self._pattern == "omni":
+            return np.ones_like(theta)
+        #Table 7.3-1
+        theta_3db = phi_3db = 65/180*PI
+        a_max = sla_v = 30
+        g_e_max = 8
+        a_v = -np.minimum(12*((theta-PI/2)/theta_3db)**2, sla_v)
+        a_h = -np.minimum(12*(phi/phi_3db)**2, a_max)
+        a_db = -np.minimum(-(a_v + a_h), a_max) + g_e_max
+        return 10**(a_db/10)
+
+    def field(self, theta, phi):
+        #field pattern in the vertical and horizontal polarization (7.3-4/5)
+        a = np.sqrt(self.radiation_pattern(theta, phi))
+        return (a*np.cos(self._slant_angle), a*np.sin(self._slant_angle))
+
+    def show(self):
+        theta = np.linspace(0.0, PI, 361)
+        phi = np.linspace(-PI, PI, 361)
+        a_v = 10*np.log10(self.radiation_pattern(theta, np.zeros_like(theta)))
+        a_h = 10*np.log10(self.radiation_pattern(PI/2*np.ones_like(phi), phi))
+        fig = plt.figure()
+        plt.polar(theta, a_v)
+        fig.axes[0].set_theta_zero_location("N")
+        fig.axes[0].set_theta_direction(-1)
+        plt.title(r"Vertical cut of the radiation pattern ($\phi = 0 $) ")
+        plt.legend([f"{self._pattern}"])
+        fig = plt.figure()
+        plt.polar(phi, a_h)
+        fig.axes[0].set_theta_zero_location("E")
+        plt.title(r"Horizontal cut of the radiation pattern ($\theta = \pi/2$)")
+        plt.legend([f"{self._pattern}"])
+
+class PanelArray:
+    #same geometry, element indexing and arguments as sionna_tf_cdl.PanelArray (without dtype)
+    def __init__(self, num_rows_per_panel, num_cols_per_panel, polarization, polarization_type, antenna_pattern, carrier_frequency,
+                 num_rows=1, num_cols=1, panel_vertical_spacing=None, panel_horizontal_spacing=None,
+                 element_vertical_spacing=None, element_horizontal_spacing=None):
+        assert polarization in ('single', 'dual'), \
+            "polarization must be either 'single' or 'dual'"
+        if element_vertical_spacing is None:
+            element_vertical_spacing = 0.5
+        if element_horizontal_spacing is None:
+            element_horizontal_spacing = 0.5
+        if panel_vertical_spacing is None:
+            panel_vertical_spacing = (num_rows_per_panel-1)*element_vertical_spacing+0.5
+        if panel_horizontal_spacing is None:
+            panel_horizontal_spacing = (num_cols_per_panel-1)*element_horizontal_spacing+0.5
+        assert panel_horizontal_spacing > (num_cols_per_panel-1)*element_horizontal_spacing, \
+            "Pannel horizontal spacing must be larger than the panel width"
+        assert panel_vertical_spacing > (num_rows_per_panel-1)*element_vertical_spacing, \
+            "Pannel vertical spacing must be larger than panel height"
+        self.polarization = polarization
+        self.polarization_type = polarization_type
+        p = 1 if polarization == 'single' else 2
+        num_panels = num_cols*num_rows
+        num_panel_ant = num_cols_per_panel*num_rows_per_panel*p
+        self.num_ant = num_panels*num_panel_ant
+        lambda_0 = SPEED_OF_LIGHT/carrier_frequency
+
+        if polarization == 'single':
+            assert polarization_type in ["V", "H"], \
+                "For single polarization, polarization_type must be 'V' or 'H'"
+            slant_angle = 0 if polarization_type == "V" else PI/2
+            self.ant_pol1 = AntennaElement(antenna_pattern, slant_angle)
+        else:
+            assert polarization_type in ["VH", "cross"], \
+                "For dual polarization, polarization_type must be 'VH' or 'cross'"
+            slant_angle = 0 if polarization_type == "VH" else -PI/4
+            self.ant_pol1 = AntennaElement(antenna_pattern, slant_angle)
+            self.ant_pol2 = AntennaElement(antenna_pattern, slant_angle+PI/2)
+
+        #elements of one panel on the y-z-plane, centered around the origin (AntennaPanel)
+        pos = np.zeros([num_panel_ant, 3])
+        for i in range(num_rows_per_panel):
+            for j in range(num_cols_per_panel):
+                pos[i+j*num_rows_per_panel] = [0, j*element_horizontal_spacing, -i*element_vertical_spacing]
+        pos += [0, -(num_cols_per_panel-1)*element_horizontal_spacing/2, (num_rows_per_panel-1)*element_vertical_spacing/2]
+        if polarization == 'dual':
+            pos[num_rows_per_panel*num_cols_per_panel:] = pos[:num_rows_per_panel*num_cols_per_panel]
+        #place the panels
+        ant_pos = np.zeros([self.num_ant, 3])
+        count = 0
+        for j in range(num_cols):
+            for i in range(num_rows):
+                ant_pos[count*num_panel_ant:(count+1)*num_panel_ant] = pos + [0, j*panel_horizontal_spacing, -i*panel_vertical_spacing]
+                count += 1
+        ant_pos += [0, -(num_cols-1)*panel_horizontal_spacing/2, (num_rows-1)*panel_vertical_spacing/2]
+        self.ant_pos = ant_pos*lambda_0
+
+        ind = np.reshape(np.arange(0, self.num_ant), [num_panels*p, -1])
+        self.ant_ind_pol1 = np.reshape(ind[::p], [-1])
+        if polarization == 'single':
+            self.ant_ind_pol2 = np.array([], np.int64)
+        else:
+            self.ant_ind_pol2 = np.reshape(ind[1:num_panels*p:2], [-1])
+
+    def show(self):
+        fig = plt.figure()
+        pos_pol1 = self.ant_pos[self.ant_ind_pol1]
+        plt.plot(pos_pol1[:,1], pos_pol1[:,2], marker="|", markeredgecolor='red',
+                 markersize="20", linestyle="None", markeredgewidth="2")
+        for i, p in enumerate(pos_pol1):
+            fig.axes[0].annotate(self.ant_ind_pol1[i]+1, (p[1], p[2]))
+        if self.polarization == 'dual':
+            pos_pol2 = self.ant_pos[self.ant_ind_pol2]
+            plt.plot(pos_pol2[:,1], pos_pol2[:,2], marker="_", markeredgecolor='black',
+                     markersize="20", linestyle="None", markeredgewidth="1")
+        plt.xlabel("y (m)")
+        plt.ylabel("z (m)")
+        plt.title("Panel Array")
+        plt.legend(["Polarization 1", "Polarization 2"], loc="upper right")
+
+    def show_element_radiation_pattern(self):
+        self.ant_pol1.show()
+
+class AntennaArray(PanelArray):
+    #single panel array, same arguments as sionna_tf_cdl.AntennaArray (without dtype)
+    def __init__(self, num_rows, num_cols, polarization, polarization_type, antenna_pattern, carrier_frequency,
+                 vertical_spacing=None, horizontal_spacing=None):
+        super().__init__(num_rows_per_panel=num_rows, num_cols_per_panel=num_cols, polarization=polarization,
+                         polarization_type=polarization_type, antenna_pattern=antenna_pattern, carrier_frequency=carrier_frequency,
+                         element_vertical_spacing=vertical_spacing, element_horizontal_spacing=horizontal_spacing)
+
+def _unit_sphere_vector(theta, phi):
+    #(7.1-6), [..., 3]
+    theta, phi = np.broadcast_arrays(theta, phi)
+    return np.stack([np.sin(theta)*np.cos(phi), np.sin(theta)*np.sin(phi), np.cos(theta)], axis=-1)
+
+def _rotation_matrix(orientation):
+    #forward composite rotation matrix (7.1-4), orientation: [3] (alpha, beta, gamma) [radian]
+    a, b, c = orientation
+    return np.array([[np.cos(a)*np.cos(b), np.cos(a)*np.sin(b)*np.sin(c)-np.sin(a)*np.cos(c), np.cos(a)*np.sin(b)*np.cos(c)+np.sin(a)*np.sin(c)],
+                     [np.sin(a)*np.cos(b), np.sin(a)*np.sin(b)*np.sin(c)+np.cos(a)*np.cos(c), np.sin(a)*np.sin(b)*np.cos(c)-np.cos(a)*np.sin(c)],
+                     [-np.sin(b), np.cos(b)*np.sin(c), np.cos(b)*np.cos(c)]])
+
+def _array_response(array, orientation, theta, phi, lambda_0):
+    #field of every element in the GCS times its phase offset, for rays leaving/arriving at (theta, phi) [radian]
+    #output: [..., num_ant, 2] complex, last dimension is (theta, phi) field component
+    rot = _rotation_matrix(orientation)
+    #angles in the LCS (7.1-7/8)
+    rho = _unit_sphere_vector(theta, phi) @ rot #rot^T @ rho for every ray
+    theta_prime = np.arccos(np.clip(rho[...,2], -1., 1.))
+    phi_prime = np.angle(rho[...,0]+1j*rho[...,1])
+    #LCS to GCS field transformation (7.1-11/15)
+    a, b, c = orientation
+    real = np.sin(c)*np.cos(theta)*np.sin(phi-a) + np.cos(c)*(np.cos(b)*np.sin(theta)-np.sin(b)*np.cos(theta)*np.cos(phi-a))
+    imag = np.sin(c)*np.cos(phi-a) + np.sin(b)*np.cos(c)*np.sin(phi-a)
+    psi = np.angle(real+1j*imag)
+    def gcs_field(element):
+        #also accepts the elements of sionna_tf_cdl arrays
+        f_theta, f_phi = AntennaElement(element._pattern, float(element._slant_angle)).field(theta_prime, phi_prime)
+        return np.stack([np.cos(psi)*f_theta-np.sin(psi)*f_phi, np.sin(psi)*f_theta+np.cos(psi)*f_phi], axis=-1)
+    num_ant = int(array.num_ant)
+    fields = np.repeat(gcs_field(array.ant_pol1)[...,None,:], num_ant, axis=-2) #[..., num_ant, 2]
+    if array.polarization == 'dual':
+        fields[...,np.asarray(array.ant_ind_pol2),:] = gcs_field(array.ant_pol2)[...,None,:]
+    #phase offsets between the elements (7.5-22)
+    ant_pos = np.asarray(array.ant_pos, np.float64) @ rot.T #[num_ant, 3] in the GCS
+    offsets = np.exp(1j*2*PI/lambda_0*(_unit_sphere_vector(theta, phi) @ ant_pos.T)) #[..., num_ant]
+    return fields*offsets[...,None]
+
+class CDL:
+    #model: "A"-"E", delay_spread [s], carrier_frequency [Hz], ut_array/bs_array: PanelArray from this module or from sionna_tf_cdl,
+    #direction: "uplink" or "downlink", orientations [radian], speeds [m/s]
+    #seed: None draws from the global np.random state (seeded by seed_everything), otherwise a private Generator
+    #memory_budget: approximate number of bytes for the per call temporaries, the batch is processed in chunks that fit into it
+    NUM_RAYS = 20
+
+    def __init__(self, model, delay_spread, carrier_frequency, ut_array, bs_array, direction,
+                 ut_orientation=None, bs_orientation=None, min_speed=0., max_speed=None,
+                 dtype=np.complex64, seed=None, memory_budget=2**28):
+        assert direction in ('uplink', 'downlink'), "Invalid link direction"
+        assert model in ("A", "B", "C", "D", "E"), "Invalid CDL model"
+        self._dtype = np.dtype(dtype)
+        self._real_dtype = np.finfo(self._dtype).dtype
+        self._direction = direction
+        self._delay_spread = delay_spread
+        self._min_speed = min_speed
+        if max_speed is None:
+            self._max_speed = min_speed
+        else:
+            assert max_speed >= min_speed, \
+                "min_speed cannot be larger than max_speed"
+            self._max_speed = max_speed
+        self._rng = np.random if seed is None else np.random.default_rng(seed)
+        self.memory_budget = memory_budget
+        ut_orientation = np.array([PI, 0.0, 0.0]) if ut_orientation is None else np.asarray(ut_orientation, np.float64)
+        bs_orientation = np.zeros([3]) if bs_orientation is None else np.asarray(bs_orientation, np.float64)
+        if direction == 'downlink':
+            tx_array, rx_array = bs_array, ut_array
+            tx_orientation, rx_orientation = bs_orientation, ut_orientation
+        else:
+            tx_array, rx_array = ut_array, bs_array
+            tx_orientation, rx_orientation = ut_orientation, bs_orientation
+        self._num_tx_ant = int(tx_array.num_ant)
+        self._num_rx_ant = int(rx_array.num_ant)
+        lambda_0 = SPEED_OF_LIGHT/carrier_frequency
+
+        with open(files(cdlmodels).joinpath(f"CDL-{model}.json")) as parameter_file:
+            params = json.load(parameter_file)
+        self._los = bool(params['los'])
+        delays = np.array(params['delays'], np.float64)
+        powers = np.power(10.0, np.array(params['powers'])/10.0)
+        powers = powers/np.sum(powers)
+        angles = {key: np.array(params[key], np.float64) for key in ('aod', 'aoa', 'zod', 'zoa')}
+        spreads = {'aod': params['cASD'], 'aoa': params['cASA'], 'zod': params['cZSD'], 'zoa': params['cZSA']}
+        if self._los:
+            #the specular component is added separately, the NLoS powers are renormalized and K = specular/NLoS power (7.7.6)
+            los_angles = {key: np.deg2rad(value[0]) for key, value in angles.items()}
+            angles = {key: value[1:] for key, value in angles.items()}
+            los_power = powers[0]
+            delays = delays[1:]
+            powers = powers[1:]
+            norm_fact = np.sum(powers)
+            powers = powers/norm_fact
+            self._k_factor = los_power/norm_fact
+        #rays of every cluster (7.7-0a) [num clusters, num rays]
+        rays = {key: np.deg2rad(value[:,None] + spreads[key]*RAY_OFFSETS[None,:]) for key, value in angles.items()}
+        if direction == 'uplink':
+            #the tables are given for the downlink
+            rays = {'aoa': rays['aod'], 'zoa': rays['zod'], 'aod': rays['aoa'], 'zod': rays['zoa']}
+            if self._los:
+                los_angles = {'aoa': los_angles['aod'], 'zoa': los_angles['zod'], 'aod': los_angles['aoa'], 'zod': los_angles['zoa']}
+
+        #the generator returns the paths sorted by delay, the order is the same for every batch
+        order = np.argsort(delays, kind='stable')
+        rays = {key: value[order] for key, value in rays.items()}
+        self._num_clusters = len(delays)
+        self._delays = (delays[order]*delay_spread).astype(self._real_dtype)
+        self._powers = powers[order]
+        self._power_scaling = np.sqrt(self._powers/CDL.NUM_RAYS) #[num clusters]
+        xpr = np.power(10.0, params['xpr']/10.0)
+        self._xpr_scaling = np.sqrt(1/xpr)
+
+        #static terms for every (zenith ray, azimuth ray) pair of a cluster, the random coupling only picks one pair per ray
+        #[num clusters, num rays (zenith), num rays (azimuth), num ant, 2]
+        self._rx_response = _array_response(rx_array, rx_orientation, rays['zoa'][:,:,None], rays['aoa'][:,None,:], lambda_0).astype(self._dtype)
+        self._tx_response = _array_response(tx_array, tx_orientation, rays['zod'][:,:,None], rays['aod'][:,None,:], lambda_0).astype(self._dtype)
+        #Doppler: 2*pi/lambda_0 * unit vector of arrival, multiplied with the velocity per batch [num clusters, num rays, num rays, 3]
+        self._rx_doppler = (2*PI/lambda_0*_unit_sphere_vector(rays['zoa'][:,:,None], rays['aoa'][:,None,:])).astype(self._real_dtype)
+        if self._los:
+            #LoS path (7.5-29) with the fixed polarization matrix [[1,0],[0,-1]], distance_3d=0 so there is no extra delay phase
+            rx = _array_response(rx_array, rx_orientation, los_angles['zoa'], los_angles['aoa'], lambda_0)
+            tx = _array_response(tx_array, tx_orientation, los_angles['zod'], los_angles['aod'], lambda_0)
+            h_los = rx @ np.diag([1., -1.]) @ tx.T #[num rx ant, num tx ant]
+            self._h_los = (np.sqrt(self._k_factor/(self._k_factor+1))*h_los).astype(self._dtype)
+            self._los_doppler = (2*PI/lambda_0*_unit_sphere_vector(los_angles['zoa'], los_angles['aoa'])).astype(self._real_dtype)
+            self._nlos_scaling = np.sqrt(1/(self._k_factor+1))
+        else:
+            self._nlos_scaling = 1.
+
+    def _sample_velocities(self, batch_size):
+        v_r = self._rng.uniform(self._min_speed, self._max_speed, batch_size)
+        v_phi = self._rng.uniform(0.0, 2.*PI, batch_size)
+        v_theta = self._rng.uniform(0.0, PI, batch_size)
+        return np.stack([v_r*np.cos(v_phi)*np.sin(v_theta), v_r*np.sin(v_phi)*np.sin(v_theta), v_r*np.cos(v_theta)], axis=-1)
+
+    def _nlos(self, velocities, perm, phases, t):
+        #NLoS clusters (7.5-22/27) [batch, num clusters, num rx ant, num tx ant, num time steps]
+        batch_size, num_clusters, num_rays = phases.shape[:3]
+        cl = np.arange(num_clusters)[None,:,None]
+        rx = self._rx_response[cl, perm[2], perm[0]] #[batch, num clusters, num rays, num rx ant, 2]
+        tx = self._tx_response[cl, perm[3], perm[1]] #[batch, num clusters, num rays, num tx ant, 2]
+        phases = np.exp(1j*phases).astype(self._dtype)
+        phases[...,1:3] *= self._xpr_scaling
+        phases = phases.reshape(batch_size, num_clusters, num_rays, 2, 2)
+        #F_rx^T @ phase matrix @ F_tx for every antenna pair, scaled by the cluster power
+        h_rays = rx @ (phases @ np.swapaxes(tx, -1, -2)) #[batch, num clusters, num rays, num rx ant, num tx ant]
+        h_rays *= (self._nlos_scaling*self._power_scaling).astype(self._real_dtype)[None,:,None,None,None]
+        #Doppler of every ray
+        doppler = self._rx_doppler[cl, perm[2], perm[0]] @ velocities.astype(self._real_dtype)[:,None,:,None] #[batch, num clusters, num rays, 1]
+        doppler = np.exp(1j*(doppler*t)).astype(self._dtype) #[batch, num clusters, num rays, num time steps]
+        #sum over the rays
+        h_rays = h_rays.reshape(batch_size, num_clusters, num_rays, -1)
+        h = np.swapaxes(h_rays, -1, -2) @ doppler #[batch, num clusters, num rx ant*num tx ant, num time steps]
+        return h.reshape(batch_size, num_clusters, self._num_rx_ant, self._num_tx_ant, -1)
+
+    def __call__(self, batch_size, num_time_steps, sampling_frequency):
+        t = (np.arange(num_time_steps)/sampling_frequency).astype(self._real_dtype)
+        #all random draws up front, the result does not depend on the chunking
+        velocities = self._sample_velocities(batch_size)
+        #random coupling (step 8): shuffle the rays of every cluster for aoa, aod, zoa and zod independently
+        perm = np.argsort(self._rng.normal(size=(4, batch_size, self._num_clusters, CDL.NUM_RAYS)), axis=-1)
+        #random initial phases for the four polarization combinations (step 10)
+        phases = self._rng.uniform(-PI, PI, (batch_size, self._num_clusters, CDL.NUM_RAYS, 4))
+        h = np.empty([batch_size, self._num_clusters, self._num_rx_ant, self._num_tx_ant, num_time_steps], self._dtype)
+        #bytes per batch example: gathered terms and Doppler of every ray plus the output
+        itemsize = self._dtype.itemsize
+        per_example = itemsize*self._num_clusters*(CDL.NUM_RAYS*(num_time_steps+2*(self._num_rx_ant+self._num_tx_ant)+self._num_rx_ant*self._num_tx_ant)
+                                                   + self._num_rx_ant*self._num_tx_ant*num_time_steps)
+        chunk = max(1, int(self.memory_budget//per_example))
+        for start in range(0, batch_size, chunk):
+            h[start:start+chunk] = self._nlos(velocities[start:start+chunk], perm[:,start:start+chunk], phases[start:start+chunk], t)
+        if self._los:
+            #specular component added to the first (zero delay) cluster (7.5-30)
+            doppler = np.exp(1j*((velocities.astype(self._real_dtype) @ self._los_doppler)[:,None]*t)).astype(self._dtype) #[batch, num time steps]
+            h[:,0] += self._h_los[None,:,:,None]*doppler[:,None,None,:]
+        #[batch, num_rx = 1, num_rx_ant, num_tx = 1, num_tx_ant, num_paths, num_time_steps]
+        h = np.ascontiguousarray(np.transpose(h, [0, 2, 3, 1, 4]))[:,None,:,None]
+        delays = np.tile(self._delays, [batch_size, 1, 1, 1])
+        return h, delays
+
+    @property
+    def num_clusters(self):
+        return self._num_clusters
+
+    @property
+    def los(self):
+        return self._los
+
+    @property
+    def delays(self):
+        return self._delays
+
+    @property
+    def powers(self):
+        if self._los:
+            powers = self._powers.copy()
+            powers[0] += self._k_factor
+            return powers/(self._k_factor+1.)
+        return self._powers
+
+    @property
+    def delay_spread(self):
+        return self._delay_spread
@@ -1226,7 +1226,7 @@ class BaseChannelInterpolator(ABC):
 
 class NearestNeighborInterpolator(BaseChannelInterpolator):
     # pylint: disable=line-too-long
-    r"""NearestNeighborInterpolator(pilot_pattern)
+    r"""NearestNeighborInterpolator(pilot_pattern, debug=False)
 
     Nearest-neighbor channel estimate interpolation on a resource grid.
 
@@ -1248,6 +1248,10 @@ class NearestNeighborInterpolator(BaseChannelInterpolator):
     pilot_pattern : PilotPattern
         An instance of :class:`~sionna.ofdm.PilotPattern`
 
+    debug : bool
+        Save the interpolation inputs and outputs on every call.
+        Defaults to `False`.
+
     Input
     -----
     h_hat : [batch_size, num_rx, num_rx_ant, num_tx, num_streams_per_tx, num_pilot_symbols], tf.complex
@@ -1266,8 +1270,9 @@ class NearestNeighborInterpolator(BaseChannelInterpolator):
         Channel estimation error variances accross the entire resource grid
         for all transmitters and streams
     """
-    def __init__(self, pilot_pattern):
+    def __init__(self, pilot_pattern, debug=False):
         super().__init__()
+        self._debug = debug
 
         assert(pilot_pattern.num_pilot_symbols>0),\
             """The pilot pattern cannot be empty"""
@@ -1320,12 +1325,14 @@ class NearestNeighborInterpolator(BaseChannelInterpolator):
         # [num_tx, num_streams_per_tx, num_pilots, k, l, m]
         perm = tf.roll(tf.range(tf.rank(inputs)), -3, 0) #[3, 4, 5, 0, 1, 2]
         inputs = tf.transpose(inputs, perm) #(1, 2, 128, 2, 1, 16)
-        np.save('inputs_inter_tf.npy', inputs.numpy())
+        if self._debug:
+            np.save('inputs_inter_tf.npy', inputs.numpy())
         # Interpolate through gather. Shape:
         # [num_tx, num_streams_per_tx, num_ofdm_symbols,
         #  ..., num_effective_subcarriers, k, l, m]
         outputs = tf.gather(inputs, self._gather_ind, 2, batch_dims=2) #inputs: (1, 2, 128, 2, 1, 16) _gather_ind: (1, 2, 14, 64)
-        np.save('outputs_inter_tf.npy', outputs.numpy())
+        if self._debug:
+            np.save('outputs_inter_tf.npy', outputs.numpy())
         #outputs: (1, 2, 14, 64, 2, 1, 16)
         # Transpose outputs to bring batch_dims first again. New shape:
         # [k, l, m, num_tx, num_streams_per_tx,...
@@ -1963,7 +1970,7 @@ class LSChannelEstimator(BaseChannelEstimator, Layer):
 
 class MyLSChannelEstimator():
     # pylint: disable=line-too-long
-    r"""LSChannelEstimator(resource_grid, interpolation_type="nn", interpolator=None, dtype=tf.complex64, **kwargs)
+    r"""LSChannelEstimator(resource_grid, interpolation_type="nn", interpolator=None, dtype=tf.complex64, debug=False, **kwargs)
 
     Layer implementing least-squares (LS) channel estimation for OFDM MIMO systems.
 
@@ -2027,6 +2034,10 @@ class MyLSChannelEstimator():
         Datatype for internal calculations and the output dtype.
         Defaults to `tf.complex64`.
 
+    debug : bool
+        Print the pilot indices and save the intermediate arrays and a plot
+        of the pilot estimates to ``data/`` on every call. Defaults to `False`.
+
     Input
     -----
     (y, no) :
@@ -2049,12 +2060,13 @@ class MyLSChannelEstimator():
         for all transmitters and streams
     """
 
-    def __init__(self, resource_grid, interpolation_type="nn", interpolator=None, dtype=tf.complex64, **kwargs):
+    def __init__(self, resource_grid, interpolation_type="nn", interpolator=None, dtype=tf.complex64, debug=False, **kwargs):
         #super().__init__(dtype=dtype, **kwargs)
 
         # assert isinstance(resource_grid, ResourceGrid),\
         #     "You must provide a valid instance of ResourceGrid."
         self._pilot_pattern = resource_grid.pilot_pattern
+        self._debug = debug #save intermediate arrays to data/ on every call
 
         #added test code
         mask = np.array(self._pilot_pattern.mask) #(1, 2, 14, 64)
@@ -2078,7 +2090,7 @@ class MyLSChannelEstimator():
         "`interpolator` must implement the BaseChannelInterpolator interface"
             self._interpol = interpolator
         elif self._interpolation_type == "nn":
-            self._interpol = NearestNeighborInterpolator(self._pilot_pattern)
+            self._interpol = NearestNeighborInterpolator(self._pilot_pattern, debug=self._debug)
         elif self._interpolation_type == "lin":
             self._interpol = LinearInterpolator(self._pilot_pattern)
         elif self._interpolation_type == "lin_time_avg":
@@ -2092,7 +2104,8 @@ class MyLSChannelEstimator():
         pilot_ind = tf.argsort(mask, axis=-1, direction="DESCENDING") #(1, 2, 896)
         self._pilot_ind = pilot_ind[...,:num_pilot_symbols]
 
-        print(self._pilot_ind[0,0,:]) #(1, 2, 128) int32 only 128 pilots [128-191 704-767]
+        if self._debug:
+            print(self._pilot_ind[0,0,:]) #(1, 2, 128) int32 only 128 pilots [128-191 704-767]
 
 
     def estimate_at_pilot_locations(self, y_pilots, no):
@@ -2159,10 +2172,11 @@ class MyLSChannelEstimator():
         # plt.plot(np.real(y_pilots[0,0,0,0,0,:]))
         # plt.plot(np.imag(y_pilots[0,0,0,0,0,:]))
         # plt.title('y_pilots')
-        np.save('data/y_eff_tf2.npy', y_eff.numpy()) #(128, 1, 16, 14, 64)
-        np.save('data/y_eff_flat_tf2.npy', y_eff_flat.numpy()) #(128, 1, 16, 896)
-        np.save('data/pilot_ind_tf2.npy', self._pilot_ind) #(1, 2, 128)
-        np.save('data/y_pilots_tf2.npy', y_pilots.numpy()) #(128, 1, 16, 1, 2, 128)
+        if self._debug:
+            np.save('data/y_eff_tf2.npy', y_eff.numpy()) #(128, 1, 16, 14, 64)
+            np.save('data/y_eff_flat_tf2.npy', y_eff_flat.numpy()) #(128, 1, 16, 896)
+            np.save('data/pilot_ind_tf2.npy', self._pilot_ind) #(1, 2, 128)
+            np.save('data/y_pilots_tf2.npy', y_pilots.numpy()) #(128, 1, 16, 1, 2, 128)
 
         # Compute LS channel estimates
         # Note: Some might be Inf because pilots=0, but we do not care
@@ -2173,23 +2187,25 @@ class MyLSChannelEstimator():
         h_hat, err_var = self.estimate_at_pilot_locations(y_pilots, no)#h_hat: (2, 1, 16, 1, 2, 128), err_var: (1, 1, 1, 1, 2, 128)
         #np.save('h_hat_pilot_tf.npy', h_hat.numpy())
         #h_ls: (2, 1, 16, 1, 2, 128), err_var: (1, 1, 1, 1, 2, 128)
-        plt.figure()
-        plt.plot(np.real(h_hat[0,0,0,0,0,0:64]))
-        plt.plot(np.imag(h_hat[0,0,0,0,0,0:64]))
-        plt.plot(np.real(h_hat[0,0,0,0,0,64:128]),'--')
-        plt.plot(np.imag(h_hat[0,0,0,0,0,64:128]),'--')
-        plt.title('h_hat at_pilot')
-        plt.savefig('data/h_hat_at_pilot2.png')
-        np.save('data/h_hat_beforeinter2.npy', h_hat.numpy())
-        np.save('data/err_var_beforeinter2.npy', err_var.numpy())
+        if self._debug:
+            plt.figure()
+            plt.plot(np.real(h_hat[0,0,0,0,0,0:64]))
+            plt.plot(np.imag(h_hat[0,0,0,0,0,0:64]))
+            plt.plot(np.real(h_hat[0,0,0,0,0,64:128]),'--')
+            plt.plot(np.imag(h_hat[0,0,0,0,0,64:128]),'--')
+            plt.title('h_hat at_pilot')
+            plt.savefig('data/h_hat_at_pilot2.png')
+            plt.close()
+            np.save('data/h_hat_beforeinter2.npy', h_hat.numpy())
+            np.save('data/err_var_beforeinter2.npy', err_var.numpy())
 
         # Interpolate channel estimates over the resource grid
         if self._interpolation_type is not None:
             h_hat, err_var = self._interpol(h_hat, err_var) #h_hat: (2, 1, 16, 1, 2, 128)=>(2, 1, 16, 1, 2, 14, 64)
-            np.save('data/h_hat_inter2.npy', h_hat.numpy())
-            
             err_var = tf.maximum(err_var, tf.cast(0, err_var.dtype)) #(1, 1, 1, 1, 2, 14, 64)=>(1, 1, 1, 1, 2, 14, 64)
-            np.save('data/err_var_inter2.npy', err_var.numpy())
+            if self._debug:
+                np.save('data/h_hat_inter2.npy', h_hat.numpy())
+                np.save('data/err_var_inter2.npy', err_var.numpy())
 
         return h_hat, err_var
 
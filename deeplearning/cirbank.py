@@ -0,0 +1,91 @@
+#Offline channel impulse response bank
+#N realizations of (a, tau) of one channel configuration (CDL model, DeepMIMO scenario, ...) are generated once into a datastore folder
+#(memory-mapped .npy shards, see datastore.py), simulations then draw random batches from it instead of running the channel generator.
+#   a:   [N, num_rx, num_rx_ant, num_tx, num_tx_ant, num_paths, num_time_steps] complex
+#   tau: [N, num_rx, num_tx, num_paths] float
+#   meta: num_time_steps, sampling_frequency and whatever describes the configuration
+#CIRBank(...)() returns batches with the same (a, tau) contract as the CDL generator, CIRBank.generator feeds channel.CIRDataset.
+import numpy as np
+from datastore import ShardWriter, ShardDataset, is_store, read_index
+
+def build_cir_bank(folder, source, num_samples, meta=None, shard_size=1024):
+    #source: callable returning a batch (a, tau), e.g., partial(cdl, batch_size=..., num_time_steps=..., sampling_frequency=...)
+    #or CIRProvider(...).get; resumes a partly written bank in folder
+    with ShardWriter(folder, shard_size=shard_size, meta=meta, append=True) as writer:
+        while len(writer) < num_samples:
+            a, tau = source()
+            a, tau = np.asarray(a), np.asarray(tau)
+            n = min(len(a), num_samples-len(writer))
+            writer.add_batch(a=a[:n], tau=tau[:n])
+            print(f"CIR bank {folder}: {len(writer)}/{num_samples}")
+    return folder
+
+class CIRBank:
+    #batch_size: default batch size of __call__
+    #random_phase: rotate every path of every drawn example by a uniform random phase
+    #max_doppler: add a random Doppler shift, uniform in [-max_doppler, max_doppler] Hz, per example and path (needs sampling_frequency in meta)
+    #seed: None draws from the global np.random state (seeded by seed_everything), otherwise a private Generator
+    def __init__(self, folder, batch_size=64, random_phase=False, max_doppler=0., seed=None):
+        self.store = ShardDataset(folder, keys=['a', 'tau'])
+        self.meta = self.store.meta
+        self.batch_size = batch_size
+        self.random_phase = random_phase
+        self.max_doppler = max_doppler
+        if max_doppler > 0:
+            assert 'sampling_frequency' in self.meta, "max_doppler needs the sampling_frequency of the bank"
+        self._rng = np.random if seed is None else np.random.default_rng(seed)
+
+    def __len__(self):
+        return len(self.store)
+
+    @property
+    def num_time_steps(self):
+        return self.store.sample_shapes['a'][-1]
+
+    def _randint(self, high, size):
+        if self._rng is np.random:
+            return np.random.randint(0, high, size)
+        return self._rng.integers(0, high, size)
+
+    def sample(self, indices):
+        #examples at indices, with the optional phase/Doppler rotation
+        a = self.store.take('a', indices)
+        tau = self.store.take('tau', indices)
+        if self.random_phase or self.max_doppler > 0:
+            batch_size, num_paths, num_time_steps = a.shape[0], a.shape[-2], a.shape[-1]
+            phase = np.zeros([batch_size, num_paths, 1])
+            if self.random_phase:
+                phase = phase + self._rng.uniform(-np.pi, np.pi, [batch_size, num_paths, 1])
+            if self.max_doppler > 0:
+                t = np.arange(num_time_steps)/self.meta['sampling_frequency']
+                f_d = self._rng.uniform(-self.max_doppler, self.max_doppler, [batch_size, num_paths, 1])
+                phase = phase + 2*np.pi*f_d*t
+            #same rotation for all antennas of a path [batch, 1, 1, 1, 1, num_paths, num_time_steps or 1]
+            a *= np.exp(1j*phase).astype(a.dtype)[:,None,None,None,None]
+        return a, tau
+
+    def __call__(self, batch_size=None, num_time_steps=None, sampling_frequency=None):
+        #same arguments as the channel models, random batch drawn with replacement
+        if num_time_steps is not None and num_time_steps != self.num_time_steps:
+            raise ValueError(f"the CIR bank holds {self.num_time_steps} time steps, {num_time_steps} requested")
+        if batch_size is None:
+            batch_size = self.batch_size
+        return self.sample(self._randint(len(self), batch_size))
+
+    def generator(self):
+        #single examples forever, for channel.CIRDataset(bank.generator, batch_size, num_rx, ...)
+        while True:
+            a, tau = self(batch_size=1)
+            yield a[0], tau[0]
+
+def open_cir_bank(folder, source, num_samples, meta=None, **kwargs):
+    #CIRBank on folder, generated (or topped up) from source first when the folder does not hold num_samples examples
+    #source is only called when examples are missing, meta must match the one the bank was built with
+    if is_store(folder):
+        index = read_index(folder)
+        for key, value in (meta or {}).items():
+            if key in index['meta'] and index['meta'][key] != value:
+                raise ValueError(f"CIR bank {folder} was built with {key}={index['meta'][key]}, not {value}")
+    if not is_store(folder) or read_index(folder)['num_samples'] < num_samples:
+        build_cir_bank(folder, source, num_samples, meta=meta)
+    return CIRBank(folder, **kwargs)
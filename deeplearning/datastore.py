@@ -0,0 +1,203 @@
+#Sharded on-disk dataset store
+#A store is a folder with fixed-size contiguous .npy shards per key plus a small index.json:
+#   index.json                      {"num_samples", "shard_size", "keys": {key: {dtype, shape}}, "shards": [n0, n1, ...], "meta": {...}, "static": [...]}
+#   <key>_00000.npy, <key>_00001.npy  [n_i, *sample_shape] per shard, every shard except the last holds shard_size samples
+#   static_<name>.npy               arrays that belong to the whole dataset (pilots, frequencies, ...)
+#Writers append samples incrementally and rewrite the index after every flushed shard, so a partly written store stays readable.
+#Readers memory-map the shards, __getitem__ returns a slice of the mapped file (no copy, pages shared across DataLoader workers).
+import os
+import json
+import numpy as np
+from torch.utils.data import Dataset
+
+INDEX_FILE = 'index.json'
+
+def _shard_path(folder, key, shard_id):
+    return os.path.join(folder, f'{key}_{shard_id:05d}.npy')
+
+def _to_json(value):
+    #numpy scalars and small lists go into index.json, returns None when value needs a .npy file
+    if isinstance(value, (str, bool, int, float)) or value is None:
+        return value
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (list, tuple)):
+        items = [_to_json(v) for v in value]
+        if all(item is not None or v is None for item, v in zip(items, value)):
+            return items
+    return None
+
+def read_index(folder):
+    with open(os.path.join(folder, INDEX_FILE)) as f:
+        return json.load(f)
+
+def is_store(path):
+    return os.path.isfile(os.path.join(path, INDEX_FILE))
+
+class ShardWriter:
+    def __init__(self, folder, shard_size=1024, meta=None, append=False):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+        self.shard_size = shard_size
+        self.keys = {} #key: (dtype, sample_shape)
+        self.shards = [] #number of samples in each flushed shard
+        self.meta = {}
+        self.static = []
+        self.buffers = None #preallocated arrays for the shard under construction
+        self.count = 0 #samples in the current buffers
+        if append and is_store(folder):
+            index = read_index(folder)
+            self.shard_size = index['shard_size']
+            self.keys = {key: (np.dtype(v['dtype']), tuple(v['shape'])) for key, v in index['keys'].items()}
+            self.shards = index['shards']
+            self.meta = index['meta']
+            self.static = index['static']
+            if self.shards and self.shards[-1] < self.shard_size:
+                #reopen the last partial shard, it is rewritten when the buffer is flushed
+                n = self.shards.pop()
+                self._allocate()
+                for key in self.keys:
+                    self.buffers[key][:n] = np.load(_shard_path(folder, key, len(self.shards)))
+                self.count = n
+        if meta is not None:
+            self.set_meta(meta)
+
+    def __len__(self):
+        return sum(self.shards) + self.count
+
+    def set_meta(self, meta):
+        for key, value in meta.items():
+            jvalue = _to_json(value)
+            if jvalue is None and value is not None:
+                np.save(os.path.join(self.folder, f'static_{key}.npy'), np.asarray(value), allow_pickle=True)
+                if key not in self.static:
+                    self.static.append(key)
+                self.meta.pop(key, None)
+            else:
+                self.meta[key] = jvalue
+
+    def _allocate(self):
+        self.buffers = {key: np.empty((self.shard_size,)+shape, dtype=dtype) for key, (dtype, shape) in self.keys.items()}
+
+    def add(self, **sample):
+        #one sample per key, e.g., add(pdsch_iq=x, labels=y)
+        self.add_batch(**{key: np.asarray(value)[None] for key, value in sample.items()})
+
+    def add_batch(self, **batch):
+        #arrays with a leading batch dimension
+        batch = {key: np.asarray(value) for key, value in batch.items()}
+        if not self.keys:
+            self.keys = {key: (value.dtype, value.shape[1:]) for key, value in batch.items()}
+        if set(batch) != set(self.keys):
+            raise ValueError(f"expected keys {sorted(self.keys)}, got {sorted(batch)}")
+        if self.buffers is None:
+            self._allocate()
+        num = len(next(iter(batch.values())))
+        start = 0
+        while start < num:
+            n = min(num - start, self.shard_size - self.count)
+            for key, value in batch.items():
+                self.buffers[key][self.count:self.count+n] = value[start:start+n]
+            self.count += n
+            start += n
+            if self.count == self.shard_size:
+                self.flush()
+
+    def flush(self):
+        if self.count > 0:
+            shard_id = len(self.shards)
+            for key, buffer in self.buffers.items():
+                np.save(_shard_path(self.folder, key, shard_id), buffer[:self.count])
+            self.shards.append(self.count)
+            self.count = 0
+        self.write_index()
+
+    def write_index(self):
+        index = {'num_samples': sum(self.shards), 'shard_size': self.shard_size,
+                 'keys': {key: {'dtype': dtype.str, 'shape': list(shape)} for key, (dtype, shape) in self.keys.items()},
+                 'shards': self.shards, 'meta': self.meta, 'static': self.static}
+        tmp = os.path.join(self.folder, INDEX_FILE+'.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(index, f, indent=1)
+        os.replace(tmp, os.path.join(self.folder, INDEX_FILE)) #readers never see a half written index
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def save_dict(folder, data, sample_keys, shard_size=1024, append=True):
+    #sharded replacement for np.save(path, dict): sample_keys carry a leading batch dimension, the rest becomes metadata
+    with ShardWriter(folder, shard_size=shard_size, append=append) as writer:
+        writer.set_meta({key: value for key, value in data.items() if key not in sample_keys})
+        writer.add_batch(**{key: data[key] for key in sample_keys})
+    return writer
+
+class ShardDataset(Dataset):
+    def __init__(self, folder, keys=None, as_tuple=False):
+        self.folder = folder
+        index = read_index(folder)
+        self.shard_size = index['shard_size']
+        self.shards = index['shards']
+        self.num_samples = index['num_samples']
+        self.keys = list(keys) if keys is not None else list(index['keys'])
+        self.sample_shapes = {key: tuple(index['keys'][key]['shape']) for key in self.keys}
+        self.dtypes = {key: np.dtype(index['keys'][key]['dtype']) for key in self.keys}
+        self.as_tuple = as_tuple
+        self.meta = dict(index['meta'])
+        for key in index['static']:
+            value = np.load(os.path.join(folder, f'static_{key}.npy'), allow_pickle=True)
+            self.meta[key] = value.item() if value.dtype == object and value.ndim == 0 else value
+        self._maps = {} #opened lazily, so each DataLoader worker maps the files itself
+
+    def __len__(self):
+        return self.num_samples
+
+    def shard(self, key, shard_id):
+        m = self._maps.get((key, shard_id))
+        if m is None:
+            #copy-on-write mapping: pages are shared, and torch gets a writable array without copying
+            m = np.load(_shard_path(self.folder, key, shard_id), mmap_mode='c')
+            self._maps[(key, shard_id)] = m
+        return m
+
+    def get(self, key, index):
+        if index < 0:
+            index += self.num_samples
+        if not 0 <= index < self.num_samples:
+            raise IndexError(index)
+        shard_id, offset = divmod(index, self.shard_size)
+        return self.shard(key, shard_id)[offset]
+
+    def take(self, key, indices):
+        #random access gather of many samples, one fancy index per touched shard
+        indices = np.asarray(indices)
+        indices = np.where(indices < 0, indices + self.num_samples, indices)
+        if np.any((indices < 0) | (indices >= self.num_samples)):
+            raise IndexError(indices)
+        out = np.empty((len(indices),)+self.sample_shapes[key], dtype=self.dtypes[key])
+        shard_ids, offsets = np.divmod(indices, self.shard_size)
+        for shard_id in np.unique(shard_ids):
+            sel = shard_ids == shard_id
+            out[sel] = self.shard(key, shard_id)[offsets[sel]]
+        return out
+
+    def array(self, key):
+        #the whole column, a memmap when the store holds a single shard
+        parts = [self.shard(key, i) for i in range(len(self.shards))]
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def __getitem__(self, index):
+        if self.as_tuple:
+            return tuple(self.get(key, index) for key in self.keys)
+        return {key: self.get(key, index) for key in self.keys}
+
+    def __getstate__(self):
+        #DataLoader workers reopen the memmaps instead of pickling them
+        state = self.__dict__.copy()
+        state['_maps'] = {}
+        return state
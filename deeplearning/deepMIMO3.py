@@ -2,6 +2,7 @@
 #pip install DeepMIMO
 
 import DeepMIMO
+from deepmimo_cache import generate_data_cached
 import numpy as np
 import matplotlib.pyplot as plt
 
@@ -128,7 +129,7 @@ class DeepMIMODataset(Dataset):
     def __len__(self):
         return self.num_samples
                 
-def get_deepMIMOdata():
+def get_deepMIMOdata(cachefolder='data/deepmimo_cache'):
     # Load the default parameters
     parameters = DeepMIMO.default_params()
 
@@ -167,8 +168,8 @@ def get_deepMIMOdata():
     # will be generated using Sionna.
     parameters['OFDM_channels'] = 0
 
-    # Generate data
-    DeepMIMO_dataset = DeepMIMO.generate_data(parameters)
+    # Generate data, or load it from the cache keyed on the parameters (cachefolder=None to always regenerate)
+    DeepMIMO_dataset = generate_data_cached(parameters, cachefolder=cachefolder)
 
     ## User locations
     active_bs_idx = 0 # Select the first active basestation in the dataset
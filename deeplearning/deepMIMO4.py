@@ -2,6 +2,7 @@
 #pip install DeepMIMO
 
 import DeepMIMO
+from deepmimo_cache import generate_data_cached
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib import colors
@@ -464,7 +465,7 @@ class DeepMIMODataset(Dataset):
     def __len__(self):
         return self.num_samples
                 
-def get_deepMIMOdata(scenario='O1_60', dataset_folder=r'D:\Dataset\CommunicationDataset\O1_60'):
+def get_deepMIMOdata(scenario='O1_60', dataset_folder=r'D:\Dataset\CommunicationDataset\O1_60', cachefolder='data/deepmimo_cache'):
     # Load the default parameters
     parameters = DeepMIMO.default_params()
 
@@ -502,8 +503,8 @@ def get_deepMIMOdata(scenario='O1_60', dataset_folder=r'D:\Dataset\Communication
     # It is set to 0 for this simulation, as the channel responses in frequency domain
     parameters['OFDM_channels'] = 0
 
-    # Generate data
-    DeepMIMO_dataset = DeepMIMO.generate_data(parameters)
+    # Generate data, or load it from the cache keyed on the parameters (cachefolder=None to always regenerate)
+    DeepMIMO_dataset = generate_data_cached(parameters, cachefolder=cachefolder)
 
     ## User locations
     active_bs_idx = 0 # Select the first active basestation in the dataset
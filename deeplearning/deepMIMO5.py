@@ -2,22 +2,32 @@
 #pip install DeepMIMO
 
 import DeepMIMO
+from deepmimo_cache import generate_data_cached
+from demapper_numpy import demapper_tables, demap_llr
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib import colors
 import torch
 import torch.nn as nn
+import tensorflow as tf
 from torch.utils.data import Dataset
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, BatchSampler, RandomSampler, SequentialSampler
 
 from matplotlib import colors
 
-from sionna_tf import MyLMMSEEqualizer, LMMSEEqualizer, SymbolLogits2LLRs#, OFDMDemodulator #ZFPrecoder, OFDMModulator, KroneckerPilotPattern, Demapper, RemoveNulledSubcarriers, 
+from sionna_tf import MyLMMSEEqualizer, LMMSEEqualizer#, SymbolLogits2LLRs, OFDMDemodulator #ZFPrecoder, OFDMModulator, KroneckerPilotPattern, Demapper, RemoveNulledSubcarriers, 
 from channel import MyLSChannelEstimator, LSChannelEstimator, ApplyTimeChannel#, time_lag_discrete_time_channel #, ApplyTimeChannel #cir_to_time_channel
 from ldpc.encoding import LDPC5GEncoder
 from ldpc.decoding import LDPC5GDecoder
 
 import scipy
+import scipy.fft
+import csv
+import time
+import random
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 def ebnodb2no(ebno_db, num_bits_per_symbol, coderate):
     r"""Compute the noise variance `No` for a given `Eb/No` in dB.
@@ -378,10 +388,29 @@ def plotcomplex(y):
 # by stacking the data of channels from the basestations (0 and 1), (2 and 3), 
 # and (4 and 5) to the UEs.
 #
+#Pack the DeepMIMO dict-of-lists into contiguous per-user arrays, ToA zero-padded to num_paths:
+#   channel [num_bs, num_ue, num_rx_ant, num_tx_ant, num_paths] complex64, toa [num_bs, num_ue, num_paths] float32
+def pack_deepmimo(DeepMIMO_dataset):
+    channel = np.stack([np.asarray(bs['user']['channel'], dtype=np.csingle) for bs in DeepMIMO_dataset])
+    num_bs, num_ue, num_paths = channel.shape[0], channel.shape[1], channel.shape[-1]
+    toa = np.zeros((num_bs, num_ue, num_paths), dtype=np.single)
+    for i_bs, bs in enumerate(DeepMIMO_dataset):
+        paths = bs['user']['paths']
+        ue_num_paths = np.array([path['num_paths'] for path in paths], dtype=np.int64)
+        if ue_num_paths.sum() > 0:
+            toa_flat = np.concatenate([np.asarray(path['ToA'], dtype=np.single).ravel()[:path['num_paths']] for path in paths])
+            toa[i_bs][np.arange(num_paths)[None, :] < ue_num_paths[:, None]] = toa_flat #row-major fill keeps the per-user path order
+    return {'channel': channel, 'toa': toa}
+
 class DeepMIMODataset(Dataset):
     #ref: https://github.com/DeepMIMO/DeepMIMO-python/blob/master/src/DeepMIMOv3/sionna_adapter.py
-    def __init__(self, DeepMIMO_dataset, bs_idx = None, ue_idx = None, num_time_steps = 1):
+    #packed: output of pack_deepmimo, used instead of DeepMIMO_dataset
+    def __init__(self, DeepMIMO_dataset=None, bs_idx = None, ue_idx = None, num_time_steps = 1, packed = None):
         self.dataset = DeepMIMO_dataset  
+        if packed is None:
+            packed = pack_deepmimo(DeepMIMO_dataset)
+        self.channel = packed['channel'] #(num_bs, 9231, 1, 16, 10)
+        self.toa = packed['toa'] #(num_bs, 9231, 10)
         # Set bs_idx based on given parameters
         # If no input is given, choose the first basestation
         if bs_idx is None:
@@ -391,12 +420,12 @@ class DeepMIMODataset(Dataset):
         # Set ue_idx based on given parameters
         # If no input is given, set all user indices
         if ue_idx is None:
-            ue_idx = np.arange(DeepMIMO_dataset[0]['user']['channel'].shape[0])
+            ue_idx = np.arange(self.channel.shape[1])
         self.ue_idx = self._verify_idx(ue_idx) #(9231, 1)
         
         # Extract number of antennas from the DeepMIMO dataset
-        self.num_rx_ant = DeepMIMO_dataset[0]['user']['channel'].shape[1] #1 
-        self.num_tx_ant = DeepMIMO_dataset[0]['user']['channel'].shape[2] #16
+        self.num_rx_ant = self.channel.shape[2] #1 
+        self.num_tx_ant = self.channel.shape[3] #16
         
         # Determine the number of samples based on the given indices
         self.num_samples_bs = self.bs_idx.shape[0] #1
@@ -408,7 +437,7 @@ class DeepMIMODataset(Dataset):
         self.num_tx = self.bs_idx.shape[1] #1
         
         # Determine the number of available paths in the DeepMIMO dataset
-        self.num_paths = DeepMIMO_dataset[0]['user']['channel'].shape[-1] #10
+        self.num_paths = self.channel.shape[-1] #10
         self.num_time_steps = num_time_steps # Time step = 1 for static scenarios
         
         # The required path power shape
@@ -423,19 +452,30 @@ class DeepMIMODataset(Dataset):
         self.t_shape = (self.num_rx, self.num_tx, self.num_paths) #(rx=1,tx=1,paths=10)
     
     def __getitem__(self, index):
+        #index: int for one sample, or an index array for a whole batch (leading batch dimension)
+        index = np.asarray(index)
+        if np.any(index >= self.num_samples) or np.any(index < -self.num_samples):
+            raise IndexError(index)
+        index = index % self.num_samples
         ue_idx = index // self.num_samples_bs
         bs_idx = index % self.num_samples_bs
-        # Generate zero vectors
-        a = np.zeros(self.ch_shape, dtype=np.csingle)
-        tau = np.zeros(self.t_shape, dtype=np.single)
-        # Place the DeepMIMO dataset power and delays into the channel sample
-        for i_ch in range(self.num_rx): # for each receiver in the sample
-            for j_ch in range(self.num_tx): # for each transmitter in the sample
-                i_ue = self.ue_idx[ue_idx][i_ch] # UE channel sample i - channel RX i_ch
-                i_bs = self.bs_idx[bs_idx][j_ch] # BS channel sample i - channel TX j_ch
-                a[i_ch, :, j_ch, :, :, 0] = self.dataset[i_bs]['user']['channel'][i_ue]
-                tau[i_ch, j_ch, :self.dataset[i_bs]['user']['paths'][i_ue]['num_paths']] = self.dataset[i_bs]['user']['paths'][i_ue]['ToA'] 
+        i_ue = self.ue_idx[ue_idx][..., :, None] # UE channel sample - channel RX i_ch (..., num_rx, 1)
+        i_bs = self.bs_idx[bs_idx][..., None, :] # BS channel sample - channel TX j_ch (..., 1, num_tx)
+        # Place the DeepMIMO dataset power and delays into the channel sample, one gather for all rx/tx pairs
+        a = np.zeros(index.shape + self.ch_shape, dtype=np.csingle)
+        a[..., 0] = np.moveaxis(self.channel[i_bs, i_ue], -3, -4) #(..., num_rx, num_tx, rx_ant, tx_ant, paths)->(..., num_rx, rx_ant, num_tx, tx_ant, paths)
+        tau = self.toa[i_bs, i_ue] #(..., num_rx, num_tx, paths)
         return a, tau ## yield this sample h=(num_rx=1, 1, num_tx=1, 16, 10, 1), tau=(num_rx=1,num_tx=1,ToA=10)
+
+    def __getitems__(self, indices):
+        #batched fetch used by DataLoader (torch>=2.0): one gather, then per-sample views for the collate function
+        a, tau = self[np.asarray(indices)]
+        return list(zip(a, tau))
+
+    def batch_loader(self, batch_size, shuffle=True, drop_last=False, **kwargs):
+        #DataLoader that hands whole index batches to __getitem__, batches come out already stacked (no per-sample collate)
+        sampler = RandomSampler(self) if shuffle else SequentialSampler(self)
+        return DataLoader(dataset=self, sampler=BatchSampler(sampler, batch_size=batch_size, drop_last=drop_last), batch_size=None, **kwargs)
     
     def __len__(self):
         return self.num_samples
@@ -472,7 +512,7 @@ class DeepMIMODataset(Dataset):
     def __len__(self):
         return self.num_samples
                 
-def get_deepMIMOdata(scenario='O1_60', dataset_folder=r'D:\Dataset\CommunicationDataset\O1_60', num_ue_antenna=1, num_bs_antenna=16, showfig=True):
+def get_deepMIMOdata(scenario='O1_60', dataset_folder=r'D:\Dataset\CommunicationDataset\O1_60', num_ue_antenna=1, num_bs_antenna=16, showfig=True, cachefolder='data/deepmimo_cache'):
     # Load the default parameters
     parameters = DeepMIMO.default_params()
     #https://github.com/DeepMIMO/DeepMIMO-python/blob/master/src/DeepMIMOv3/params.py
@@ -509,8 +549,8 @@ def get_deepMIMOdata(scenario='O1_60', dataset_folder=r'D:\Dataset\Communication
     # It is set to 0 for this simulation, as the channel responses in frequency domain will be generated
     parameters['OFDM_channels'] = 0
 
-    # Generate data
-    DeepMIMO_dataset = DeepMIMO.generate_data(parameters)
+    # Generate data, or load it from the cache keyed on the parameters (cachefolder=None to always regenerate)
+    DeepMIMO_dataset = generate_data_cached(parameters, cachefolder=cachefolder)
 
     ## User locations
     active_bs_idx = 0 # Select the first active basestation in the dataset
@@ -1640,7 +1680,7 @@ def myexpand_to_rank(tensor, target_rank, axis=-1):
 
     return output #(1, 1, 1, 1, 1, 1, 1, 76)
 
-def cir_to_ofdm_channel(frequencies, a, tau, normalize=False):
+def cir_to_ofdm_channel(frequencies, a, tau, normalize=False, method='exact', memory_budget=2**28):
     r"""
     Compute the frequency response of the channel at ``frequencies``.
 
@@ -1666,48 +1706,60 @@ def cir_to_ofdm_channel(frequencies, a, tau, normalize=False):
     normalize : bool
         to ensure unit average energy per resource element. Defaults to `False`.
 
+    method : str
+        "exact" accumulates the paths one at a time against the phase terms ``e^{-j2\pi f \tau_m}``,
+        bit-identical to the full broadcast ``sum(h*e)``; "einsum" does the path sum as a matmul against
+        the ``[num_paths, fft_size]`` phase matrix of every link (equal up to float rounding).
+        Defaults to "exact".
+
+    memory_budget : int
+        Approximate number of bytes for the temporaries, the batch is processed in chunks
+        that fit into it. Defaults to 2**28.
+
     Output
     -------
     h_f : [batch size, num_rx, num_rx_ant, num_tx, num_tx_ant, num_time_steps, fft_size], complex
         Channel frequency responses at ``frequencies``
     """
 
-    real_dtype = tau.dtype #torch.float32
-
     if len(tau.shape) == 4:
-        # Expand dims to broadcast with h. Add the following dimensions:
-        #  - number of rx antennas (2)
-        #  - number of tx antennas (4)
-        tau_tmp=np.expand_dims(tau, axis=2) #[64, 1, 1, 10][batch size, num_rx, num_tx, num_paths] => [batch size, num_rx, 1, num_tx, num_paths]
-        tau = np.expand_dims(tau_tmp, axis=4) #[batch size, num_rx, 1, num_tx, 1, num_paths] (64, 1, 1, 1, 1, 10)
-        #tau = tf.expand_dims(tf.expand_dims(tau, axis=2), axis=4)
-        # Broadcast is not supported yet by TF for such high rank tensors.
-        # We therefore do part of it manually
-        #tau = tf.tile(tau, [1, 1, 1, 1, a.shape[4], 1])
-        tau = np.tile(tau, [1, 1, 1,1, a.shape[4], 1]) #(64, 1, 1, 1, 16, 10)
+        # tau is shared by all antennas of a link: keep singleton antenna dimensions (no tiling),
+        # the phase terms are computed once per link and broadcast over the antennas
+        tau = np.expand_dims(np.expand_dims(tau, axis=2), axis=4) #[batch size, num_rx, 1, num_tx, 1, num_paths] (64, 1, 1, 1, 1, 10)
 
     # Add a time samples dimension for broadcasting
-    tau = np.expand_dims(tau, axis=6) #[batch size, num_rx, num_rx_ant, num_tx, num_tx_ant, num_paths, fft_size] (64, 1, 1, 1, 16, 10, 1)
-    #tau = tf.expand_dims(tau, axis=6)
+    tau = np.expand_dims(tau, axis=6) #[batch size, num_rx, num_rx_ant, num_tx, num_tx_ant, num_paths, 1]
 
     # Bring all tensors to broadcastable shapes
-    tau = np.expand_dims(tau, axis=-1) ##[batch size, num_rx, num_rx_ant, num_tx, num_tx_ant, num_paths, fft_size , 1] (64, 1, 1, 1, 16, 10, 1, 1)
-    #tau = tf.expand_dims(tau, axis=-1)
-    h = np.expand_dims(a, axis=-1) #[batch size, num_rx, num_rx_ant, num_tx, num_tx_ant, num_paths, num_time_steps, 1] (64, 1, 1, 1, 16, 10, 1, 1)
-    #h = tf.expand_dims(a, axis=-1)
+    tau = np.expand_dims(tau, axis=-1) #[batch size, num_rx, num_rx_ant, num_tx, num_tx_ant, num_paths, 1, 1]
     frequencies = myexpand_to_rank(frequencies, tau.ndim, axis=0) #(1, 1, 1, 1, 1, 1, 1, 76)
-
-    ## Compute the Fourier transforms of all cluster taps
-    # Exponential component
-    # e = tf.exp(tf.complex(tf.constant(0, real_dtype),
-    #     -2*PI*frequencies*tau))
-    tmp_complex = 0 - 1j*2*np.pi*frequencies*tau #(64, 1, 1, 1, 16, 10, 1, 76)
-    e = np.exp(tmp_complex)
-
-    h_f = h*e #(64, 1, 1, 1, 16, 10, 1, 76)
-    # Sum over all clusters to get the channel frequency responses
-    #h_f = tf.reduce_sum(h_f, axis=-3)
-    h_f = np.sum(h_f, axis=-3) #(64, 1, 1, 1, 16, 1, 76) #combine 10 paths
+    # same factor as in -1j*2*pi*frequencies*tau, evaluated left to right
+    frequencies = 1j*2*np.pi*frequencies
+
+    batch_size = a.shape[0]
+    out_shape = np.broadcast_shapes(a.shape[:-2], tau.shape[:-3]) + (a.shape[-1], frequencies.shape[-1])
+    h_f = None
+    # bytes per batch example: output, one product term and the phase terms
+    itemsize = np.dtype(np.result_type(a, frequencies)).itemsize
+    per_example = (2*int(np.prod(out_shape[1:])) + int(np.prod(tau.shape[1:]))*frequencies.shape[-1])*itemsize
+    chunk = max(1, memory_budget // per_example)
+    for start in range(0, batch_size, chunk):
+        stop = min(start+chunk, batch_size)
+        tau_c = tau[start:stop] if tau.shape[0] > 1 else tau
+        a_c = a[start:stop]
+        ## Compute the Fourier transforms of all cluster taps
+        e = np.exp(0 - frequencies*tau_c) #[chunk, num_rx, 1 or num_rx_ant, num_tx, 1 or num_tx_ant, num_paths, 1, fft_size]
+        if method == 'einsum':
+            # [.., num_time_steps, num_paths] @ [.., num_paths, fft_size]
+            h_c = np.matmul(np.swapaxes(a_c, -1, -2), e[..., 0, :])
+        else:
+            # Sum over all clusters, in path order as np.sum over the path axis
+            h_c = a_c[..., 0, :, np.newaxis]*e[..., 0, :, :]
+            for m in range(1, a.shape[-2]):
+                h_c += a_c[..., m, :, np.newaxis]*e[..., m, :, :]
+        if h_f is None:
+            h_f = np.empty((batch_size,)+h_c.shape[1:], dtype=h_c.dtype)
+        h_f[start:stop] = h_c
     #h_f : [batch size, num_rx, num_rx_ant, num_tx, num_tx_ant, num_time_steps, fft_size]
 
     if normalize:
@@ -2244,6 +2296,177 @@ def count_block_errors(b, b_hat):
     errors = np.any(b != b_hat, axis=-1) #np.any(b != b_hat, axis=-1) computes element-wise inequality between the arrays b and b_hat along the last dimension.
     return np.sum(errors) #np.sum(errors) calculates the sum of all elements in the resulting boolean array.
 
+#Monte-Carlo BER/BLER engine: batches are repeated per Eb/No point until enough errors are counted
+#eval_fn(b, ebno_db) -> (b_hat, BER), a new random b is drawn for every batch after the first one
+#all random generators are reseeded per point, so the numbers do not depend on which process ran the point
+def seed_everything(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    tf.random.set_seed(seed)
+
+_transceivers = {} #per process cache of the transceivers built by TransceiverRunner
+
+def _freeze(value):
+    #hashable cache key of the transceiver kwargs
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, np.ndarray):
+        return (value.dtype.str, value.shape, value.tobytes())
+    return value
+
+class TransceiverRunner:
+    #picklable eval_fn for process pools, every worker process builds a transceiver on first use and reuses it
+    #for all runners with the same class, kwargs and build_seed
+    def __init__(self, transceiver_class, transceiver_kwargs, build_seed=0, **call_kwargs):
+        self.transceiver_class = transceiver_class
+        self.transceiver_kwargs = transceiver_kwargs
+        self.build_seed = build_seed
+        self.call_kwargs = call_kwargs
+        self.transceiver = None
+
+    def build(self):
+        if self.transceiver is None:
+            key = (self.transceiver_class, _freeze(self.transceiver_kwargs), self.build_seed)
+            self.transceiver = _transceivers.get(key)
+            if self.transceiver is None:
+                seed_everything(self.build_seed) #same pilots and channel model in every process
+                self.transceiver = _transceivers[key] = self.transceiver_class(**self.transceiver_kwargs)
+        return self.transceiver
+
+    def seed(self, seed):
+        transceiver = self.build()
+        seed_everything(seed)
+        cirprovider = getattr(transceiver, 'cirprovider', None)
+        if cirprovider is not None:
+            cirprovider.reset() #restart the DataLoader epoch under the point seed
+
+    def __call__(self, b, ebno_db):
+        return self.build()(b=b, ebno_db=ebno_db, **self.call_kwargs)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['transceiver'] = None
+        return state
+
+def _init_mc_worker(num_threads=None):
+    if num_threads is not None: #avoid oversubscribing the cores with num_workers processes
+        torch.set_num_threads(num_threads)
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+            tf.config.threading.set_inter_op_parallelism_threads(num_threads)
+        except RuntimeError: #TF runtime already initialized
+            pass
+
+def mc_point(eval_fn, ebno_db, b, max_mc_iter=1, num_target_bit_errors=None, num_target_block_errors=None, seed=None):
+    assert max_mc_iter >= 1, "max_mc_iter must be at least 1"
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    bits_seed, global_seed = seed.generate_state(2) #private stream for the new bits, one seed for the global generators
+    rng = np.random.default_rng(bits_seed)
+    if hasattr(eval_fn, 'seed'):
+        eval_fn.seed(int(global_seed))
+    else:
+        seed_everything(int(global_seed))
+    bit_errors, block_errors, nb_bits, nb_blocks = 0, 0, 0, 0
+    BERs = []
+    start = time.time()
+    for i in range(max_mc_iter):
+        if i > 0:
+            b = rng.integers(0, 2, size=b.shape).astype(b.dtype)
+        b_hat, BER = eval_fn(b, ebno_db)
+        BERs.append(BER)
+        bit_errors += int(count_errors(b, b_hat))
+        block_errors += int(count_block_errors(b, b_hat))
+        nb_bits += np.size(b)
+        nb_blocks += np.size(b[..., -1])
+        if num_target_bit_errors is not None and bit_errors >= num_target_bit_errors:
+            break
+        if num_target_block_errors is not None and block_errors >= num_target_block_errors:
+            break
+    return {'ebno_db': float(ebno_db), 'bit_errors': bit_errors, 'block_errors': block_errors, 'nb_bits': nb_bits, 'nb_blocks': nb_blocks,
+            'ber': bit_errors/nb_bits, 'bler': block_errors/nb_blocks, 'BER': float(np.mean(BERs)), 'iterations': i+1, 'runtime': time.time()-start}
+
+MC_CSV_FIELDS = ['ebno_db', 'bit_errors', 'block_errors', 'nb_bits', 'nb_blocks', 'ber', 'bler', 'BER', 'iterations', 'runtime']
+
+def run_mc_jobs(jobs, early_stop=True, csvpath=None, num_workers=0, max_inflight=None, num_threads=None):
+    #jobs: (tags, eval_fn, ebno_db, b, max_mc_iter, num_target_bit_errors, num_target_block_errors, seed), in Eb/No order within each tags group
+    #returns one result dict per job (the tags, then the mc_point fields), results are printed and appended to csvpath in job order
+    #with early_stop, the jobs of a group after its first error free one are skipped (zero BER)
+    #num_workers>0 runs all jobs in one spawn process pool with at most max_inflight (default 2*num_workers) submitted jobs,
+    #eval_fn must then be picklable (e.g., TransceiverRunner)
+    num_jobs = len(jobs)
+    results = [None]*num_jobs
+    stopped = set()
+    tagfields = []
+    for job in jobs:
+        tagfields += [key for key in job[0] if key not in tagfields]
+    csvfile = None
+    if csvpath is not None:
+        csvfile = open(csvpath, 'w', newline='')
+        writer = csv.DictWriter(csvfile, fieldnames=tagfields+MC_CSV_FIELDS)
+        writer.writeheader()
+        csvfile.flush()
+
+    def group(i):
+        return tuple(jobs[i][0].items())
+
+    def record(i, result):
+        results[i] = result = {**jobs[i][0], **result}
+        prefix = ''.join(f"{value} " for value in jobs[i][0].values())
+        print(f"{prefix}EbNo: {result['ebno_db']:.2f} dB, BER: {result['ber']:.4e}, BLER: {result['bler']:.4e}, "
+              f"bit errors: {result['bit_errors']}, iterations: {result['iterations']}, time: {result['runtime']:.1f}s")
+        if csvfile is not None:
+            writer.writerow(result)
+            csvfile.flush()
+        if early_stop and result['bit_errors'] == 0:
+            stopped.add(group(i))
+
+    try:
+        if num_workers > 0:
+            if max_inflight is None:
+                max_inflight = 2*num_workers
+            ctx = multiprocessing.get_context('spawn') #TF and CUDA state does not survive fork
+            with ProcessPoolExecutor(max_workers=num_workers, mp_context=ctx, initializer=_init_mc_worker, initargs=(num_threads,)) as pool:
+                pending = deque() #(job index, future) in job order
+                next_job = 0
+                while True:
+                    while next_job < num_jobs and len(pending) < max_inflight: #caps the number of batches held in memory
+                        if group(next_job) not in stopped:
+                            pending.append((next_job, pool.submit(mc_point, *jobs[next_job][1:])))
+                        next_job += 1
+                    if not pending:
+                        break
+                    i, future = pending.popleft()
+                    if group(i) in stopped: #a lower Eb/No point of the group was error free
+                        future.cancel()
+                        continue
+                    record(i, future.result())
+        else:
+            for i, job in enumerate(jobs):
+                if group(i) not in stopped:
+                    record(i, mc_point(*job[1:]))
+    finally:
+        if csvfile is not None:
+            csvfile.close()
+    if early_stop: #BER stays zero for the skipped higher Eb/No points
+        for i in range(num_jobs):
+            if results[i] is None:
+                results[i] = {**jobs[i][0], 'ebno_db': float(jobs[i][2]), 'bit_errors': 0, 'block_errors': 0, 'nb_bits': 0, 'nb_blocks': 0,
+                              'ber': 0.0, 'bler': 0.0, 'BER': 0.0, 'iterations': 0, 'runtime': 0.0}
+    return results
+
+def sim_ber_mc(ebno_dbs, eval_fn, b, max_mc_iter=1, num_target_bit_errors=None, num_target_block_errors=None,
+               early_stop=True, csvpath=None, num_workers=0, seed=None, max_inflight=None, num_threads=None):
+    #returns one result dict per Eb/No point (see mc_point and run_mc_jobs), points after the first error free one are skipped when early_stop
+    #num_workers>0 runs the points in a spawn process pool, eval_fn must then be picklable (e.g., TransceiverRunner)
+    assert max_mc_iter >= 1, "max_mc_iter must be at least 1"
+    seeds = np.random.SeedSequence(seed).spawn(len(ebno_dbs)) #one stream per point, independent of the scheduling
+    jobs = [({}, eval_fn, ebno_db, b, max_mc_iter, num_target_bit_errors, num_target_block_errors, seeds[i]) for i, ebno_db in enumerate(ebno_dbs)]
+    return run_mc_jobs(jobs, early_stop=early_stop, csvpath=csvpath, num_workers=num_workers, max_inflight=max_inflight, num_threads=num_threads)
+
 class MyDemapper:
     r"""
     Demapper(demapping_method, constellation_type=None, num_bits_per_symbol=None, constellation=None, hard_out=False, with_prior=False, dtype=tf.complex64, **kwargs)
@@ -2367,6 +2590,7 @@ class MyDemapper:
                  num_bits_per_symbol=None,
                  hard_out=False,
                  with_prior=False,
+                 chunk_size=2**15,
                  #dtype=tf.complex64,
                  #**kwargs
                 ):
@@ -2374,10 +2598,9 @@ class MyDemapper:
         self.num_bits_per_symbol = num_bits_per_symbol #4
         self.with_prior = with_prior #False
         self.hard_out = hard_out #False
-        self._logits2llrs = SymbolLogits2LLRs(demapping_method,
-                                              num_bits_per_symbol,
-                                              hard_out,
-                                              with_prior)
+        self.demapping_method = demapping_method
+        self.chunk_size = chunk_size #symbols per chunk, bounds the memory of the distance computation
+        self._tables = demapper_tables(self.points, num_bits_per_symbol)
     
     # def demap(self, inputs):
         
@@ -2407,52 +2630,9 @@ class MyDemapper:
         else:
             y, no = inputs #(64, 1, 1, 14, 76), [batch size, num_rx, num_rx_ant, num_ofdm_symbols, fft_size]
         
-        # Reshape constellation points to [1,...1,num_points]
-        #points_shape = [1]*y.shape.rank + self.points.shape
-        points_shape = [1]*len(y.shape) +list(self.points.shape) #[1,1]+[4] = [1, 1, 4] : [1, 1, 1, 1, 1, 16]
-        #points = tf.reshape(self.constellation.points, points_shape)
-        points_reshape =np.reshape(self.points, points_shape) #(1, 1, 4) #(16,)=> (1, 1, 1, 1, 1, 16)
-
-        # Compute squared distances from y to all points
-        # shape [...,n,num_points]
-        #squared_dist = tf.pow(tf.abs(tf.expand_dims(y, axis=-1) - points_reshape), 2)
-        ynew=np.expand_dims(y, axis=-1) #(64, 512, 1): (64, 1, 1, 14, 76, 1(added))
-        #squared_dist=((ynew-points_reshape)**2) #(64, 512, 4)
-        dist = np.abs(ynew-points_reshape) #(64, 512, 4) float32: (64, 1, 1, 14, 76, 16) distance to all 16 points
-        squared_dist = dist **2
-        
-        #Convert no to numpy and cast to the same data type as squared_dist
-        #no=np.array(no, dtype=squared_dist.dtype)
-        #no=no.astype(squared_dist.dtype)
-        no=np.expand_dims(no, axis=-1)
-        # Compute exponents
-        exponents = -squared_dist/no #(64, 1, 1, 14, 76, 16)
-
-        if self.with_prior:
-            llr = self._logits2llrs([exponents, prior])
-        else:
-            #exponents = tf.convert_to_tensor(exponents) #move into the logits2llrs function
-            llr = self._logits2llrs(exponents) #(64, 512, 2): tensor 
-            #input: [...,n, num_points] => [...,n, num_bits_per_symbol] LLRs or hard-decisions for every bit.
-            #output [64, 1, 1, 14, 76, 4] [batch size, num_rx, num_rx_ant, num_ofdm_symbols, fft_size, bits]
-        
-        llr = llr.numpy() #convert tf to numpy
-        yshape_list = list(np.shape(y)) #[64, 1, 1, 14, 76] [batch size, num_rx, num_rx_ant, num_ofdm_symbols, fft_size]
-        part1= yshape_list[:-1] #[64, 1, 1, 14]
-        part2= yshape_list[-1]*self.num_bits_per_symbol #304 (76*4)
-        out_shape = np.concatenate([part1, [part2]], 0) #[ 64,   1,   1,  14, 304] 
-        # Reshape LLRs to [...,n*num_bits_per_symbol]
-        llr_reshaped = np.reshape(llr, out_shape) #[ 64,   1,   1,  14, 304] combined last two dimension
-        #[...,n*num_bits_per_symbol] [batch size, num_rx, num_rx_ant, num_ofdm_symbols, fft_size(n subcarrier) * num_bits_per_symbol]
-
-        # print(tf.shape(y)) #[64, 512]
-        # print(tf.shape(y)[:-1]) # [64]
-        # print(y.shape[-1]) #512
-        # out_shape = tf.concat([tf.shape(y)[:-1],
-        #                        [y.shape[-1] * \
-        #                         self.num_bits_per_symbol]], 0)
-        # llr_reshaped = tf.reshape(llr, out_shape) #(64, 1024)
-
+        # Per-axis PAM (square QAM) or per-point distances, [...,n] => [...,n*num_bits_per_symbol] LLRs or hard-decisions
+        llr_reshaped = demap_llr(y, no, self.points, self._tables, self.num_bits_per_symbol, method=self.demapping_method, \
+                                 prior=prior if self.with_prior else None, hard_out=self.hard_out, chunk_size=self.chunk_size)
         return llr_reshaped
 
 
@@ -2711,6 +2891,18 @@ class MyApplyTimeChannel:
         shape of the channel outputs by adding dummy dimensions after the
         last axis.
 
+    method : str
+        "gather" materializes ``x`` at every (time, tap) pair (reference path),
+        "chunked" runs the same computation over blocks of ``chunk_size`` time steps with bounded memory
+        (bit-identical to "gather"), "fft" convolves in the frequency domain and only applies to
+        time-invariant taps (``h_time`` with one time step, equal to "gather" up to float rounding),
+        "auto" picks "fft" for time-invariant and "chunked" for time-varying taps.
+        Defaults to "chunked", "fft" and "auto" are opt-in.
+
+    chunk_size : int or None
+        Number of output time steps per block in "chunked" mode, `None` bounds each
+        temporary to about 2**22 elements.
+
     Output
     -------
     y : [batch size, num_rx, num_rx_ant, num_time_samples + l_tot - 1], tf.complex
@@ -2720,8 +2912,12 @@ class MyApplyTimeChannel:
         ``num_time_samples`` with the time-variant channel filter  of length
         ``l_tot``.
     """
-    def __init__(self, num_time_samples, l_tot, add_awgn=True):
+    def __init__(self, num_time_samples, l_tot, add_awgn=True, method="chunked", chunk_size=None):
         self._add_awgn = add_awgn
+        self._num_time_samples = num_time_samples
+        self._l_tot = l_tot
+        self._method = method
+        self._chunk_size = chunk_size
 
         # The channel transfert function is implemented by first gathering from
         # the vector of transmitted baseband symbols
@@ -2771,7 +2967,61 @@ class MyApplyTimeChannel:
             x, h_time, no = inputs #x: (64, 1, 1, 1064), h_time: (64, 1, 1, 1, 16, 1, 27)
         else:
             x, h_time = inputs
+
+        method = self._method
+        assert method in ("auto", "fft", "chunked", "gather"), "method must be one of 'auto', 'fft', 'chunked' or 'gather'"
+        if method == "auto":
+            method = "fft" if h_time.shape[-2] == 1 else "chunked"
+        if method == "fft":
+            y = self._apply_fft(x, h_time)
+        elif method == "chunked":
+            y = self._apply_chunked(x, h_time)
+        else:
+            y = self._apply_gather(x, h_time)
+
+        if self._add_awgn:
+            noise=complex_normal(y.shape, var=1.0)
+            noise = noise.astype(y.dtype)
+            noise *= np.sqrt(no)
+            y=y+noise
         
+        return y
+
+    def _apply_fft(self, x, h_time):
+        #time-invariant taps: y_b = sum_l x_{b-l} h_l is the full linear convolution of x and h
+        if h_time.shape[-2] != 1:
+            raise ValueError("method='fft' requires time-invariant taps (h_time with one time step)")
+        num_out = self._num_time_samples + self._l_tot - 1
+        nfft = scipy.fft.next_fast_len(num_out)
+        dtype = np.result_type(x, h_time)
+        #computed in double precision so the result matches the direct sum to the output precision
+        x_f = scipy.fft.fft(x.astype(np.complex128), n=nfft, axis=-1) #[batch size, num_tx, num_tx_ant, nfft]
+        h_f = scipy.fft.fft(h_time[..., 0, :].astype(np.complex128), n=nfft, axis=-1) #[batch size, num_rx, num_rx_ant, num_tx, num_tx_ant, nfft]
+        # Sum over the transmit antennas of all transmitters in the frequency domain
+        y_f = np.sum(np.sum(h_f * x_f[:, np.newaxis, np.newaxis], axis=4), axis=3)
+        y = scipy.fft.ifft(y_f, axis=-1)[..., :num_out]
+        return y.astype(dtype)
+
+    def _apply_chunked(self, x, h_time):
+        #same gather/multiply/reduce as _apply_gather, one block of output time steps at a time
+        x = np.pad(x, [(0, 0), (0, 0), (0, 0), (0, 1)])
+        x = np.expand_dims(np.expand_dims(x, axis=1), axis=1) #(64, 1, 1, 1, 16, 1065)
+        num_out = self._g.shape[0]
+        time_varying = h_time.shape[-2] != 1
+        out_shape = np.broadcast_shapes(h_time.shape[:-2], x.shape[:-1])
+        chunk_size = self._chunk_size
+        if chunk_size is None:
+            chunk_size = max(1, 2**22 // (int(np.prod(out_shape))*self._l_tot))
+        y = np.empty(out_shape[:3] + (num_out,), dtype=np.result_type(x, h_time))
+        for start in range(0, num_out, chunk_size):
+            stop = min(start+chunk_size, num_out)
+            x_g = np.take(x, self._g[start:stop], axis=-1)
+            h = h_time[..., start:stop, :] if time_varying else h_time
+            y_c = np.sum(h * x_g, axis=-1)
+            y[..., start:stop] = np.sum(np.sum(y_c, axis=4), axis=3)
+        return y
+
+    def _apply_gather(self, x, h_time):
         #x :  [batch size, num_tx, num_tx_ant, num_time_samples]
         # Preparing the channel input for broadcasting and matrix multiplication
         x = np.pad(x, [(0, 0), (0, 0), (0, 0), (0, 1)]) #(64, 1, 1, 1065)
@@ -2811,13 +3061,6 @@ class MyApplyTimeChannel:
         #The outer tf.reduce_sum(..., axis=3) computes the sum along the third axis of the intermediate result.
         #The final result is assigned back to the variable y.
         #The resulting tensor y will have shape [batch size, num_rx, num_rx_ant, num_time_samples + l_tot - 1].
-
-        if self._add_awgn:
-            noise=complex_normal(y.shape, var=1.0)
-            noise = noise.astype(y.dtype)
-            noise *= np.sqrt(no)
-            y=y+noise
-        
         return y
         
 
@@ -3421,7 +3664,7 @@ class Transmitter():
         #print(tau.shape) #[num_rx, num_tx, num_paths]
 
         # torch dataloaders
-        self.data_loader = DataLoader(dataset=self.channeldataset, batch_size=batch_size, shuffle=True, pin_memory=True)
+        self.data_loader = self.channeldataset.batch_loader(batch_size, shuffle=True, pin_memory=True)
         if showfig:
             self.plotchimpulse()
 
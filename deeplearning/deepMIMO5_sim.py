@@ -23,7 +23,7 @@ import matplotlib.pyplot as plt
 # from tensorflow.keras.layers import Layer, Conv2D, LayerNormalization
 # from tensorflow.nn import relu
 
-from deepMIMO5 import Transmitter, BinarySource, count_errors, count_block_errors
+from deepMIMO5 import Transmitter, BinarySource, sim_ber_mc, TransceiverRunner
 
 def ber_plot(ebno_dbs, bers, legend="", ylabel="BER", title="Bit Error Rate", ebno=True, xlim=None,
              ylim=None, is_bler=False, savefigpath='./data/ber.jpg'):
@@ -112,50 +112,21 @@ def ber_plot_single(ebno_dbs, bers, title = "BER Simulation", savefigpath='./dat
         plt.savefig(savefigpath)
         plt.close(fig)
 
-def sim_ber(ebno_dbs, eval_transceiver, b, batch_size,  channeltype='awgn'):
-    #num_points = 100  # Example value, replace with the actual value
-    ebno_dbs_np = np.array(ebno_dbs, dtype=np.float64)  # Cast to the desired data type
-    batch_size_np = np.array(batch_size, dtype=np.int32)  # Cast to the desired data type
-    num_points = ebno_dbs_np.shape[0] #20
-
-    bit_n = np.size(b) #272384
-    block_n = np.size(b[..., -1]) #128, b: (128, 1, 1, 2128)
-
-    bers = []
-    blers = []
-    BERs= []
-
-    for ebno_db in ebno_dbs:
-        b_hat, BER = eval_transceiver(b=b, ebno_db = ebno_db, channeltype=channeltype)
-        BERs.append(BER)
-        # count errors
-        bit_e = count_errors(b, b_hat)
-        block_e = count_block_errors(b, b_hat)
-
-        # Initialize NumPy arrays bit_errors, block_errors, nb_bits, and nb_blocks (if not already initialized)
-        nb_bits = np.zeros_like(bit_n, dtype=np.int64)
-        nb_blocks = np.zeros_like(block_n, dtype=np.int64)
-        #bit_errors = 0
-        #block_errors = 0
-        bit_errors = np.zeros_like(bit_e, dtype=np.int64)
-        block_errors = np.zeros_like(block_e, dtype=np.int64)
-
-        # Update variables
-        bit_errors = bit_errors + np.int64(bit_e)
-        block_errors = block_errors + np.int64(block_e)
-        nb_bits = nb_bits+ np.int64(bit_n)
-        nb_blocks = nb_blocks+ np.int64(block_n)
-
-        ber = np.divide(bit_errors.astype(np.float64), nb_bits.astype(np.float64))
-        bler = np.divide(block_errors.astype(np.float64), nb_blocks.astype(np.float64))
-
-        # Replace NaN values with zeros
-        ber = np.where(np.isnan(ber), np.zeros_like(ber), ber)
-        bler = np.where(np.isnan(bler), np.zeros_like(bler), bler)
-
-        bers.append(ber)
-        blers.append(bler)
-
+def sim_ber(ebno_dbs, eval_transceiver, b, batch_size, channeltype='awgn', max_mc_iter=1, num_target_bit_errors=None, num_target_block_errors=None, \
+            early_stop=True, csvpath=None, num_workers=0, seed=None):
+    #Monte-Carlo sweep: up to max_mc_iter batches per Eb/No point (fresh bits after the first batch of b) until the target errors are reached,
+    #stops once a point is error free, each finished point is appended to csvpath
+    #num_workers>0 runs the points in a process pool, pass a TransceiverRunner as eval_transceiver in that case
+    #batch_size is not used (the batch is the shape of b), kept only for call compatibility
+    if isinstance(eval_transceiver, TransceiverRunner):
+        eval_fn = eval_transceiver
+    else:
+        eval_fn = lambda b, ebno_db: eval_transceiver(b=b, ebno_db=ebno_db, channeltype=channeltype)
+    results = sim_ber_mc(ebno_dbs, eval_fn, b, max_mc_iter=max_mc_iter, num_target_bit_errors=num_target_bit_errors, \
+                         num_target_block_errors=num_target_block_errors, early_stop=early_stop, csvpath=csvpath, num_workers=num_workers, seed=seed)
+    bers = [np.float64(result['ber']) for result in results]
+    blers = [np.float64(result['bler']) for result in results]
+    BERs = [result['BER'] for result in results]
     return bers, blers, BERs
 
 def simulationloop(ebno_dbs, eval_transceiver, b=None, channeltype='awgn'):
@@ -208,7 +179,7 @@ if __name__ == '__main__':
     # Start Transmitter self.k Number of information bits per codeword
     b = binary_source([BATCH_SIZE, 1, NUM_STREAMS_PER_TX, k]) #[batch_size, num_tx, num_streams_per_tx, num_databits]
     
-    bers, blers, BERs = sim_ber(ebno_dbs, eval_transceiver, b, BATCH_SIZE,  channeltype='awgn')
+    bers, blers, BERs = sim_ber(ebno_dbs, eval_transceiver, b, BATCH_SIZE,  channeltype='awgn', max_mc_iter=100, num_target_block_errors=100, csvpath='./data/ber.csv')
     ber_plot_single(ebno_dbs, bers, title = "BER Simulation", savefigpath='./data/ber.jpg')
 
     #Multi-scenario testing
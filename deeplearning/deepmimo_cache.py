@@ -0,0 +1,91 @@
+#Content-addressed cache for DeepMIMO.generate_data
+#The generation parameters (scenario, rows, antennas, OFDM settings, num_paths, ...) are hashed, the generated dataset is stored as
+#<cachefolder>/deepmimo_<hash>.npz and loaded back into the same list-of-dicts structure DeepMIMO returns.
+#Ragged per-user path lists (ToA, DoA, power, ... of different lengths) are stored concatenated with their lengths.
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+import DeepMIMO
+
+def _json_default(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+def parameters_hash(parameters):
+    version = getattr(DeepMIMO, '__version__', '')
+    text = json.dumps({'parameters': parameters, 'version': version}, sort_keys=True, default=_json_default)
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+def _flatten(obj, prefix, out):
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            _flatten(value, prefix+str(key)+'/', out)
+    elif isinstance(obj, list) and len(obj) > 0 and isinstance(obj[0], dict):
+        #list of dicts, e.g., the per-user 'paths'
+        out[prefix+'__list'] = np.array(len(obj))
+        for key in obj[0]:
+            values = [np.asarray(item[key]) for item in obj]
+            out[prefix+str(key)+'/__lengths'] = np.array([value.shape[0] if value.ndim > 0 else -1 for value in values]) #-1: scalar
+            out[prefix+str(key)+'/__data'] = np.concatenate([np.atleast_1d(value) for value in values])
+    else:
+        out[prefix[:-1]] = np.asarray(obj)
+
+def save_deepmimo(path, DeepMIMO_dataset):
+    out = {'__num_bs': np.array(len(DeepMIMO_dataset))}
+    for i_bs, bs in enumerate(DeepMIMO_dataset):
+        _flatten(bs, f'{i_bs}/', out)
+    #unique temp file in the cache folder, concurrent writers of the same entry do not clobber each other
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path) or '.', suffix='.tmp', delete=False) as tmp:
+        try:
+            np.savez_compressed(tmp, **out)
+        except BaseException:
+            tmp.close()
+            os.remove(tmp.name)
+            raise
+    os.replace(tmp.name, path) #concurrent readers (e.g., DataLoader workers) never see a partial file
+
+def _set(tree, keys, value):
+    for key in keys[:-1]:
+        tree = tree.setdefault(key, {})
+    tree[keys[-1]] = value
+
+def load_deepmimo(path):
+    with np.load(path, allow_pickle=True) as data:
+        data = {key: data[key] for key in data.files}
+    DeepMIMO_dataset = [{} for _ in range(int(data.pop('__num_bs')))]
+    lists = {key[:-len('/__list')]: int(value) for key, value in data.items() if key.endswith('/__list')}
+    for key, value in data.items():
+        if key.endswith('/__list') or key.endswith('/__lengths') or key.endswith('/__data'):
+            continue
+        keys = key.split('/')
+        _set(DeepMIMO_dataset[int(keys[0])], keys[1:], value[()] if value.ndim == 0 else value)
+    for listkey, length in lists.items():
+        items = [{} for _ in range(length)]
+        for key in data:
+            if key.startswith(listkey+'/') and key.endswith('/__lengths'):
+                name = key[len(listkey)+1:-len('/__lengths')]
+                lengths, values = data[key], data[listkey+'/'+name+'/__data']
+                offsets = np.concatenate([[0], np.cumsum(np.where(lengths < 0, 1, lengths))]) #scalars take one slot
+                for i, n in enumerate(lengths):
+                    items[i][name] = values[offsets[i]] if n < 0 else values[offsets[i]:offsets[i]+n]
+        keys = listkey.split('/')
+        _set(DeepMIMO_dataset[int(keys[0])], keys[1:], items)
+    return DeepMIMO_dataset
+
+def generate_data_cached(parameters, cachefolder='data/deepmimo_cache'):
+    #drop-in for DeepMIMO.generate_data(parameters), cachefolder=None disables the cache
+    if cachefolder is None:
+        return DeepMIMO.generate_data(parameters)
+    path = os.path.join(cachefolder, 'deepmimo_'+parameters_hash(parameters)+'.npz')
+    if os.path.exists(path):
+        print("Load DeepMIMO dataset from cache:", path)
+        return load_deepmimo(path)
+    DeepMIMO_dataset = DeepMIMO.generate_data(parameters)
+    os.makedirs(cachefolder, exist_ok=True)
+    save_deepmimo(path, DeepMIMO_dataset)
+    return DeepMIMO_dataset
@@ -0,0 +1,194 @@
+#Numpy MIMO equalizers for the per resource element model y = Hx + n (no TensorFlow needed)
+#   y: [..., num_rx_ant], h: [..., num_rx_ant, num_streams], s: noise-plus-interference covariance [..., num_rx_ant, num_rx_ant]
+#   or only its diagonal [..., num_rx_ant] (no interfering streams), which skips the matrix factorizations of s
+#Every equalizer returns x_hat [..., num_streams] and the effective noise variance no_eff [..., num_streams] of x_hat = x + e,
+#the same as lmmse_equalizer, zf_equalizer and mf_equalizer of sionna_tf. All resource elements are solved at once by the batched
+#np.linalg.cholesky / np.linalg.solve on the stacked small matrices.
+#OFDMEqualizer(...)([y, h_hat, err_var, no]) is the numpy counterpart of sionna_tf.MyOFDMEqualizer (same inputs and outputs).
+import numpy as np
+
+def _herm(x):
+    return np.conj(np.swapaxes(x, -1, -2))
+
+def _is_diag(y, s):
+    #s holds only the diagonal of the covariance matrix
+    return np.ndim(s) == np.ndim(y)
+
+def _stack(y, h):
+    #[y, h] as one right-hand side [..., M, 1+K] for the solves
+    shape = np.broadcast_shapes(y.shape[:-1], h.shape[:-2])
+    y = np.broadcast_to(y[...,None], shape+y.shape[-1:]+(1,))
+    h = np.broadcast_to(h, shape+h.shape[-2:])
+    return np.concatenate([y, h], axis=-1)
+
+def whiten_channel(y, h, s):
+    #multiplies y and h from the left by L^-1 with S = LL^H (Cholesky), the whitened noise covariance is the identity
+    if _is_diag(y, s):
+        w = 1/np.sqrt(np.real(s)).astype(y.dtype)
+        return y*w, h*w[...,None]
+    l = np.linalg.cholesky(s)
+    z = np.linalg.solve(l, _stack(y, h))
+    return z[...,0], z[...,1:]
+
+def lmmse_equalizer(y, h, s, whiten_interference=True):
+    #x_hat = diag(GH)^-1 Gy with G = H^H(HH^H+S)^-1, no_eff = diag(GH)^-1 - 1
+    #whiten_interference: G = (H^H S^-1 H + I)^-1 H^H S^-1 computed on the whitened channel, only a num_streams x num_streams solve
+    num_streams = h.shape[-1]
+    if whiten_interference:
+        y, h = whiten_channel(y, h, s)
+        hh = _herm(h)
+        a = hh @ h + np.eye(num_streams, dtype=h.dtype)
+        z = np.linalg.solve(a, hh @ _stack(y, h)) #[..., K, 1+K]: Gy and GH
+        gy, gh = z[...,0], z[...,1:]
+    else:
+        hh = _herm(h)
+        c = h @ hh
+        if _is_diag(y, s):
+            c = c + s[...,None]*np.eye(h.shape[-2], dtype=h.dtype)
+        else:
+            c = c + s
+        z = hh @ np.linalg.solve(c, _stack(y, h))
+        gy, gh = z[...,0], z[...,1:]
+    d = np.diagonal(gh, axis1=-2, axis2=-1)
+    x_hat = gy/d
+    no_eff = np.real(1/d - 1)
+    return x_hat, no_eff
+
+def _gsg_diag(g, s, y):
+    #diag(G S G^H) for G [..., K, M]
+    if _is_diag(y, s):
+        return np.sum(np.abs(g)**2*np.real(s)[...,None,:], axis=-1)
+    return np.real(np.sum((g @ s)*np.conj(g), axis=-1))
+
+def zf_equalizer(y, h, s):
+    #x_hat = Gy with G = (H^H H)^-1 H^H, no_eff = diag(G S G^H)
+    hh = _herm(h)
+    z = np.linalg.solve(hh @ h, hh @ _stack(y, np.eye(h.shape[-2], dtype=h.dtype))) #[..., K, 1+M]: Gy and G
+    x_hat, g = z[...,0], z[...,1:]
+    no_eff = _gsg_diag(g, s, y)
+    return x_hat, no_eff
+
+def mf_equalizer(y, h, s):
+    #matched filter (MRC): x_hat = Gy with G = diag(H^H H)^-1 H^H
+    #no_eff = diag(G S G^H) + the residual interference of the other streams sum_j |(GH-I)_kj|^2
+    g = _herm(h)/np.sum(np.abs(h)**2, axis=-2)[...,None].astype(h.dtype)
+    x_hat = (g @ y[...,None])[...,0]
+    gh = g @ h
+    no_eff = _gsg_diag(g, s, y) + np.sum(np.abs(gh - np.eye(h.shape[-1], dtype=h.dtype))**2, axis=-1)
+    return x_hat, no_eff
+
+EQUALIZERS = {'lmmse': lmmse_equalizer, 'zf': zf_equalizer, 'mrc': mf_equalizer}
+
+class OFDMEqualizer:
+    #equalizer: one of EQUALIZERS or a callable (y, h, s) -> (x_hat, no_eff) as the functions above
+    #resource_grid, stream_management: MyResourceGrid and StreamManagement of deepMIMO5 (or the sionna ones)
+    #memory_budget: approximate number of bytes for the solver temporaries, the resource elements are equalized in chunks that fit into it
+    #Input (y, h_hat, err_var, no):
+    #   y: [batch_size, num_rx, num_rx_ant, num_ofdm_symbols, fft_size]
+    #   h_hat: [batch_size, num_rx, num_rx_ant, num_tx, num_streams_per_tx, num_ofdm_symbols, num_effective_subcarriers]
+    #   err_var: broadcastable to h_hat, no: [batch_size, num_rx, num_rx_ant] or only the first n dims
+    #Output x_hat, no_eff: [batch_size, num_tx, num_streams_per_tx, num_data_symbols]
+    def __init__(self, equalizer, resource_grid, stream_management, dtype=np.complex64, memory_budget=2**28):
+        if isinstance(equalizer, str):
+            assert equalizer in EQUALIZERS, f"equalizer must be one of {list(EQUALIZERS)}"
+            equalizer = EQUALIZERS[equalizer]
+        assert callable(equalizer)
+        self._equalizer = equalizer
+        self._dtype = np.dtype(dtype)
+        self._real_dtype = np.finfo(self._dtype).dtype
+        self._stream_management = stream_management
+        self.memory_budget = memory_budget
+        self._sc_ind = np.asarray(resource_grid.effective_subcarrier_ind)
+
+        #only the resource elements carrying data for at least one stream are equalized
+        mask = np.array(resource_grid.pilot_pattern.mask) #(num_tx, num_streams_per_tx, num_ofdm_symbols, num_effective_subcarriers)
+        mask = np.reshape(mask, mask.shape[:2]+(-1,))
+        num_data_symbols = resource_grid.pilot_pattern.num_data_symbols
+        self._re_ind = np.where(np.any(mask==0, axis=(0, 1)))[0]
+        pos = np.zeros(mask.shape[-1], int)
+        pos[self._re_ind] = np.arange(len(self._re_ind))
+        #data symbols of every stream in ascending order, as indices into _re_ind
+        data_ind = np.argsort(mask!=0, axis=-1, kind="stable")[...,:num_data_symbols]
+        self._data_ind = pos[data_ind] #(num_tx, num_streams_per_tx, num_data_symbols)
+
+    def _covariance(self, h_undesired, s_diag):
+        #noise + channel estimation error (diagonal) + undesired streams
+        if h_undesired.shape[-1] == 0:
+            return s_diag
+        s = h_undesired @ _herm(h_undesired)
+        s[..., np.arange(s.shape[-1]), np.arange(s.shape[-1])] += s_diag
+        return s
+
+    def __call__(self, inputs):
+        y, h_hat, err_var, no = [np.asarray(x) for x in inputs]
+        sm = self._stream_management
+        num_rx_ant = y.shape[2]
+
+        #[batch_size, num_rx, num_re, num_rx_ant], num_re: data carrying resource elements
+        y_dt = np.take(y, self._sc_ind, axis=-1)
+        y_dt = np.reshape(np.transpose(y_dt, [0, 1, 3, 4, 2]), y_dt.shape[:2]+(-1, num_rx_ant))
+        y_dt = y_dt[:,:,self._re_ind].astype(self._dtype)
+        batch_size, num_rx = y_dt.shape[:2]
+
+        #desired and undesired channels [batch_size, num_rx, num_re, num_rx_ant, num_streams_per_rx (num_interfering_streams_per_rx)]
+        h_dt = np.reshape(h_hat, h_hat.shape[:5]+(-1,))[...,self._re_ind] #(b, num_rx, num_rx_ant, num_tx, num_streams_per_tx, num_re)
+        h_dt = np.transpose(h_dt, [1, 3, 4, 0, 5, 2]) #(num_rx, num_tx, num_streams_per_tx, b, num_re, num_rx_ant)
+        h_dt = np.reshape(h_dt, (-1,)+h_dt.shape[3:])
+        def streams(ind, num):
+            h = np.reshape(h_dt[np.asarray(ind, int).reshape(-1)], (sm.num_rx, num)+h_dt.shape[1:])
+            return np.transpose(h, [2, 0, 3, 4, 1]).astype(self._dtype)
+        h_desired = streams(sm.detection_desired_ind, sm.num_streams_per_rx)
+        h_undesired = streams(sm.detection_undesired_ind, -1)
+
+        #diagonal of the noise covariance [batch_size or 1, num_rx or 1, num_re, num_rx_ant]
+        #channel estimation errors summed across all transmitters and streams, as err_var broadcast to h_hat
+        err_var = np.reshape(err_var, (1,)*(h_hat.ndim-err_var.ndim)+err_var.shape)
+        s_csi = np.sum(err_var, axis=(3, 4))*(h_hat.shape[3]*h_hat.shape[4]/(err_var.shape[3]*err_var.shape[4]))
+        s_csi = np.broadcast_to(s_csi, s_csi.shape[:3]+h_hat.shape[-2:])
+        s_csi = np.reshape(np.transpose(s_csi, [0, 1, 3, 4, 2]), s_csi.shape[:2]+(-1, s_csi.shape[2]))[:,:,self._re_ind]
+        no = np.reshape(no, no.shape+(1,)*(3-no.ndim))
+        no = np.broadcast_to(no, y.shape[:3])[:,:,None,:]
+        s_diag = (s_csi + no).astype(self._real_dtype)
+
+        #equalize all resource elements in chunks of the flattened [batch_size, num_rx, num_re]
+        num_streams = h_desired.shape[-1]
+        num_interferers = h_undesired.shape[-1]
+        y_dt = np.reshape(y_dt, (-1, num_rx_ant))
+        num = len(y_dt)
+        h_desired = np.reshape(h_desired, (num, num_rx_ant, num_streams))
+        h_undesired = np.reshape(h_undesired, (num, num_rx_ant, num_interferers))
+        s_diag = np.reshape(np.broadcast_to(s_diag, (batch_size, num_rx)+s_diag.shape[2:]), (num, num_rx_ant))
+        x_hat = np.empty([num, num_streams], self._dtype)
+        no_eff = np.empty([num, num_streams], self._real_dtype)
+        #bytes per resource element: covariance, right-hand sides and solver copies
+        per_re = self._dtype.itemsize*(num_rx_ant*num_rx_ant + 4*(num_rx_ant+num_streams)*(num_rx_ant+num_streams+1))
+        chunk = max(1, int(self.memory_budget//per_re))
+        for start in range(0, num, chunk):
+            sl = slice(start, start+chunk)
+            s = self._covariance(h_undesired[sl], s_diag[sl])
+            x_hat[sl], no_eff[sl] = self._equalizer(y_dt[sl], h_desired[sl], s)
+
+        #[num_tx, num_streams_per_tx, num_re, batch_size] in the stream order of the transmitters
+        def to_streams(x):
+            x = np.reshape(x, (batch_size, num_rx, -1, num_streams))
+            x = np.reshape(np.transpose(x, [1, 3, 2, 0]), (num_rx*num_streams,)+(x.shape[2], batch_size))
+            x = x[np.asarray(sm.stream_ind)]
+            x = np.reshape(x, (sm.num_tx, sm.num_streams_per_tx)+x.shape[1:])
+            #gather the data symbols and put the batch first [batch_size, num_tx, num_streams, num_data_symbols]
+            x = np.take_along_axis(x, self._data_ind[...,None], axis=2)
+            return np.ascontiguousarray(np.transpose(x, [3, 0, 1, 2]))
+        return to_streams(x_hat), to_streams(no_eff)
+
+class LMMSEEqualizer(OFDMEqualizer):
+    def __init__(self, resource_grid, stream_management, whiten_interference=True, dtype=np.complex64, memory_budget=2**28):
+        def equalizer(y, h, s):
+            return lmmse_equalizer(y, h, s, whiten_interference)
+        super().__init__(equalizer, resource_grid, stream_management, dtype=dtype, memory_budget=memory_budget)
+
+class ZFEqualizer(OFDMEqualizer):
+    def __init__(self, resource_grid, stream_management, dtype=np.complex64, memory_budget=2**28):
+        super().__init__(zf_equalizer, resource_grid, stream_management, dtype=dtype, memory_budget=memory_budget)
+
+class MFEqualizer(OFDMEqualizer):
+    def __init__(self, resource_grid, stream_management, dtype=np.complex64, memory_budget=2**28):
+        super().__init__(mf_equalizer, resource_grid, stream_management, dtype=dtype, memory_budget=memory_budget)
@@ -39,9 +39,10 @@ class OFDMEvalDataset(Dataset):
         mapping_table_QPSK, de_mapping_table_QPSK = mapping_table(2) # mapping table QPSK (e.g. for pilot symbols)
         self.mapping_table_Qm, self.de_mapping_table_Qm = mapping_table(Qm, plot=False) # mapping table for Qm
 
-        self.TTI_mask_RE = TTI_mask(S=self.S,F=self.F, Fp=self.Fp, Sp=self.Sp, FFT_offset=self.FFT_offset, plotTTI=False) #[14, 128]
+        self.layout = OFDMFrameLayout(S=self.S, F=self.F, Fp=self.Fp, Sp=self.Sp, FFT_size=self.FFT_size, CP=self.CP) # precomputed gather indices
+        self.TTI_mask_RE = self.layout.TTI_mask_RE #[14, 128]
         #among TTI_mask, 958 places are 1 (means data)
-        self.pilot_symbols = pilot_set(self.TTI_mask_RE, Pilot_Power) #[36]
+        self.pilot_symbols = self.layout.pilot_symbols #[36]
         
     def __len__(self):
         return self.maxdatalen
@@ -55,14 +56,8 @@ class OFDMEvalDataset(Dataset):
         RX_Samples = apply_multipath_channel(TX_Samples, n_taps=self.n_taps, max_delay=self.max_delay, random_start=False, repeats=0, SINR_s=ch_SINR, leading_zeros=self.leading_zeros)
 
         #Create groundtruth labels:
-        # create a bit stream matrix, the same shape as TTI mask RE
-        TTI_mask_indices = torch.where(self.TTI_mask_RE==1) #[14, 128]
-        TTI_3d = torch.zeros((self.TTI_mask_RE.shape[0], self.TTI_mask_RE.shape[1], pdsch_bits.shape[1]), dtype=pdsch_bits.dtype) #[14, 128, 6]
-        row_indices, col_indices = TTI_mask_indices #[958]
-        #TTI_3d: [14, 128, 6]
-        TTI_3d[row_indices, col_indices, :] = pdsch_bits.clone().detach() #[958, 6]->[14, 128, 6]
-        TTI_3d = remove_fft_Offests(TTI_3d, F, FFT_offset) #[14, 72, 6]
-        TTI_3d = torch.cat((TTI_3d[:, :F//2,:], TTI_3d[:, F//2 + 1:,:]), dim=1)  # remove DC, [14, 71, 6]
+        # bit grid without FFT offsets and DC, data REs filled with their bits
+        TTI_3d = self.layout.label_grid(pdsch_bits) #[958, 6]->[14, 71, 6]
         batch={}
         batch['rx_samples']=RX_Samples
         batch['labels']=TTI_3d #[14, 71, 6]
@@ -81,9 +76,10 @@ class MultiReceiver():
         self.FFT_offset = int((self.FFT_size - self.F) / 2)  # FFT offset
         self.CP = CP  # Cyclic prefix
 
-        self.TTI_mask_RE = TTI_mask(S=self.S,F=self.F, Fp=self.Fp, Sp=self.Sp, FFT_offset=self.FFT_offset, plotTTI=False) #[14, 128]
+        self.layout = OFDMFrameLayout(S=self.S, F=self.F, Fp=self.Fp, Sp=self.Sp, FFT_size=self.FFT_size, CP=self.CP) # precomputed gather indices
+        self.TTI_mask_RE = self.layout.TTI_mask_RE #[14, 128]
         #among TTI_mask, 958 places are 1 (means data)
-        self.pilot_symbols = pilot_set(self.TTI_mask_RE, Pilot_Power) #[36]
+        self.pilot_symbols = self.layout.pilot_symbols #[36]
 
         mapping_table_QPSK, de_mapping_table_QPSK = mapping_table(2) # mapping table QPSK (e.g. for pilot symbols)
         self.mapping_table_Qm, self.de_mapping_table_Qm = mapping_table(Qm, plot=False) # mapping table for Qm
@@ -98,25 +94,15 @@ class MultiReceiver():
         self.TTI_mask_RE_3d = TTI_mask_RE_3d.expand(self.S, self.F-1, self.Qm) #[14, 71, 6]
         self.index_one =  self.TTI_mask_RE_3d==1 #[14, 71, 6]
 
-    #for all receivers
+    #for all receivers, RX_Samples: [N] or a batch [B, N]
     def receiver_preprocessing(self, RX_Samples):
-        #RX_Samples = batch['rx_samples']
-        #step1: CP remove
-        symbol_index = 1 #starting place
-        RX_NO_CP = CP_removal(RX_Samples, symbol_index, self.S, self.FFT_size, self.CP, plotsig=False)# remove cyclic prefix and other symbols created by convolution
-        RX_NO_CP = RX_NO_CP / torch.max(torch.abs(RX_NO_CP)) # normalize
-        #torch.Size([14, 128])
-
-        #back into the frequency domain
-        OFDM_demod = DFT(RX_NO_CP, plotDFT=False) # DFT
-        #batch['OFDM_demod'] = OFDM_demod
-        return OFDM_demod
+        return self.layout.receiver_preprocessing(RX_Samples) #[14, 128] or [B, 14, 128]
 
     def ZHLSreceiver(self, OFDM_demod):
-        #OFDM_demod [14, 128]
-        H_estim = channelEstimate_LS(self.TTI_mask_RE, self.pilot_symbols, self.F, self.FFT_offset, self.Sp, OFDM_demod, plotEst=False) # estimate the channel using least squares and plot
+        #OFDM_demod [14, 128] or [B, 14, 128]
+        H_estim = self.layout.channel_estimate_LS(OFDM_demod) # estimate the channel using least squares
 
-        OFDM_demod_no_offsets = remove_fft_Offests(OFDM_demod, self.F, self.FFT_offset) # remove the FFT offsets and DC carrier from the received signal
+        OFDM_demod_no_offsets = self.layout.remove_offsets(OFDM_demod) # remove the FFT offsets and DC carrier from the received signal
         #[14, 72]
         #[14, 128]->[14, 72] (28:28+72)
 
@@ -125,47 +111,39 @@ class MultiReceiver():
         #[14, 72]
 
         #Payload Symbols extraction
-        QAM_est = get_payload_symbols(self.TTI_mask_RE, equalized_H_estim, self.FFT_offset, self.F, plotQAM=False) # get the payload symbols from
-        #[958]
+        QAM_est = self.layout.payload_symbols(equalized_H_estim) # get the payload symbols from
+        #[958] or [B, 958]
 
         #Converting OFDM Symbols to Data
         PS_est, hardDecision = Demapping(QAM_est, self.de_mapping_table_Qm) # demap the symbols back to codewords
         #PS_est[958, 6] bits
         #hardDecision[958] mapped complex value
         #[958, 6] bits =>[5748]
-        binary_predictions = PS(PS_est) # convert the codewords to the bitstream
-        #0 1 bits [5748]
-        # convert to bits
-        #binary_predictions = torch.tensor(PS(PS_est).flatten().cpu(), dtype=torch.int8) #[5748]
+        binary_predictions = PS_est.flatten(-2) # convert the codewords to the bitstream (per TTI for a batch)
+        #0 1 bits [5748] or [B, 5748]
         return binary_predictions
 
 
     def NNpreprocessing(self, OFDM_demod):
-        OFDM_demod = OFDM_demod / torch.max(torch.abs(OFDM_demod)) # normalize DFT'd signal for NN input
-        #torch.Size([14, 128])
-        #F is number of carriers
-        pdsch_symbols_map = remove_fft_Offests(OFDM_demod, self.F, self.FFT_offset) # remove FFT offsets
-        #[14, 72]
-        # remove DC
-        pdsch_symbols_map = torch.cat((pdsch_symbols_map[:, :self.F//2], pdsch_symbols_map[:, self.F//2 + 1:]), dim=1) 
-        # [14, 71]
-        return pdsch_symbols_map
+        return self.layout.NNpreprocessing(OFDM_demod) #[14, 71] or [B, 14, 71]
 
     def NNinference(self, model, pdsch_symbols_map, device):
-        pdsch_symbols_map=torch.unsqueeze(pdsch_symbols_map, dim=0).to(device) #[14, 71]=>[1, 14, 71]
-        test_outputs = model(pdsch_symbols_map) #[1, 14, 71]->[1, 14, 71, 6]
-        #binary_predictions = test_outputs.squeeze()[TTI_mask_RE_3d==1] #[91968]
-        binary_predictions = test_outputs.squeeze() #[14, 71, 6]
+        batched = pdsch_symbols_map.dim() > 2
+        if not batched:
+            pdsch_symbols_map=torch.unsqueeze(pdsch_symbols_map, dim=0) #[14, 71]=>[1, 14, 71]
+        test_outputs = model(pdsch_symbols_map.to(device)) #[B, 14, 71]->[B, 14, 71, 6]
         
         #Fetch the payload
-        binary_predictions = binary_predictions[self.index_one] #[5748]
+        binary_predictions = test_outputs[..., self.index_one.to(test_outputs.device)] #[B, 5748]
         binary_predictions = torch.round(binary_predictions)
+        if not batched:
+            binary_predictions = binary_predictions.squeeze(0) #[5748]
         return binary_predictions.cpu()
     
     def evaluate(self, binary_predictions, test_labels):
-        test_labels = test_labels.squeeze() #[14, 71, 6]
-        #index_one =  TTI_mask_RE_3d==1
-        test_labels = test_labels[self.index_one] #[5748]
+        #binary_predictions: [5748] or [B, 5748], test_labels: [14, 71, 6] or [B, 14, 71, 6]
+        test_labels = test_labels[..., self.index_one.to(test_labels.device)] #[5748] or [B, 5748]
+        binary_predictions = binary_predictions.to(test_labels.device)
         
         # Calculate Bit Error Rate (BER) for the NN-receiver
         error_count = torch.sum(binary_predictions != test_labels).float()  # Count of unequal bits
@@ -193,24 +171,21 @@ def test():
 
     eval_data = OFDMEvalDataset(Qm=Qm, S=S, Sp=Sp, F=F)
     onebatch = eval_data[0]
-    test_dataloader = DataLoader(eval_data, batch_size=1, shuffle=True)
+    test_dataloader = DataLoader(eval_data, batch_size=16, shuffle=True)
     onebatch = next(iter(test_dataloader))
     rx_samples = onebatch['rx_samples']
     data_labels = onebatch['labels']
     print(f"Feature batch shape: {rx_samples.size()}") #[Batch_size, 2078]
     print(f"Labels batch shape: {data_labels.size()}") #[Batch_size, 14, 71, 6]
-    rx_samples=rx_samples.squeeze() #[2078]
-    data_labels=data_labels.squeeze() #[14, 71, 6]
-    
 
     multiprocessor = MultiReceiver(Qm=Qm, S=S, Sp=Sp, F=F)
-    #back into the frequency domain
-    OFDM_demod = multiprocessor.receiver_preprocessing(rx_samples) #[14, 128]
+    #back into the frequency domain, the receivers work on the whole batch
+    OFDM_demod = multiprocessor.receiver_preprocessing(rx_samples) #[16, 14, 128]
 
     ZHLS_binary_predictions = multiprocessor.ZHLSreceiver(OFDM_demod)
     ZHLS_BER, ZHLS_wrongs = multiprocessor.evaluate(ZHLS_binary_predictions, data_labels)
 
-    pdsch_symbols_map = multiprocessor.NNpreprocessing(OFDM_demod) #[14, 128] ->[14, 71]
+    pdsch_symbols_map = multiprocessor.NNpreprocessing(OFDM_demod) #[16, 14, 128] ->[16, 14, 71]
     NN_binary_predictions = multiprocessor.NNinference(model, pdsch_symbols_map, device)
     NN_BER, NN_wrongs = multiprocessor.evaluate(NN_binary_predictions, data_labels)
     print(NN_BER)
@@ -218,8 +193,7 @@ def test():
 def evalmain():
     device, useamp=get_device(gpuid='0', useamp=False)
 
-    dataset = CustomDataset()
-    dataset = torch.load('output/ofdm_dataset.pth')
+    dataset = load_dataset('output/ofdm_dataset')
     batch_size = 16
     val_batch_size = 1
 
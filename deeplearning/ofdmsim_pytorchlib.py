@@ -1,10 +1,10 @@
 import torch
-import torch.nn.functional as tFunc
 from torch.utils.data import Dataset
 import numpy as np
 import random
 import matplotlib.pyplot as plt
 import pandas as pd
+from datastore import ShardWriter, ShardDataset, is_store
 
 save_plots = False
 
@@ -123,6 +123,120 @@ def pilot_set(TTI_mask, power_scaling=1.0):
 
     return pilots #torch.Size([36])
 
+#Precomputed OFDM frame layout: the TTI mask and all gather indices derived from (S, F, Fp, Sp, FFT_size, CP), built once.
+#Every method takes a single TTI or a batch [..., ] and is one index_select/gather on the input's device.
+class OFDMFrameLayout():
+    def __init__(self, S=14, F=72, Fp=2, Sp=2, FFT_size=128, CP=20, device='cpu'):
+        self.S = S  # Number of symbols
+        self.F = F  # Number of subcarriers, including DC
+        self.Fp = Fp  # Pilot subcarrier spacing
+        self.Sp = Sp  # Pilot symbol, 0 for none
+        self.FFT_size = FFT_size  # FFT size
+        self.CP = CP  # Cyclic prefix
+        self.FFT_offset = int((FFT_size - F) / 2)  # FFT offset=28
+
+        self.TTI_mask_RE = TTI_mask(S=S, F=F, Fp=Fp, Sp=Sp, FFT_offset=self.FFT_offset, plotTTI=False) #[14, 128]
+        self.pilot_symbols = pilot_set(self.TTI_mask_RE, Pilot_Power) #[36]
+
+        # time domain: payload samples of every symbol (CP removed) relative to the TTI start, [14*128]
+        symbols = torch.arange(S).view(-1, 1)
+        self.payload_index = ((symbols + 1) * CP + symbols * FFT_size + torch.arange(FFT_size)).flatten()
+
+        # frequency domain: subcarriers without FFT offsets [72], and without FFT offsets and DC [71]
+        self.subcarrier_index = torch.arange(self.FFT_offset, self.FFT_offset + F)
+        self.nodc_index = torch.cat((self.subcarrier_index[:F//2], self.subcarrier_index[F//2 + 1:]))
+
+        # flat RE indices (same order as TTI_mask_RE[mask]) in the [14, 128], [14, 72] and [14, 71] grids
+        self.data_index = torch.nonzero(self.TTI_mask_RE.flatten() == 1).squeeze(1) #[958]
+        self.pilot_index = torch.nonzero(self.TTI_mask_RE.flatten() == 2).squeeze(1) #[36]
+        self.data_index_F = torch.nonzero(self.TTI_mask_RE[:, self.subcarrier_index].flatten() == 1).squeeze(1) #[958]
+        self.data_index_nodc = torch.nonzero(self.TTI_mask_RE[:, self.nodc_index].flatten() == 1).squeeze(1) #[958]
+
+        # LS channel estimation: linear interpolation (torch_interp) of the pilots of symbol Sp onto the F subcarriers
+        pilot_subcarriers = torch.nonzero(self.TTI_mask_RE[Sp] == 2).squeeze(1) #[36] 28:30:32...
+        interp_left = torch.clamp(torch.searchsorted(pilot_subcarriers, self.subcarrier_index, right=True), 0, len(pilot_subcarriers) - 1)
+        interp_right = torch.clamp(interp_left - 1, 0, len(pilot_subcarriers) - 1)
+        x_left, x_right = pilot_subcarriers[interp_left], pilot_subcarriers[interp_right]
+        self.interp_left = interp_left
+        self.interp_right = interp_right
+        self.interp_weight = (self.subcarrier_index - x_left) / (x_right - x_left) #[72]
+        self.to(device)
+
+    def to(self, device):
+        for name, value in vars(self).items():
+            if torch.is_tensor(value):
+                setattr(self, name, value.to(device))
+        self.device = device
+        return self
+
+    #[..., N] => [..., S, FFT_size], TTI_start: int or a tensor [...] (e.g. from batched sync_TTI)
+    def remove_cp(self, rx_signal, TTI_start=1):
+        if torch.is_tensor(TTI_start) and TTI_start.dim() > 0:
+            index = TTI_start.to(rx_signal.device).unsqueeze(-1) + self.payload_index.to(rx_signal.device)
+            rx_signal_no_CP = torch.gather(rx_signal, -1, index)
+        else:
+            rx_signal_no_CP = torch.index_select(rx_signal, -1, int(TTI_start) + self.payload_index.to(rx_signal.device))
+        return rx_signal_no_CP.reshape(rx_signal.shape[:-1] + (self.S, self.FFT_size))
+
+    # RE extraction from the [..., S, FFT_size] grid
+    def data_symbols(self, OFDM_demod):
+        return torch.index_select(OFDM_demod.flatten(-2), -1, self.data_index.to(OFDM_demod.device)) #[..., 958]
+
+    def pilots(self, OFDM_demod):
+        return torch.index_select(OFDM_demod.flatten(-2), -1, self.pilot_index.to(OFDM_demod.device)) #[..., 36]
+
+    #[..., S, FFT_size] => [..., S, F]
+    def remove_offsets(self, OFDM_demod):
+        return torch.index_select(OFDM_demod, -1, self.subcarrier_index.to(OFDM_demod.device))
+
+    #[..., S, FFT_size] => [..., S, F-1], FFT offsets and DC removed (NN input)
+    def remove_dc(self, OFDM_demod):
+        return torch.index_select(OFDM_demod, -1, self.nodc_index.to(OFDM_demod.device))
+
+    #receiver front end for all receivers: CP removal, per TTI normalization and DFT, [..., N] => [..., S, FFT_size]
+    def receiver_preprocessing(self, RX_Samples, TTI_start=1):
+        RX_NO_CP = self.remove_cp(RX_Samples, TTI_start) # remove cyclic prefix and other symbols created by convolution
+        RX_NO_CP = RX_NO_CP / torch.amax(torch.abs(RX_NO_CP), dim=(-2, -1), keepdim=True) # normalize each TTI
+        return DFT(RX_NO_CP, plotDFT=False) # back into the frequency domain
+
+    #NN input: per TTI normalization of the DFT'd signal, FFT offsets and DC removed, [..., S, FFT_size] => [..., S, F-1]
+    def NNpreprocessing(self, OFDM_demod):
+        OFDM_demod = OFDM_demod / torch.amax(torch.abs(OFDM_demod), dim=(-2, -1), keepdim=True)
+        return self.remove_dc(OFDM_demod)
+
+    #equalized [..., S, F] => payload symbols [..., 958]
+    def payload_symbols(self, equalized):
+        return torch.index_select(equalized.flatten(-2), -1, self.data_index_F.to(equalized.device))
+
+    #bits [..., 958, Qm] => label grid [..., S, F-1, Qm] with zeros on pilots and DC
+    def label_grid(self, pdsch_bits):
+        labels = torch.zeros(pdsch_bits.shape[:-2] + (self.S * (self.F - 1), pdsch_bits.shape[-1]), dtype=pdsch_bits.dtype, device=pdsch_bits.device)
+        labels[..., self.data_index_nodc.to(pdsch_bits.device), :] = pdsch_bits
+        return labels.view(pdsch_bits.shape[:-2] + (self.S, self.F - 1, pdsch_bits.shape[-1]))
+
+    #LS channel estimate on the pilots with magnitude/phase interpolation, same as channelEstimate_LS: [..., S, FFT_size] => [..., F]
+    def channel_estimate_LS(self, OFDM_demod):
+        device = OFDM_demod.device
+        H_estim_at_pilots = self.pilots(OFDM_demod) / self.pilot_symbols.to(device) #[..., 36]
+        left, right = self.interp_left.to(device), self.interp_right.to(device)
+        weight = self.interp_weight.to(device)
+        def interp(fp):
+            f_left, f_right = fp[..., left], fp[..., right]
+            return f_left + (f_right - f_left) * weight
+        H_estim_abs = interp(torch.abs(H_estim_at_pilots))
+        H_estim_phase = interp(torch.angle(H_estim_at_pilots))
+        return torch.polar(H_estim_abs, H_estim_phase) #[..., 72]
+
+#NN input features of the symbol map [..., S, F-1] => [..., 2, S, F-1] (real, imag) or [..., 4, S, F-1] (real, imag, magnitude, phase)
+def create_2Dfeature(pdsch_symbols_map, simple_stack=True):
+    y_real = pdsch_symbols_map.real
+    y_imag = pdsch_symbols_map.imag
+    if simple_stack:
+        return torch.stack([y_real, y_imag], dim=-3)
+    y_mag = y_real.pow(2) + y_imag.pow(2)
+    y_phase = torch.atan2(-y_imag + 0.0, y_real) # +0.0 removes -0.0 elements, which leads to error in calculating phase
+    return torch.stack([y_real, y_imag, y_mag, y_phase], dim=-3)
+
 #TTI_mask: [14, 128]
 #Qm = 6  # bits per symbol
 #mapping_table_Qm  64 len dict
@@ -214,48 +328,84 @@ def create_OFDM_data(TTI_mask_RE, Qm, mapping_table_Qm, pilot_symbols, leading_z
 #signal/TX_Samples 2072 (14*148) complex
 def apply_multipath_channel(signal, n_taps, max_delay, repeats=0, random_start=True, SINR_s=30, leading_zeros=500):
     # note that the output is max_delay longer than input, due to the delayed symbols of some of the taps
-
-    h = torch.zeros(max_delay+1, dtype=torch.complex64) #7
-
-    for _ in range(n_taps): #2
-        delay = torch.randint(1, max_delay, (1,)).item()  # Avoid delay=0 for remaining taps
-        magnitude = torch.abs(torch.randn(1)) * 0.5
-        phase = torch.randn(1)
-        complex_gain = magnitude * torch.exp(1j * phase)
-        h[delay] = complex_gain
-
-    h[0] = torch.complex(torch.randn(1), torch.randn(1))
-
+    return apply_multipath_channel_batch(signal.unsqueeze(0), n_taps, max_delay, repeats=repeats, random_start=random_start, \
+                                         SINR_s=SINR_s, leading_zeros=leading_zeros)[0]
+
+#Batched versions of create_OFDM_data/apply_multipath_channel, generate a whole batch of TTIs at once
+#constellation points ordered by symbol index (bits are the MSB-first binary of the index), [2^Qm] complex
+def constellation_points(mapping_table):
+    return torch.stack(list(mapping_table.values())).to(torch.complex64)
+
+#returns bits: [B, 958, Qm], TX_Samples: [B, 14*148=2072]
+def create_OFDM_data_batch(batch_size, TTI_mask_RE, Qm, constellation, pilot_symbols, leading_zeros=80, use_sdr=False, device='cpu'):
+    data_mask = (TTI_mask_RE == 1).to(device)
+    pilot_mask = (TTI_mask_RE == 2).to(device)
+    pdsch_elems = int(data_mask.sum()) #958
+    bits = torch.randint(0, 2, (batch_size, pdsch_elems, Qm), dtype=torch.float32, device=device)
+    #bits to symbol index, same order as mapping_table
+    weights = 2 ** torch.arange(Qm - 1, -1, -1, device=device, dtype=torch.float32)
+    symbol_index = (bits * weights).sum(dim=-1).long() #[B, 958]
+    pdsch_symbols = constellation.to(device)[symbol_index] * PDSCH_power
+    # map the PDSCH and pilot symbols to the TTI
+    Modulated_TTI = torch.zeros((batch_size,) + tuple(TTI_mask_RE.shape), dtype=torch.complex64, device=device) #[B, 14, 128]
+    Modulated_TTI[:, data_mask] = pdsch_symbols
+    Modulated_TTI[:, pilot_mask] = pilot_symbols.to(device=device, dtype=torch.complex64)
+    TD_TTI_IQ = torch.fft.ifft(torch.fft.ifftshift(Modulated_TTI, dim=-1), dim=-1) #[B, 14, 128]
+    TX_Samples = torch.cat((TD_TTI_IQ[..., -CP:], TD_TTI_IQ), dim=-1).reshape(batch_size, -1) # add the CP
+    if use_sdr:
+        zeros = torch.zeros((batch_size, leading_zeros), dtype=TX_Samples.dtype, device=device)
+        TX_Samples = torch.cat((zeros, TX_Samples), dim=1)
+    return bits, TX_Samples
+
+#draw the channel taps of apply_multipath_channel for a batch: h [B, max_delay+1]
+def multipath_taps_batch(batch_size, n_taps, max_delay, device='cpu'):
+    h = torch.zeros((batch_size, max_delay+1), dtype=torch.complex64, device=device)
+    rows = torch.arange(batch_size, device=device)
+    delays = torch.randint(1, max_delay, (batch_size, n_taps), device=device)  # Avoid delay=0 for remaining taps
+    gains = torch.abs(torch.randn(batch_size, n_taps, device=device)) * 0.5 * torch.exp(1j * torch.randn(batch_size, n_taps, device=device))
+    for tap in range(n_taps): #later taps overwrite earlier ones on the same delay, as in the loop version
+        h[rows, delays[:, tap]] = gains[:, tap].to(torch.complex64)
+    h[:, 0] = torch.complex(torch.randn(batch_size, device=device), torch.randn(batch_size, device=device))
     # Normalize the channel response
-    h = h / torch.norm(h)
-
-    # Convolve the signal with the channel
-    #https://pytorch.org/docs/stable/generated/torch.nn.functional.conv1d.html
-    convolved_signal = torch.nn.functional.conv1d(signal.unsqueeze(0).unsqueeze(0), 
-                                               h.unsqueeze(0).unsqueeze(0), 
-                                               padding=max_delay).squeeze()
-    
+    return h / torch.linalg.vector_norm(h, dim=1, keepdim=True)
+
+#Convolve every row with its own taps, conv1d semantics (correlation with h, padding=max_delay): [B, N] -> [B, N+max_delay]
+#method='conv': grouped conv1d, 'fft': FFT multiplication (faster for long signals or many taps)
+def multipath_convolve_batch(signals, h, method='conv'):
+    batch_size, num_taps = h.shape
+    max_delay = num_taps - 1
+    if method == 'fft':
+        n = signals.shape[1] + max_delay
+        spectrum = torch.fft.fft(signals, n=n, dim=1) * torch.fft.fft(torch.flip(h, dims=[1]), n=n, dim=1)
+        return torch.fft.ifft(spectrum, dim=1).to(signals.dtype)
+    return torch.nn.functional.conv1d(signals.unsqueeze(0), h.unsqueeze(1), padding=max_delay, groups=batch_size).squeeze(0)
+
+#signals: [B, N] complex on any device, SINR_s: scalar or [B]
+#batched apply_multipath_channel, every row gets its own taps, noise and random start, output [B, (leading_zeros+N+max_delay)*max(repeats,1)]
+def apply_multipath_channel_batch(signals, n_taps, max_delay, repeats=0, random_start=True, SINR_s=30, leading_zeros=500, method='conv'):
+    batch_size = signals.shape[0]
+    device = signals.device
+    h = multipath_taps_batch(batch_size, n_taps, max_delay, device=device)
+    convolved = multipath_convolve_batch(signals, h, method=method)
     # add leading zeros
-    zeros = torch.zeros(leading_zeros, dtype=convolved_signal.dtype)
-    convolved_signal = torch.cat((zeros, convolved_signal), dim=0)
-
-    # Add noise based on SINR
-    if SINR_s !=0:
-        signal_power = torch.mean(torch.abs(convolved_signal)**2)
-        noise_power = signal_power / (10 ** (SINR_s / 10))
-        noise = torch.sqrt(noise_power / 2) * (torch.randn_like(convolved_signal) + 1j * torch.randn_like(convolved_signal))
-        convolved_signal = convolved_signal + noise
-
-    # Add random start if required
+    zeros = torch.zeros((batch_size, leading_zeros), dtype=convolved.dtype, device=device)
+    convolved = torch.cat((zeros, convolved), dim=1)
+    # Add noise based on SINR, rows with SINR_s=0 stay noise free
+    SINR_s = torch.as_tensor(SINR_s, dtype=torch.float32, device=device).expand(batch_size)
+    signal_power = torch.mean(torch.abs(convolved)**2, dim=1)
+    noise_power = torch.where(SINR_s != 0, signal_power / (10 ** (SINR_s / 10)), torch.zeros_like(signal_power))
+    noise = torch.sqrt(noise_power / 2).unsqueeze(1) * (torch.randn_like(convolved.real) + 1j * torch.randn_like(convolved.real))
+    convolved = convolved + noise
+    # Add random start if required: per row torch.roll via a gather
     if random_start:
-        start_index = torch.randint(0, len(convolved_signal), (1,)).item()
-        convolved_signal = torch.roll(convolved_signal, shifts=start_index)    
-    
+        length = convolved.shape[1]
+        start_index = torch.randint(0, length, (batch_size, 1), device=device)
+        roll_index = (torch.arange(length, device=device).unsqueeze(0) - start_index) % length
+        convolved = torch.gather(convolved, 1, roll_index)
     # Repeat the signal if required
     if repeats > 0:
-        convolved_signal = convolved_signal.repeat(repeats)
-
-    return convolved_signal
+        convolved = convolved.repeat(1, repeats)
+    return convolved
 
 def radio_channel(tx_signal, ch_SINR, n_taps, max_delay, leading_zeros, tx_gain=0, rx_gain = 0, use_sdr=False):
     if use_sdr:
@@ -281,62 +431,73 @@ def PSD_plot(signal, Fs, f, info='TX'):
 
 #Synchronization is achieved through correlation. The beginning of a Transmission Time Interval (TTI) us selected based on the first value exceeding an adjustable threshold. 
 #Cyclic prefix covers ISI for CP symbols from that point onwards.
+#Complex cross-correlation via FFT, corr[..., k] = sum_n rx[..., k+n] * conj(tx[n]), valid lags only
+#rx_signal: [..., N_rx], tx_signal: [N_tx] or broadcastable [..., N_tx] -> [..., N_rx-N_tx+1]
+def correlate_fft(rx_signal, tx_signal):
+    rx_len = rx_signal.shape[-1]
+    tx_len = tx_signal.shape[-1]
+    nfft = rx_len
+    corr = torch.fft.ifft(torch.fft.fft(rx_signal, n=nfft, dim=-1) * torch.conj(torch.fft.fft(tx_signal, n=nfft, dim=-1)), dim=-1)
+    return corr[..., :rx_len-tx_len+1]
+
+#First index along the last dim where correlation > threshold, argmax for rows without any crossing
+def first_crossing(correlation, threshold):
+    exceed = correlation > threshold
+    found = exceed.any(dim=-1)
+    index = torch.where(found, torch.argmax(exceed.to(torch.uint8), dim=-1), torch.argmax(correlation, dim=-1))
+    return index, found
+
+#rx_signal: [N_rx] returns the TTI start index (int), or a batch [B, N_rx] returns a tensor [B]
 def sync_TTI(tx_signal, rx_signal, leading_zeros, threshold=6, plot=False):
 
-    # time sync using correlation
-
-    tx_len = tx_signal.numel()
-    rx_len = rx_signal.numel()
+    # time sync using complex (conjugate) FFT correlation
+    tx_len = tx_signal.shape[-1]
+    rx_len = rx_signal.shape[-1]
     end_point=rx_len-tx_len
 
-    rx_signal = rx_signal[leading_zeros:end_point]
-
-    # Calculate the cross-correlation using conv1d
-    corr_result_real = tFunc.conv1d(rx_signal.real.view(1, 1, -1), tx_signal.real.view(1, 1, -1)).view(-1)
-    corr_result_imag = tFunc.conv1d(rx_signal.imag.view(1, 1, -1), tx_signal.imag.view(1, 1, -1)).view(-1)
-    correlation =  torch.complex(corr_result_real, corr_result_imag)
-    correlation = correlation.abs()
-    threshold = correlation.mean()*threshold
-
-    # Find the first peak that exceeds the threshold
-    for i, value in enumerate(correlation):
-        if value > threshold:
-            if plot:
-                plt.figure(figsize=(8, 4))
-                plt.plot(correlation.abs()[i-10:i+50]) #only select -10~50 space
-                plt.grid()
-                plt.xlabel("Samples from selected index")
-                plt.ylabel("Complex conjugate correlation")
-                plt.axvline(x=10, color = 'r', linewidth=3)
-                if save_plots:
-                    plt.savefig('corr.png')
-                plt.show()
-
-            return i + leading_zeros
-        
-    i = torch.argmax(correlation).item() + leading_zeros
+    rx_signal = rx_signal[..., leading_zeros:end_point]
+    correlation = correlate_fft(rx_signal, tx_signal.to(rx_signal.dtype)).abs()
+    threshold = correlation.mean(dim=-1, keepdim=True)*threshold
+
+    # Find the first peak that exceeds the threshold (argmax if there is none)
+    index, found = first_crossing(correlation, threshold)
+    if rx_signal.dim() > 1:
+        return index + leading_zeros
+
+    i = index.item()
+    if plot and found.item():
+        plt.figure(figsize=(8, 4))
+        plt.plot(correlation[max(i-10, 0):i+50].cpu()) #only select -10~50 space
+        plt.grid()
+        plt.xlabel("Samples from selected index")
+        plt.ylabel("Complex conjugate correlation")
+        plt.axvline(x=min(i, 10), color = 'r', linewidth=3)
+        if save_plots:
+            plt.savefig('corr.png')
+        plt.show()
 
-    return i
+    return i + leading_zeros
 
 #rx_signal/RX_Samples 6474
 #TTI_start/symbol_index 1149
 #S=14 Number of symbols
+#rx_signal can be a batch [..., N], TTI_start an int or a tensor [...] (e.g. from batched sync_TTI) => [..., S, FFT_size]
 def CP_removal(rx_signal, TTI_start, S, FFT_size, CP, plotsig=False):
 
-    # Initialize a payload mask
-    b_payload = torch.zeros(len(rx_signal), dtype=torch.bool)
-
-    # Mark the payload parts of the signal
-    for s in range(S):
-        start_idx = TTI_start + (s + 1) * CP + s * FFT_size
-        end_idx = start_idx + FFT_size
-        b_payload[start_idx:end_idx] = 1
+    # Sample indices of the payload parts of the signal [S, FFT_size]
+    symbols = torch.arange(S, device=rx_signal.device).view(-1, 1)
+    payload_index = (symbols + 1) * CP + symbols * FFT_size + torch.arange(FFT_size, device=rx_signal.device)
 
     # Plotting the received signal and payload mask
     if plotsig:
-        # Assuming rx_signal is a PyTorch tensor
+        # Mark the payload parts of the signal (first signal of a batch)
+        rx_signal_0 = rx_signal.reshape(-1, rx_signal.shape[-1])[0]
+        start_0 = int(torch.as_tensor(TTI_start).flatten()[0])
+        b_payload = torch.zeros(len(rx_signal_0), dtype=torch.bool)
+        b_payload[(start_0 + payload_index).flatten().cpu()] = 1
+
         # Convert to NumPy array and ensure it's in a float format to avoid overflow
-        rx_signal_numpy = rx_signal.cpu().numpy()  # Use .cpu() if rx_signal is on GPU
+        rx_signal_numpy = rx_signal_0.cpu().numpy()  # Use .cpu() if rx_signal is on GPU
         rx_signal_normalized = rx_signal_numpy / np.max(np.abs(rx_signal_numpy))
 
         plt.figure(0, figsize=(8, 4))
@@ -351,9 +512,13 @@ def CP_removal(rx_signal, TTI_start, S, FFT_size, CP, plotsig=False):
         plt.show()
 
     # Remove the cyclic prefix
-    rx_signal_no_CP = rx_signal[b_payload]
+    if torch.is_tensor(TTI_start) and TTI_start.dim() > 0:
+        index = (TTI_start.to(rx_signal.device).view(-1, 1) + payload_index.view(1, -1)).view(TTI_start.shape + (-1,))
+        rx_signal_no_CP = torch.gather(rx_signal, -1, index)
+    else:
+        rx_signal_no_CP = rx_signal[..., int(TTI_start) + payload_index.flatten()]
 
-    return rx_signal_no_CP.view(S, FFT_size)
+    return rx_signal_no_CP.reshape(rx_signal.shape[:-1] + (S, FFT_size))
 
 
 #Null symbols were added into the beginning of each transmission to allow measuring the noise level at the receiver. 
@@ -378,14 +543,15 @@ def SINR(rx_signal, index, leading_zeros):
 
 #Fast Fourier Transform (FFT) transforms the received time-domain signal back into the frequency domain, 
 #where data on individual subcarriers can be independently demodulated.
+#rxsignal: [..., S, FFT_size]
 def DFT(rxsignal, plotDFT=False):
     # Calculate DFT
-    OFDM_RX_DFT = torch.fft.fftshift(torch.fft.fft(rxsignal, dim=1), dim=1)
+    OFDM_RX_DFT = torch.fft.fftshift(torch.fft.fft(rxsignal, dim=-1), dim=-1)
 
-    # Plot the DFT if required
+    # Plot the DFT if required (first TTI of a batch)
     if plotDFT:
         plt.figure(figsize=(8, 1.5))
-        plt.imshow(torch.abs(OFDM_RX_DFT).numpy(), aspect='auto')  # Convert tensor to NumPy array for plotting
+        plt.imshow(torch.abs(OFDM_RX_DFT.reshape((-1,) + OFDM_RX_DFT.shape[-2:])[0]).cpu().numpy(), aspect='auto')  # Convert tensor to NumPy array for plotting
         plt.xlabel('Subcarrier Index')
         plt.ylabel('Symbol')
         if save_plots:
@@ -395,11 +561,12 @@ def DFT(rxsignal, plotDFT=False):
     return OFDM_RX_DFT
 
 #performs linear interpolation to estimate function values at specified points x based on given data points (xp, fp)
+#fp can be a batch [..., len(xp)], the result is [..., len(x)]
 def torch_interp(x, xp, fp):
     # Ensure xp and fp are sorted
     sorted_indices = torch.argsort(xp) #Sort the indices of xp in ascending order.
     xp = xp[sorted_indices].to(device=x.device) #Reorder xp based on the sorted indices 
-    fp = fp[sorted_indices].to(device=x.device)
+    fp = fp[..., sorted_indices.to(device=fp.device)].to(device=x.device)
 
     # Find the indices to the left and right of x
     indices_left = torch.searchsorted(xp, x, right=True) #Find the indices of the right neighbors of x in xp
@@ -409,7 +576,7 @@ def torch_interp(x, xp, fp):
 
     # Perform linear interpolation
     x_left, x_right = xp[indices_left], xp[indices_right] #Get the x-values of the left and right neighbors.
-    f_left, f_right = fp[indices_left], fp[indices_right] #Get the corresponding function values.
+    f_left, f_right = fp[..., indices_left], fp[..., indices_right] #Get the corresponding function values.
     interp_values = f_left + (f_right - f_left) * (x - x_left) / (x_right - x_left) #Perform linear interpolation using the formula for a straight line between the neighbors.
 
     return interp_values
@@ -421,20 +588,21 @@ def channelEstimate_LS(TTI_mask_RE, pilot_symbols, F, FFT_offset, Sp, OFDM_demod
     # F: The total number of frequency bins (subcarriers).
     # FFT_offset: The starting frequency bin index.
     # Sp: Indices of the pilot symbols within the time-frequency grid.
-    # OFDM_demod: Demodulated received symbols (complex values) after OFDM demodulation.
+    # OFDM_demod: Demodulated received symbols (complex values) after OFDM demodulation, [14,128] or a batch [..., 14, 128].
+    device = OFDM_demod.device
     
     # Pilot extraction
-    pilots = OFDM_demod[TTI_mask_RE == 2] #[14,128]=>[36]
+    pilots = OFDM_demod[..., TTI_mask_RE.to(device) == 2] #[14,128]=>[36], [B,14,128]=>[B,36]
 
     # Divide the pilots by the set pilot values
     #Divide the extracted pilot symbols by the known pilot values to obtain an estimate of the channel response at those pilot positions.
-    H_estim_at_pilots = pilots / pilot_symbols #[36]/[36]=>[36]
+    H_estim_at_pilots = pilots / pilot_symbols.to(device) #[36]/[36]=>[36]
 
     # Interpolation indices, Identify the indices of the pilot symbols within the Sp range.
-    pilot_indices = torch.nonzero(TTI_mask_RE[Sp] == 2, as_tuple=False).squeeze() #[36] 28:30:32...
+    pilot_indices = torch.nonzero(TTI_mask_RE[Sp] == 2, as_tuple=False).squeeze().to(device) #[36] 28:30:32...
 
     # Interpolation for magnitude and phase
-    all_indices = torch.arange(FFT_offset, FFT_offset + F) #[72] 28:29:(28+72)
+    all_indices = torch.arange(FFT_offset, FFT_offset + F, device=device) #[72] 28:29:(28+72)
     
     # Linear interpolation for magnitude and phase
     H_estim_abs = torch_interp(all_indices, pilot_indices, torch.abs(H_estim_at_pilots))
@@ -453,8 +621,8 @@ def channelEstimate_LS(TTI_mask_RE, pilot_symbols, F, FFT_offset, Sp, OFDM_demod
 
     if plotEst:
         plt.figure(figsize=(8, 4))
-        plt.plot(pilot_indices.cpu().numpy(), dB(H_estim_at_pilots).cpu().numpy(), 'ro-', label='Pilot estimates', markersize=8)
-        plt.plot(all_indices.cpu().numpy(), dB(torch.tensor(H_estim)).cpu().numpy(), 'b-', label='Estimated channel', linewidth=2)
+        plt.plot(pilot_indices.cpu().numpy(), dB(H_estim_at_pilots.reshape(-1, H_estim_at_pilots.shape[-1])[0]).cpu().numpy(), 'ro-', label='Pilot estimates', markersize=8)
+        plt.plot(all_indices.cpu().numpy(), dB(H_estim.reshape(-1, H_estim.shape[-1])[0]).cpu().numpy(), 'b-', label='Estimated channel', linewidth=2)
         plt.grid(True, which='both', linestyle='--', linewidth=0.5, alpha=0.7)
         plt.xlabel('Subcarrier Index', fontsize=12)
         plt.ylabel('Magnitude (dB)', fontsize=12)
@@ -464,35 +632,37 @@ def channelEstimate_LS(TTI_mask_RE, pilot_symbols, F, FFT_offset, Sp, OFDM_demod
             plt.savefig('ChannelEstimate.png')
         plt.show()
 
-    return H_estim #[72]
+    return H_estim #[72] or [..., 72]
 
-def remove_fft_Offests(RX_NO_CP, F, FFT_offset):
+#dim: subcarrier dimension, 1 for [14, 128(, 6)], -1 for a batch [..., 14, 128]
+def remove_fft_Offests(RX_NO_CP, F, FFT_offset, dim=1):
 
     # Calculate indices for the remaining subcarriers after removing offsets
-    remaining_indices = torch.arange(FFT_offset, F + FFT_offset)
+    remaining_indices = torch.arange(FFT_offset, F + FFT_offset, device=RX_NO_CP.device)
 
     # Remove the FFT offsets using slicing
-    OFDM_demod = RX_NO_CP[:, remaining_indices]
+    OFDM_demod = torch.index_select(RX_NO_CP, dim, remaining_indices)
 
     return OFDM_demod
 
 #Equalization aims to mitigate the phase and amplitude variations introduced by the communication channel, ensuring accurate data recovery.
+#OFDM_demod: [S, F] or [..., S, F], H_estim: [F] or [..., F]
 def equalize_ZF(OFDM_demod, H_estim, F, S):
 
     # Reshape the OFDM data and perform equalization
-    equalized = (OFDM_demod.view(S, F) / H_estim.to(device=OFDM_demod.device))
+    equalized = (OFDM_demod.reshape(OFDM_demod.shape[:-2] + (S, F)) / H_estim.to(device=OFDM_demod.device).unsqueeze(-2))
     return equalized
 
 #The payload in an OFDM system refers to the actual data transmitted, excluding overheads like cyclic prefixes, pilot symbols, and any additional signaling or control information.
 def get_payload_symbols(TTI_mask_RE, equalized, FFT_offset, F, plotQAM=False):
     # Extract payload symbols
-    mask = TTI_mask_RE[:, FFT_offset:FFT_offset + F] == 1
-    out = equalized[mask]
+    mask = TTI_mask_RE[:, FFT_offset:FFT_offset + F].to(equalized.device) == 1
+    out = equalized[..., mask] #[958] or [..., 958]
 
     # Plotting the QAM symbols
     if plotQAM:
         plt.figure(figsize=(8, 8))
-        plt.scatter(out.cpu().real, out.cpu().imag, label='QAM Symbols')
+        plt.scatter(out.flatten().cpu().real, out.flatten().cpu().imag, label='QAM Symbols')
         plt.axis('equal')
         plt.xlim([-1.5, 1.5])
         plt.ylim([-1.5, 1.5])
@@ -506,14 +676,52 @@ def get_payload_symbols(TTI_mask_RE, equalized, FFT_offset, F, plotQAM=False):
         plt.show()
     return out
 
-def Demapping(QAM, de_mapping_table):
-    # Convert the demapping table keys (constellation points) to a tensor
-    constellation = torch.tensor(list(de_mapping_table.keys())).to(QAM.device) #[64]
-    dists = torch.abs(QAM.view(-1, 1) - constellation.view(1, -1)) #[958, 64] #constellation: [64]
-    const_index = torch.argmin(dists, dim=1).to(QAM.device) #[958]
-    hardDecision = constellation[const_index].to(QAM.device) #[958]
-    string_key_table = {str(key.item()): value for key, value in de_mapping_table.items()} #complex to 6bits mapping
-    demapped_symbols = torch.tensor([string_key_table[str(c.item())] for c in hardDecision], dtype=torch.int32)
+#Lookup tables for the hard demapper, built once per demapping table:
+#constellation [2^Qm] and bits [2^Qm, Qm] in index order, and for a square uniform grid (mapping_table) the per-axis
+#levels and grid_index [size_real, size_imag] -> constellation index used for the slicing decision
+def demapping_lut(de_mapping_table):
+    constellation = torch.stack([torch.as_tensor(key) for key in de_mapping_table.keys()]).to(torch.complex64) #[64]
+    bits = torch.tensor([list(value) for value in de_mapping_table.values()], dtype=torch.int32) #[64, 6]
+    lut = {'constellation': constellation, 'bits': bits, 'grid_index': None}
+    real_levels = torch.unique(constellation.real)
+    imag_levels = torch.unique(constellation.imag)
+    if len(real_levels) * len(imag_levels) == len(constellation) and len(real_levels) > 1 and len(imag_levels) > 1:
+        step_real = torch.diff(real_levels)
+        step_imag = torch.diff(imag_levels)
+        if torch.allclose(step_real, step_real[0]) and torch.allclose(step_imag, step_imag[0]):
+            grid = real_levels.view(-1, 1) + 1j * imag_levels.view(1, -1)
+            grid_index = torch.argmin(torch.abs(grid.reshape(-1, 1) - constellation.view(1, -1)), dim=1).view(grid.shape)
+            lut.update({'grid_index': grid_index, 'real_levels': real_levels, 'imag_levels': imag_levels,
+                        'step_real': step_real[0], 'step_imag': step_imag[0]})
+    return lut
+
+_demapping_luts = {}
+def get_demapping_lut(de_mapping_table, device='cpu'):
+    key = (id(de_mapping_table), str(device))
+    if key not in _demapping_luts or _demapping_luts[key][0] is not de_mapping_table:
+        lut = {k: v.to(device) if torch.is_tensor(v) else v for k, v in demapping_lut(de_mapping_table).items()}
+        _demapping_luts[key] = (de_mapping_table, lut) #keep the table alive so its id is not reused
+    return _demapping_luts[key][1]
+
+#Index of the closest constellation point, slicing per axis on a square grid, brute-force argmin otherwise
+def hard_decision_index(QAM, lut):
+    if lut['grid_index'] is None:
+        dists = torch.abs(QAM.unsqueeze(-1) - lut['constellation']) #[..., N, 64]
+        return torch.argmin(dists, dim=-1)
+    size_real, size_imag = lut['grid_index'].shape
+    index_real = torch.round((QAM.real - lut['real_levels'][0]) / lut['step_real']).long().clamp(0, size_real-1)
+    index_imag = torch.round((QAM.imag - lut['imag_levels'][0]) / lut['step_imag']).long().clamp(0, size_imag-1)
+    return lut['grid_index'][index_real, index_imag]
+
+#QAM: [N] or a batch [B, N] complex symbols
+#returns bits [..., N, Qm] int32 (packed=True: the constellation index, i.e. the Qm bits MSB first in one integer [..., N]) and hardDecision [..., N]
+def Demapping(QAM, de_mapping_table, packed=False):
+    lut = get_demapping_lut(de_mapping_table, QAM.device)
+    const_index = hard_decision_index(QAM, lut) #[958]
+    hardDecision = lut['constellation'][const_index] #[958]
+    if packed:
+        return const_index, hardDecision
+    demapped_symbols = lut['bits'][const_index] #[958, 6]
     return demapped_symbols, hardDecision
 
 def PS(bits): # parallel to serial
@@ -598,7 +806,13 @@ class CustomDataset(Dataset):
         #self.pilot_iq.append(new_pilot_iq) 
         self.labels.append(new_label) 
 
-def create_dataset():
+def load_dataset(datapath='output/ofdm_dataset'):
+    # sharded store written by create_dataset, memory mapped; falls back to the old torch.save'd CustomDataset
+    if is_store(datapath):
+        return ShardDataset(datapath, keys=('pdsch_iq', 'labels'), as_tuple=True)
+    return torch.load(datapath if datapath.endswith('.pth') else datapath+'.pth')
+
+def create_dataset(datapath='output/ofdm_dataset', shard_size=1000):
     # SDR Configuration
     use_sdr = False # True for SDR or False for CDL-C channel emulation
     # for SDR
@@ -624,7 +838,7 @@ def create_dataset():
     leading_zeros = 80  # For SDR, Number of symbols with zero value for noise measurement at the beginning of the transmission. Used for SINR estimation.
     
 
-    dataset = CustomDataset()
+    dataset = ShardWriter(datapath, shard_size=shard_size) # shards are flushed to disk as they fill up
 
     number_of_training_items = 10000 #10000
 
@@ -671,10 +885,10 @@ def create_dataset():
         TTI_3d = torch.cat((TTI_3d[:, :F//2,:], TTI_3d[:, F//2 + 1:,:]), dim=1)  # remove DC, [14, 71, 6]
         
         #dataset.add_item(pdsch_symbols_map, pilot_symbols_map, TTI_3d) # add to dataset
-        dataset.add_item(pdsch_symbols_map, TTI_3d) 
+        dataset.add(pdsch_iq=pdsch_symbols_map.numpy(), labels=TTI_3d.numpy())
         # add to dataset pdsch_symbols_map:[14, 71] complex, TTI_3d:[14, 71, 6] bits
 
-    torch.save(dataset, 'output/ofdm_dataset.pth') # save dataset on disk
+    dataset.close() # write the last partial shard and the index
     print('Dataset saved')
 
 
@@ -779,12 +993,15 @@ def performance_test():
     number_of_testcases = 1000
     SINR2BER_table = np.zeros((number_of_testcases,4))
 
+    # all emulated channels in one batched call (same as radio_channel per testcase)
+    ch_SINRs = [int(random.uniform(ch_SINR_min, ch_SINR_max)) for _ in range(number_of_testcases)]
+    RX_Samples_all = apply_multipath_channel_batch(TX_Samples.expand(number_of_testcases, -1), n_taps=n_taps, max_delay=max_delay, \
+                  random_start=True, repeats=3, SINR_s=torch.tensor(ch_SINRs, dtype=torch.float32), leading_zeros=leading_zeros)
+
     for i in range(number_of_testcases):
-        ch_SINR = int(random.uniform(ch_SINR_min, ch_SINR_max))
         tx_gain_i = int(random.uniform(tx_gain_min, tx_gain_max))
         #RX_Samples = radio_channel(use_sdr=use_sdr, tx_signal = TX_Samples, tx_gain = tx_gain_i, rx_gain = rx_gain, ch_SINR = ch_SINR)
-        RX_Samples = radio_channel(tx_signal= TX_Samples, ch_SINR=ch_SINR, n_taps=n_taps, max_delay=max_delay, \
-                  leading_zeros=leading_zeros, tx_gain=0, rx_gain = 0, use_sdr=False)
+        RX_Samples = RX_Samples_all[i]
         
         bits_est, SINR_m = receiver_process(TX_Samples=TX_Samples, RX_Samples=RX_Samples, \
                                         TTI_mask_RE=TTI_mask_RE, pilot_symbols=pilot_symbols, \
@@ -15,8 +15,7 @@ from tqdm.auto import tqdm
 def trainmain():
     device, useamp=get_device(gpuid='0', useamp=False)
 
-    dataset = CustomDataset()
-    dataset = torch.load('output/ofdm_dataset.pth')
+    dataset = load_dataset('output/ofdm_dataset')
     batch_size = 16
 
     # train, validation and test split
@@ -2,7 +2,7 @@ import torch
 import torch.nn as nn
 import torch.optim as optim
 import numpy as np
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, IterableDataset
 from torch.utils.data import DataLoader
 import torch.nn.functional as tFunc # usually F, but that is reserved for other use
 import csv
@@ -40,9 +40,10 @@ class OFDMDataset(Dataset):
         mapping_table_QPSK, de_mapping_table_QPSK = mapping_table(2) # mapping table QPSK (e.g. for pilot symbols)
         self.mapping_table_Qm, self.de_mapping_table_Qm = mapping_table(Qm, plot=False) # mapping table for Qm
 
-        self.TTI_mask_RE = TTI_mask(S=self.S,F=self.F, Fp=self.Fp, Sp=self.Sp, FFT_offset=self.FFT_offset, plotTTI=False) #[14, 128]
+        self.layout = OFDMFrameLayout(S=self.S, F=self.F, Fp=self.Fp, Sp=self.Sp, FFT_size=self.FFT_size, CP=self.CP) # precomputed gather indices
+        self.TTI_mask_RE = self.layout.TTI_mask_RE #[14, 128]
         #among TTI_mask, 958 places are 1 (means data)
-        self.pilot_symbols = pilot_set(self.TTI_mask_RE, Pilot_Power) #[36]
+        self.pilot_symbols = self.layout.pilot_symbols #[36]
         
     def __len__(self):
         return self.maxdatalen
@@ -56,67 +57,79 @@ class OFDMDataset(Dataset):
         RX_Samples = apply_multipath_channel(TX_Samples, n_taps=self.n_taps, max_delay=self.max_delay, random_start=False, repeats=0, SINR_s=ch_SINR, leading_zeros=self.leading_zeros)
 
         #Create groundtruth labels:
-        # create a bit stream matrix, the same shape as TTI mask RE
-        TTI_mask_indices = torch.where(self.TTI_mask_RE==1) #[14, 128]
-        TTI_3d = torch.zeros((self.TTI_mask_RE.shape[0], self.TTI_mask_RE.shape[1], pdsch_bits.shape[1]), dtype=pdsch_bits.dtype) #[14, 128, 6]
-        row_indices, col_indices = TTI_mask_indices #[958]
-        #TTI_3d: [14, 128, 6]
-        TTI_3d[row_indices, col_indices, :] = pdsch_bits.clone().detach() #[958, 6]->[14, 128, 6]
-        TTI_3d = remove_fft_Offests(TTI_3d, F, FFT_offset) #[14, 72, 6]
-        TTI_3d = torch.cat((TTI_3d[:, :F//2,:], TTI_3d[:, F//2 + 1:,:]), dim=1)  # remove DC, [14, 71, 6]
+        # bit grid without FFT offsets and DC, data REs filled with their bits
+        TTI_3d = self.layout.label_grid(pdsch_bits) #[958, 6]->[14, 71, 6]
         
         batch={}
         if self.training:
-            OFDM_demod = self.receiver_preprocessing(RX_Samples) #[2078]->[14, 128]
-            pdsch_symbols_map = self.NNpreprocessing(OFDM_demod) #[14, 128] ->[14, 71]
-            feature_2d = self.create_2Dfeature(pdsch_symbols_map, simple_stack=False)
+            OFDM_demod = self.layout.receiver_preprocessing(RX_Samples) #[2078]->[14, 128]
+            pdsch_symbols_map = self.layout.NNpreprocessing(OFDM_demod) #[14, 128] ->[14, 71]
+            feature_2d = create_2Dfeature(pdsch_symbols_map, simple_stack=False)
             batch['feature_2d']= feature_2d #[4, 14, 71]
         batch['samples']=RX_Samples #[2078]
         batch['labels']=TTI_3d #[14, 71, 6]
         return batch #RX_Samples, TTI_3d
-    
-        #for all receivers
-    def receiver_preprocessing(self, RX_Samples):
-        #RX_Samples = batch['rx_samples']
-        #step1: CP remove
-        symbol_index = 1 #starting place
-        RX_NO_CP = CP_removal(RX_Samples, symbol_index, self.S, self.FFT_size, self.CP, plotsig=False)# remove cyclic prefix and other symbols created by convolution
-        RX_NO_CP = RX_NO_CP / torch.max(torch.abs(RX_NO_CP)) # normalize
-        #torch.Size([14, 128])
-
-        #back into the frequency domain
-        OFDM_demod = DFT(RX_NO_CP, plotDFT=False) # DFT
-        #batch['OFDM_demod'] = OFDM_demod
-        return OFDM_demod
 
-    def NNpreprocessing(self, OFDM_demod):
-        OFDM_demod = OFDM_demod / torch.max(torch.abs(OFDM_demod)) # normalize DFT'd signal for NN input
-        #torch.Size([14, 128])
-        #F is number of carriers
-        pdsch_symbols_map = remove_fft_Offests(OFDM_demod, self.F, self.FFT_offset) # remove FFT offsets
-        #[14, 72]
-        # remove DC
-        pdsch_symbols_map = torch.cat((pdsch_symbols_map[:, :self.F//2], pdsch_symbols_map[:, self.F//2 + 1:]), dim=1) 
-        # [14, 71]
-        return pdsch_symbols_map
-    
-    def create_2Dfeature(self, pdsch_symbols_map, simple_stack=True):
-        y_real = pdsch_symbols_map.real #[14, 71]
-        y_imag = pdsch_symbols_map.imag
-        if simple_stack:
-            # Stack the tensors along a new dimension (axis 0)
-            z = torch.stack([y_real, y_imag], dim=0) #[2, 14, 71]
-        else:
-            y_mag = y_real.pow(2) + y_imag.pow(2)
-            y_phase = torch.atan2(
-                    -y_imag + 0.0, y_real
-                )  # +0.0 removes -0.0 elements, which leads to error in calculating phase
-            y_complex = torch.stack(
-                    (y_real, -y_imag), -1
-                )  # Remember the minus sign for imaginary part
-            z = torch.stack([y_real, y_imag, y_mag, y_phase], dim=0)
-            #z = z.permute(1, 0, 2, 3) #[16, 2, 14, 71]
-        return z
+# batched on-the-fly dataset: every item is a whole batch of TTIs generated with vectorized tensor ops,
+# use with DataLoader(dataset, batch_size=None)
+class OFDMBatchDataset(IterableDataset):
+    def __init__(self, Qm=6, S=14, Sp=2, F=72, Fp=2, FFT_size=128, CP=20, ch_SINR_min=25, ch_SINR_max=50, maxdatalen=10000, batch_size=16, training=False):
+        self.maxdatalen = maxdatalen
+        self.batch_size = batch_size
+        self.training = training
+        self.ch_SINR_min = ch_SINR_min # channel emulation min SINR
+        self.ch_SINR_max = ch_SINR_max # channel emulation max SINR
+        self.Qm = Qm  # bits per symbol
+        # channel simulation
+        self.n_taps = 2 
+        self.max_delay = 6 #samples
+        self.leading_zeros = 0
+        # OFDM Parameters
+        self.S = S  # Number of symbols
+        self.Sp = Sp  # Pilot symbol, 0 for none
+        self.F = F  # Number of subcarriers, including DC
+        self.Fp = Fp  # Pilot subcarrier spacing
+        self.FFT_size = FFT_size  # FFT size
+        self.FFT_offset = int((self.FFT_size - self.F) / 2)  # FFT offset
+        self.CP = CP  # Cyclic prefix
+
+        self.mapping_table_Qm, self.de_mapping_table_Qm = mapping_table(Qm, plot=False) # mapping table for Qm
+        self.constellation = constellation_points(self.mapping_table_Qm) #[64]
+        # TTI mask and gather indices, only depend on the TTI layout, computed once
+        self.layout = OFDMFrameLayout(S=self.S, F=self.F, Fp=self.Fp, Sp=self.Sp, FFT_size=self.FFT_size, CP=self.CP)
+        self.TTI_mask_RE = self.layout.TTI_mask_RE #[14, 128]
+        self.pilot_symbols = self.layout.pilot_symbols #[36]
+
+    def __len__(self):
+        return self.maxdatalen // self.batch_size
+
+    def __iter__(self):
+        num_batches = len(self)
+        worker_info = torch.utils.data.get_worker_info()
+        if worker_info is not None: #split the batches over the DataLoader workers
+            num_batches = len(range(worker_info.id, num_batches, worker_info.num_workers))
+        for _ in range(num_batches):
+            yield self.generate_batch(self.batch_size)
+
+    def generate_batch(self, batch_size):
+        # SINR generation for adding noise to the channel, int() truncation as in OFDMDataset
+        ch_SINR = torch.empty(batch_size).uniform_(self.ch_SINR_min, self.ch_SINR_max).trunc()
+        pdsch_bits, TX_Samples = create_OFDM_data_batch(batch_size, self.TTI_mask_RE, self.Qm, self.constellation, self.pilot_symbols)
+        #pdsch_bits: [B, 958, 6], TX_Samples: [B, 2072]
+        RX_Samples = apply_multipath_channel_batch(TX_Samples, n_taps=self.n_taps, max_delay=self.max_delay, random_start=False, repeats=0, SINR_s=ch_SINR, leading_zeros=self.leading_zeros)
+        #[B, 2078]
+
+        #groundtruth labels [B, 14, 71, 6]
+        labels = self.layout.label_grid(pdsch_bits)
+
+        batch={}
+        if self.training:
+            OFDM_demod = self.layout.receiver_preprocessing(RX_Samples) #[B, 2078]->[B, 14, 128]
+            pdsch_symbols_map = self.layout.NNpreprocessing(OFDM_demod) #[B, 14, 128] ->[B, 14, 71]
+            batch['feature_2d'] = create_2Dfeature(pdsch_symbols_map, simple_stack=False) #[B, 4, 14, 71]
+        batch['samples']=RX_Samples
+        batch['labels']=labels
+        return batch
 
 class MultiReceiver():
     def __init__(self, Qm=6, S=14, Sp=2, F=72, Fp=2, FFT_size=128, CP=20):
@@ -131,9 +144,10 @@ class MultiReceiver():
         self.FFT_offset = int((self.FFT_size - self.F) / 2)  # FFT offset
         self.CP = CP  # Cyclic prefix
 
-        self.TTI_mask_RE = TTI_mask(S=self.S,F=self.F, Fp=self.Fp, Sp=self.Sp, FFT_offset=self.FFT_offset, plotTTI=False) #[14, 128]
+        self.layout = OFDMFrameLayout(S=self.S, F=self.F, Fp=self.Fp, Sp=self.Sp, FFT_size=self.FFT_size, CP=self.CP) # precomputed gather indices
+        self.TTI_mask_RE = self.layout.TTI_mask_RE #[14, 128]
         #among TTI_mask, 958 places are 1 (means data)
-        self.pilot_symbols = pilot_set(self.TTI_mask_RE, Pilot_Power) #[36]
+        self.pilot_symbols = self.layout.pilot_symbols #[36]
 
         mapping_table_QPSK, de_mapping_table_QPSK = mapping_table(2) # mapping table QPSK (e.g. for pilot symbols)
         self.mapping_table_Qm, self.de_mapping_table_Qm = mapping_table(Qm, plot=False) # mapping table for Qm
@@ -148,25 +162,15 @@ class MultiReceiver():
         self.TTI_mask_RE_3d = TTI_mask_RE_3d.expand(self.S, self.F-1, self.Qm) #[14, 71, 6]
         self.index_one =  self.TTI_mask_RE_3d==1 #[14, 71, 6]
 
-    #for all receivers
+    #for all receivers, RX_Samples: [N] or a batch [B, N]
     def receiver_preprocessing(self, RX_Samples):
-        #RX_Samples = batch['rx_samples']
-        #step1: CP remove
-        symbol_index = 1 #starting place
-        RX_NO_CP = CP_removal(RX_Samples, symbol_index, self.S, self.FFT_size, self.CP, plotsig=False)# remove cyclic prefix and other symbols created by convolution
-        RX_NO_CP = RX_NO_CP / torch.max(torch.abs(RX_NO_CP)) # normalize
-        #torch.Size([14, 128])
-
-        #back into the frequency domain
-        OFDM_demod = DFT(RX_NO_CP, plotDFT=False) # DFT
-        #batch['OFDM_demod'] = OFDM_demod
-        return OFDM_demod
+        return self.layout.receiver_preprocessing(RX_Samples) #[14, 128] or [B, 14, 128]
 
     def ZHLSreceiver(self, OFDM_demod):
-        #OFDM_demod [14, 128]
-        H_estim = channelEstimate_LS(self.TTI_mask_RE, self.pilot_symbols, self.F, self.FFT_offset, self.Sp, OFDM_demod, plotEst=False) # estimate the channel using least squares and plot
+        #OFDM_demod [14, 128] or [B, 14, 128]
+        H_estim = self.layout.channel_estimate_LS(OFDM_demod) # estimate the channel using least squares
 
-        OFDM_demod_no_offsets = remove_fft_Offests(OFDM_demod, self.F, self.FFT_offset) # remove the FFT offsets and DC carrier from the received signal
+        OFDM_demod_no_offsets = self.layout.remove_offsets(OFDM_demod) # remove the FFT offsets and DC carrier from the received signal
         #[14, 72]
         #[14, 128]->[14, 72] (28:28+72)
 
@@ -175,49 +179,40 @@ class MultiReceiver():
         #[14, 72]
 
         #Payload Symbols extraction
-        QAM_est = get_payload_symbols(self.TTI_mask_RE, equalized_H_estim, self.FFT_offset, self.F, plotQAM=False) # get the payload symbols from
-        #[958]
+        QAM_est = self.layout.payload_symbols(equalized_H_estim) # get the payload symbols from
+        #[958] or [B, 958]
 
         #Converting OFDM Symbols to Data
         PS_est, hardDecision = Demapping(QAM_est, self.de_mapping_table_Qm) # demap the symbols back to codewords
         #PS_est[958, 6] bits
         #hardDecision[958] mapped complex value
         #[958, 6] bits =>[5748]
-        binary_predictions = PS(PS_est) # convert the codewords to the bitstream
-        #0 1 bits [5748]
-        # convert to bits
-        #binary_predictions = torch.tensor(PS(PS_est).flatten().cpu(), dtype=torch.int8) #[5748]
+        binary_predictions = PS_est.flatten(-2) # convert the codewords to the bitstream (per TTI for a batch)
+        #0 1 bits [5748] or [B, 5748]
         return binary_predictions
 
 
     def NNpreprocessing(self, OFDM_demod):
-        OFDM_demod = OFDM_demod / torch.max(torch.abs(OFDM_demod)) # normalize DFT'd signal for NN input
-        #torch.Size([14, 128])
-        #F is number of carriers
-        pdsch_symbols_map = remove_fft_Offests(OFDM_demod, self.F, self.FFT_offset) # remove FFT offsets
-        #[14, 72]
-        # remove DC
-        pdsch_symbols_map = torch.cat((pdsch_symbols_map[:, :self.F//2], pdsch_symbols_map[:, self.F//2 + 1:]), dim=1) 
-        # [14, 71]
-        return pdsch_symbols_map
+        return self.layout.NNpreprocessing(OFDM_demod) #[14, 71] or [B, 14, 71]
 
     def NNinference(self, model, pdsch_symbols_map, device):
-        pdsch_symbols_map=torch.unsqueeze(pdsch_symbols_map, dim=0).to(device) #[14, 71]=>[1, 14, 71]
-        test_outputs = model(pdsch_symbols_map) #[1, 14, 71]->[1, 14, 71, 6]
-        #binary_predictions = test_outputs.squeeze()[TTI_mask_RE_3d==1] #[91968]
-        binary_predictions = test_outputs.squeeze() #[14, 71, 6]
+        batched = pdsch_symbols_map.dim() > 2
+        if not batched:
+            pdsch_symbols_map=torch.unsqueeze(pdsch_symbols_map, dim=0) #[14, 71]=>[1, 14, 71]
+        test_outputs = model(pdsch_symbols_map.to(device)) #[B, 14, 71]->[B, 14, 71, 6]
         
         #Fetch the payload
-        binary_predictions = binary_predictions[self.index_one] #[5748]
+        binary_predictions = test_outputs[..., self.index_one.to(test_outputs.device)] #[B, 5748]
         binary_predictions = torch.round(binary_predictions)
+        if not batched:
+            binary_predictions = binary_predictions.squeeze(0) #[5748]
         return binary_predictions.cpu()
-    
+
     def NNevaluate(self, binary_predictions, test_labels):
-        binary_predictions = binary_predictions.squeeze() #[14, 71, 6]
-        test_labels = test_labels.squeeze() #[14, 71, 6]
-        #index_one =  TTI_mask_RE_3d==1
-        test_labels = test_labels[self.index_one] #[5748]
-        binary_predictions = binary_predictions[self.index_one] #[5748]
+        #binary_predictions, test_labels: [14, 71, 6] or [B, 14, 71, 6]
+        index_one = self.index_one.to(test_labels.device)
+        test_labels = test_labels[..., index_one] #[5748] or [B, 5748]
+        binary_predictions = binary_predictions.to(test_labels.device)[..., index_one] #[5748] or [B, 5748]
         
         # Calculate Bit Error Rate (BER) for the NN-receiver
         error_count = torch.sum(binary_predictions != test_labels).float()  # Count of unequal bits
@@ -228,10 +223,9 @@ class MultiReceiver():
         return BER_val.item(), new_wrongs
     
     def evaluate(self, binary_predictions, test_labels):
-        #binary_predictions: [5748]
-        test_labels = test_labels.squeeze() #[14, 71, 6]
-        #index_one =  TTI_mask_RE_3d==1
-        test_labels = test_labels[self.index_one] #[5748]
+        #binary_predictions: [5748] or [B, 5748], test_labels: [14, 71, 6] or [B, 14, 71, 6]
+        test_labels = test_labels[..., self.index_one.to(test_labels.device)] #[5748] or [B, 5748]
+        binary_predictions = binary_predictions.to(test_labels.device)
         
         # Calculate Bit Error Rate (BER) for the NN-receiver
         error_count = torch.sum(binary_predictions != test_labels).float()  # Count of unequal bits
@@ -242,7 +236,7 @@ class MultiReceiver():
         return BER_val.item(), new_wrongs
 
 
-def trainmain(trainoutput, saved_model_path = ""):
+def trainmain(trainoutput, saved_model_path = "", batched_data=True):
     device, useamp=get_device(gpuid='0', useamp=False)
 
     # OFDM Parameters
@@ -255,19 +249,26 @@ def trainmain(trainoutput, saved_model_path = ""):
     #-10 20 exp0201
     #-10 40 exp0201b
     # exp0201c ResModel_simple1_2D
-    train_data = OFDMDataset(Qm=Qm, S=S, Sp=Sp, F=F, ch_SINR_min=-10, ch_SINR_max=40, training=True)
-    onebatch = train_data[0]
-
+    maxdatalen = 10000
     batch_size = 16
 
     # train, validation and test split
-    train_size = int(0.8 * len(train_data)) #8000
-    val_size = len(train_data) - train_size
-    train_set, val_set= torch.utils.data.random_split(train_data, [train_size, val_size])
+    train_size = int(0.8 * maxdatalen) #8000
+    val_size = maxdatalen - train_size
 
     # dataloaders
-    train_loader = DataLoader(dataset=train_set, batch_size=batch_size, shuffle=True, pin_memory=True, num_workers=4)
-    val_loader = DataLoader(dataset=val_set, batch_size=1, shuffle=True, pin_memory=True, num_workers=4)
+    if batched_data:
+        # synthesize whole batches per worker instead of one TTI per index, for training and validation
+        train_set = OFDMBatchDataset(Qm=Qm, S=S, Sp=Sp, F=F, ch_SINR_min=-10, ch_SINR_max=40, maxdatalen=train_size, batch_size=batch_size, training=True)
+        val_set = OFDMBatchDataset(Qm=Qm, S=S, Sp=Sp, F=F, ch_SINR_min=-10, ch_SINR_max=40, maxdatalen=val_size, batch_size=batch_size, training=True)
+        train_loader = DataLoader(dataset=train_set, batch_size=None, pin_memory=True, num_workers=4)
+        val_loader = DataLoader(dataset=val_set, batch_size=None, pin_memory=True, num_workers=4)
+    else:
+        train_data = OFDMDataset(Qm=Qm, S=S, Sp=Sp, F=F, ch_SINR_min=-10, ch_SINR_max=40, maxdatalen=maxdatalen, training=True)
+        onebatch = train_data[0]
+        train_set, val_set= torch.utils.data.random_split(train_data, [train_size, val_size])
+        train_loader = DataLoader(dataset=train_set, batch_size=batch_size, shuffle=True, pin_memory=True, num_workers=4)
+        val_loader = DataLoader(dataset=val_set, batch_size=batch_size, shuffle=True, pin_memory=True, num_workers=4)
 
     onebatch = next(iter(train_loader))
     rx_samples = onebatch['samples']
@@ -360,21 +361,19 @@ def trainmain(trainoutput, saved_model_path = ""):
                 batch = {k: v.to(device) for k, v in data_batch.items()}
                 feature_2d = batch['feature_2d']
                 labels = batch['labels']
-                rx_samples = batch['samples'] #[1, 2078]
-                val_outputs = model((feature_2d)) #[1, 14, 71, 6]
+                rx_samples = batch['samples'] #[16, 2078]
+                val_outputs = model((feature_2d)) #[16, 14, 71, 6]
                 val_loss = criterion(val_outputs, labels)
 
                 # Convert probabilities to binary predictions (0 or 1)
-                binary_predictions = torch.round(val_outputs) #[1, 14, 71, 6]
+                binary_predictions = torch.round(val_outputs) #[16, 14, 71, 6]
 
-                # Calculate Bit Error Rate (BER)
-                labels = labels.cpu().squeeze() #[1, 14, 71, 6]
-                BER, NN_wrongs = multiprocessor.NNevaluate(binary_predictions.cpu(), labels)
+                # Calculate Bit Error Rate (BER) over the whole batch
+                BER, NN_wrongs = multiprocessor.NNevaluate(binary_predictions, labels)
                 BER_batch.append(BER)
 
-                rx_samples=rx_samples.squeeze().cpu()
-                #back into the frequency domain
-                OFDM_demod = multiprocessor.receiver_preprocessing(rx_samples) #[14, 128]
+                #LS baseline on the same batch and device, back into the frequency domain
+                OFDM_demod = multiprocessor.receiver_preprocessing(rx_samples) #[16, 14, 128]
                 ZHLS_binary_predictions = multiprocessor.ZHLSreceiver(OFDM_demod)
                 ZHLS_BER, ZHLS_wrongs = multiprocessor.evaluate(ZHLS_binary_predictions, labels)
                 LSBER_batch.append(ZHLS_BER)
@@ -4,6 +4,7 @@ import tensorflow as tf
 # Avoid warnings from TensorFlow
 tf.get_logger().setLevel('ERROR')
 import numpy as np
+from demapper_numpy import demapper_tables, demap_llr
 
 # For plotting
 #%matplotlib inline 
@@ -413,6 +414,7 @@ class MyDemapper:
                  num_bits_per_symbol=None,
                  hard_out=False,
                  with_prior=False,
+                 chunk_size=2**15,
                  #dtype=tf.complex64,
                  #**kwargs
                 ):
@@ -420,10 +422,9 @@ class MyDemapper:
         self.num_bits_per_symbol = num_bits_per_symbol
         self.with_prior = with_prior
         self.hard_out = hard_out
-        self._logits2llrs = SymbolLogits2LLRs(demapping_method,
-                                              num_bits_per_symbol,
-                                              hard_out,
-                                              with_prior)
+        self.demapping_method = demapping_method
+        self.chunk_size = chunk_size #symbols per chunk, bounds the memory of the distance computation
+        self._tables = demapper_tables(self.points, num_bits_per_symbol)
     
     def demap(self, inputs):
         if self.with_prior:
@@ -431,38 +432,9 @@ class MyDemapper:
         else:
             y, no = inputs #(64, 512)
         
-        # Reshape constellation points to [1,...1,num_points]
-        #points_shape = [1]*y.shape.rank + self.points.shape
-        points_shape = [1]*len(y.shape) +list(self.points.shape) #[1,1]+[4] = [1, 1, 4]
-        #points = tf.reshape(self.constellation.points, points_shape)
-        points_reshape =np.reshape(self.points, points_shape) #(1, 1, 4)
-
-        # Compute squared distances from y to all points
-        # shape [...,n,num_points]
-        #squared_dist = tf.pow(tf.abs(tf.expand_dims(y, axis=-1) - points_reshape), 2)
-        ynew=np.expand_dims(y, axis=-1) #(64, 512, 1)
-        #squared_dist=((ynew-points_reshape)**2) #(64, 512, 4)
-        dist = np.abs(ynew-points_reshape) #(64, 512, 4) float32
-        squared_dist = dist **2
-        
-        # Compute exponents
-        exponents = -squared_dist/no
-
-        if self.with_prior:
-            llr = self._logits2llrs([exponents, prior])
-        else:
-            exponents = tf.convert_to_tensor(exponents)
-            llr = self._logits2llrs(exponents) #(64, 512, 2)
-        
-        # Reshape LLRs to [...,n*num_bits_per_symbol]
-        print(tf.shape(y)) #[64, 512]
-        print(tf.shape(y)[:-1]) # [64]
-        print(y.shape[-1]) #512
-        out_shape = tf.concat([tf.shape(y)[:-1],
-                               [y.shape[-1] * \
-                                self.num_bits_per_symbol]], 0)
-        llr_reshaped = tf.reshape(llr, out_shape) #(64, 1024)
-
+        # Per-axis PAM (square QAM) or per-point distances, [...,n] => [...,n*num_bits_per_symbol] LLRs or hard-decisions
+        llr_reshaped = demap_llr(y, no, self.points, self._tables, self.num_bits_per_symbol, method=self.demapping_method, \
+                                 prior=prior if self.with_prior else None, hard_out=self.hard_out, chunk_size=self.chunk_size)
         return llr_reshaped
 
 def calculate_BER(bits, bits_est):
@@ -590,7 +562,7 @@ class CodedSystemAWGN:
         plt.show()
         return ebno_dbs, BER
 
-from sionna_tf import Demapper, SymbolLogits2LLRs, hard_decisions, count_errors, count_block_errors
+from sionna_tf import Demapper, hard_decisions, count_errors, count_block_errors
 
 def test():
     data_type = np.complex64# Complex64 number (real and imaginary parts are float32)
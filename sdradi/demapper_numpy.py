@@ -0,0 +1,65 @@
+#Numpy LLR demapper kernel for the MyDemapper of myofdm (no TensorFlow needed), same module as deeplearning/demapper_numpy.py
+#demapper_tables(points, num_bits_per_symbol) precomputes the bit labels and, for square QAM, the per-axis PAM tables once,
+#demap_llr(y, no, points, tables, ...) then returns the app/maxlog LLRs or hard decisions of [...,n] symbols as [...,n*K]
+import numpy as np
+
+#The bit label of a point is the MSB-first binary of its index as in SymbolLogits2LLRs
+#Square QAM is the product of two PAMs (real part: even bits, imag part: odd bits), so it is demapped per axis with sqrt(M) distances
+def demapper_tables(points, num_bits_per_symbol):
+    points = np.asarray(points)
+    labels = (np.arange(2**num_bits_per_symbol)[:, None] >> np.arange(num_bits_per_symbol-1, -1, -1)) & 1 #[num_points, K]
+    tables = {'labels': labels, 'separable': False,
+              'c0': np.stack([np.where(labels[:, k]==0)[0] for k in range(num_bits_per_symbol)], axis=-1), #[num_points/2, K]
+              'c1': np.stack([np.where(labels[:, k]==1)[0] for k in range(num_bits_per_symbol)], axis=-1)}
+    if num_bits_per_symbol % 2 == 0 and np.iscomplexobj(points):
+        half = num_bits_per_symbol // 2
+        axis_labels = (np.arange(2**half)[:, None] >> np.arange(half-1, -1, -1)) & 1 #[L, K/2]
+        weights = 2**np.arange(num_bits_per_symbol-1, -1, -1)
+        pam_real = points[axis_labels @ weights[0::2]].real #[L] real axis PAM, odd bits zero
+        pam_imag = points[axis_labels @ weights[1::2]].imag #[L] imag axis PAM, even bits zero
+        axis_weights = 2**np.arange(half-1, -1, -1)
+        index_real = labels[:, 0::2] @ axis_weights
+        index_imag = labels[:, 1::2] @ axis_weights
+        if np.allclose(points, pam_real[index_real] + 1j*pam_imag[index_imag]):
+            tables.update({'separable': True, 'pam_real': pam_real, 'pam_imag': pam_imag,
+                           'a0': np.stack([np.where(axis_labels[:, k]==0)[0] for k in range(half)], axis=-1), #[L/2, K/2]
+                           'a1': np.stack([np.where(axis_labels[:, k]==1)[0] for k in range(half)], axis=-1)})
+    return tables
+
+def _logsumexp(x, axis):
+    x_max = np.max(x, axis=axis, keepdims=True)
+    return np.squeeze(x_max, axis=axis) + np.log(np.sum(np.exp(x - x_max), axis=axis))
+
+#exponents [M, num_points] -> LLRs log(Pr(b=1)/Pr(b=0)) [M, K]
+def _bits_llr(exponents, c0, c1, method):
+    reduce = _logsumexp if method == "app" else np.max
+    return reduce(exponents[:, c1], axis=1) - reduce(exponents[:, c0], axis=1)
+
+#y: [...,n] complex, no: scalar or broadcastable to y, prior: [K] or broadcastable to [...,n,K] LLRs
+#returns [...,n*K] LLRs (or hard decisions), processed in chunks of chunk_size symbols to bound the memory
+def demap_llr(y, no, points, tables, num_bits_per_symbol, method="app", prior=None, hard_out=False, chunk_size=2**15):
+    y = np.asarray(y)
+    real_dtype = np.float64 if y.dtype == np.complex128 else np.float32
+    out_shape = list(y.shape[:-1]) + [y.shape[-1]*num_bits_per_symbol]
+    y = y.reshape(-1)
+    no = np.broadcast_to(np.asarray(no, dtype=real_dtype), out_shape[:-1] + [out_shape[-1]//num_bits_per_symbol]).reshape(-1)
+    if prior is not None:
+        prior = np.asarray(prior, dtype=real_dtype)
+        prior = np.broadcast_to(prior, out_shape[:-1] + [out_shape[-1]//num_bits_per_symbol, num_bits_per_symbol]).reshape(-1, num_bits_per_symbol)
+        sign_labels = 2*tables['labels'] - 1 #labels from {-1, 1}
+    llr = np.empty((y.size, num_bits_per_symbol), dtype=real_dtype)
+    for start in range(0, y.size, chunk_size):
+        ys = y[start:start+chunk_size]
+        nos = no[start:start+chunk_size, None]
+        if tables['separable'] and prior is None:
+            llr[start:start+chunk_size, 0::2] = _bits_llr(-(ys.real[:, None]-tables['pam_real'])**2/nos, tables['a0'], tables['a1'], method)
+            llr[start:start+chunk_size, 1::2] = _bits_llr(-(ys.imag[:, None]-tables['pam_imag'])**2/nos, tables['a0'], tables['a1'], method)
+        else:
+            exponents = -np.abs(ys[:, None]-points)**2/nos #[M, num_points]
+            if prior is not None:
+                # log prior probability of every symbol, sum of log_sigmoid(label*prior)
+                exponents = exponents - np.sum(np.logaddexp(0, -sign_labels*prior[start:start+chunk_size, None, :]), axis=-1)
+            llr[start:start+chunk_size] = _bits_llr(exponents, tables['c0'], tables['c1'], method)
+    if hard_out:
+        llr = (llr > 0).astype(real_dtype)
+    return llr.reshape(out_shape)
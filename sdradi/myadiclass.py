@@ -11,7 +11,8 @@ import numpy as np
 from scipy import signal
 from timeit import default_timer as timer
 import sys
-from processing import createcomplexsinusoid, calculate_spectrum, normalize_complexsignal, detect_signaloffset, plot_noisesignalPSD
+from processing import createcomplexsinusoid, calculate_spectrum, normalize_complexsignal, detect_signaloffset, plot_noisesignalPSD, CaptureBuffer
+from rxstream import RXStreamer
 
 def printSDRproperties(sdr):
     print("Bandwidth of TX path:", sdr.tx_rf_bandwidth) #Bandwidth of front-end analog filter of TX path
@@ -102,6 +103,7 @@ class SDR:
         self.SDR_RX_BANDWIDTH = int(SDR_BANDWIDTH) # RX bandwidth (Hz)
         self.num_samples=1024*8 #int(SDR_SAMPLERATE/10) #default save 0.1s data
         self.sdr = self.setupSDR(fs=SDR_SAMPLERATE, device_name=device_name, Rx_CHANNEL=Rx_CHANNEL, Tx_CHANNEL=Tx_CHANNEL)
+        self.rxstream = None #RXStreamer of SDR_RX_start_stream
 
     # Function to check if a class has a setter property
     def has_setter(self, cls, property_name):
@@ -297,17 +299,29 @@ class SDR:
         #return torch.tensor(a, dtype=torch.complex64)
         return a
     
-    def SDR_RX_receive_continuous(self, T_len = 2, spectrum=False, delay=1, normalize=True, plot_flag = False):
+    def SDR_RX_start_stream(self, num_buffers=8, combinerule='drop', normalize=False):
+        #background acquisition: sdr.rx() runs in a thread, consumers pull buffers with self.rxstream.get()/read()
+        self.rxstream = RXStreamer(self.sdr, Rx_CHANNEL=self.Rx_CHANNEL, num_buffers=num_buffers, \
+                                   combinerule=combinerule, normalize=normalize).start()
+        return self.rxstream
+
+    def SDR_RX_stop_stream(self):
+        if self.rxstream is not None:
+            self.rxstream.stop()
+            print("RX stream stats:", self.rxstream.stats())
+            self.rxstream = None
+
+    def SDR_RX_receive_continuous(self, T_len = 2, spectrum=False, delay=1, normalize=True, plot_flag = False, filename=None):
         #T_len = 2  #2second
-        # Collect data
-        #alldata0 = np.empty(0) #Default is numpy.float64.
-        alldata0 = np.empty(0, dtype=np.complex_) #Default is numpy.float64.
+        #filename: optional .npy file, the capture is written to a memory-mapped array instead of RAM
         rxtime=[]
         processtime=[]
         
         fs = self.SDR_SAMPLERATE
         num_samps = self.sdr.rx_buffer_size
         Nperiod=int(T_len*fs/num_samps) #total time 10s *fs=total samples /fft_size = Number of frames
+        # Collect data into a preallocated buffer (Nperiod buffers)
+        capture = CaptureBuffer(Nperiod*num_samps, dtype=np.complex128, filename=filename)
 
         if plot_flag:
             #plt.figure(figsize=(10,6))
@@ -322,7 +336,7 @@ class SDR:
             
             datarate=len(data0.real)*4/timedelta/1e6 #Mbps, complex data is 4bytes
             print("Data rate at ", datarate, "Mbps.") #7-8Mbps in 10240 points, 10Mbps in 102400points, single channel in 19-20Mbps
-            alldata0 = np.concatenate((alldata0, data0))
+            capture.append(data0)
             if spectrum:
                 f, Pxx_den, peak_freq = calculate_spectrum(data0, fs, find_peak=True)
             
@@ -340,6 +354,8 @@ class SDR:
                 time.sleep(delay)
             endtime = timer()
             processtime.append(endtime-start)
+        capture.flush()
+        alldata0 = capture.data()
         return alldata0, processtime
 
 
@@ -7,7 +7,8 @@ import matplotlib.pyplot as plt
 plt.rcParams['font.size'] = 8.0
 from matplotlib import colors
 
-from tfmodules import MyLMMSEEqualizer, LMMSEEqualizer, SymbolLogits2LLRs
+from tfmodules import MyLMMSEEqualizer, LMMSEEqualizer
+from demapper_numpy import demapper_tables, demap_llr
 
 #Ref: deeplearning\ofdmsim2.py, create simple OFDM signal
 class OFDMSymbol():
@@ -885,6 +886,7 @@ class MyDemapper:
                  num_bits_per_symbol=None,
                  hard_out=False,
                  with_prior=False,
+                 chunk_size=2**15,
                  #dtype=tf.complex64,
                  #**kwargs
                 ):
@@ -892,10 +894,9 @@ class MyDemapper:
         self.num_bits_per_symbol = num_bits_per_symbol #4
         self.with_prior = with_prior #False
         self.hard_out = hard_out #False
-        self._logits2llrs = SymbolLogits2LLRs(demapping_method,
-                                              num_bits_per_symbol,
-                                              hard_out,
-                                              with_prior)
+        self.demapping_method = demapping_method
+        self.chunk_size = chunk_size #symbols per chunk, bounds the memory of the distance computation
+        self._tables = demapper_tables(self.points, num_bits_per_symbol)
     
     # def demap(self, inputs):
         
@@ -925,52 +926,9 @@ class MyDemapper:
         else:
             y, no = inputs #(64, 1, 1, 14, 76), [batch size, num_rx, num_rx_ant, num_ofdm_symbols, fft_size]
         
-        # Reshape constellation points to [1,...1,num_points]
-        #points_shape = [1]*y.shape.rank + self.points.shape
-        points_shape = [1]*len(y.shape) +list(self.points.shape) #[1,1]+[4] = [1, 1, 4] : [1, 1, 1, 1, 1, 16]
-        #points = tf.reshape(self.constellation.points, points_shape)
-        points_reshape =np.reshape(self.points, points_shape) #(1, 1, 4) #(16,)=> (1, 1, 1, 1, 1, 16)
-
-        # Compute squared distances from y to all points
-        # shape [...,n,num_points]
-        #squared_dist = tf.pow(tf.abs(tf.expand_dims(y, axis=-1) - points_reshape), 2)
-        ynew=np.expand_dims(y, axis=-1) #(64, 512, 1): (64, 1, 1, 14, 76, 1(added))
-        #squared_dist=((ynew-points_reshape)**2) #(64, 512, 4)
-        dist = np.abs(ynew-points_reshape) #(64, 512, 4) float32: (64, 1, 1, 14, 76, 16) distance to all 16 points
-        squared_dist = dist **2
-        
-        #Convert no to numpy and cast to the same data type as squared_dist
-        #no=np.array(no, dtype=squared_dist.dtype)
-        #no=no.astype(squared_dist.dtype)
-        no=np.expand_dims(no, axis=-1)
-        # Compute exponents
-        exponents = -squared_dist/no #(64, 1, 1, 14, 76, 16)
-
-        if self.with_prior:
-            llr = self._logits2llrs([exponents, prior])
-        else:
-            #exponents = tf.convert_to_tensor(exponents) #move into the logits2llrs function
-            llr = self._logits2llrs(exponents) #(64, 512, 2): tensor 
-            #input: [...,n, num_points] => [...,n, num_bits_per_symbol] LLRs or hard-decisions for every bit.
-            #output [64, 1, 1, 14, 76, 4] [batch size, num_rx, num_rx_ant, num_ofdm_symbols, fft_size, bits]
-        
-        llr = llr.numpy() #convert tf to numpy
-        yshape_list = list(np.shape(y)) #[64, 1, 1, 14, 76] [batch size, num_rx, num_rx_ant, num_ofdm_symbols, fft_size]
-        part1= yshape_list[:-1] #[64, 1, 1, 14]
-        part2= yshape_list[-1]*self.num_bits_per_symbol #304 (76*4)
-        out_shape = np.concatenate([part1, [part2]], 0) #[ 64,   1,   1,  14, 304] 
-        # Reshape LLRs to [...,n*num_bits_per_symbol]
-        llr_reshaped = np.reshape(llr, out_shape) #[ 64,   1,   1,  14, 304] combined last two dimension
-        #[...,n*num_bits_per_symbol] [batch size, num_rx, num_rx_ant, num_ofdm_symbols, fft_size(n subcarrier) * num_bits_per_symbol]
-
-        # print(tf.shape(y)) #[64, 512]
-        # print(tf.shape(y)[:-1]) # [64]
-        # print(y.shape[-1]) #512
-        # out_shape = tf.concat([tf.shape(y)[:-1],
-        #                        [y.shape[-1] * \
-        #                         self.num_bits_per_symbol]], 0)
-        # llr_reshaped = tf.reshape(llr, out_shape) #(64, 1024)
-
+        # Per-axis PAM (square QAM) or per-point distances, [...,n] => [...,n*num_bits_per_symbol] LLRs or hard-decisions
+        llr_reshaped = demap_llr(y, no, self.points, self._tables, self.num_bits_per_symbol, method=self.demapping_method, \
+                                 prior=prior if self.with_prior else None, hard_out=self.hard_out, chunk_size=self.chunk_size)
         return llr_reshaped
 
 class BinarySource:
@@ -15,8 +15,8 @@ from myadi.aditddn import tddn
 
 #from myad9361class import SDR
 from myadiclass import SDR
-from processing import cfar, get_spectrum, select_chirp, estimate_velocity,\
-      createcomplexsinusoid, create_singlechannel_complexOFDMMIMO
+from processing import cfar_fast, cfar_2d, get_spectrum, select_chirp, extract_bursts, bursts_rangedoppler, estimate_velocity,\
+      createcomplexsinusoid, create_singlechannel_complexOFDMMIMO, CaptureBuffer
 
 # Read back properties from hardware https://analogdevicesinc.github.io/pyadi-iio/devices/adi.ad936x.html
 def printSDRproperties(sdr):
@@ -222,6 +222,10 @@ class RadarData:
         with open(datapath, 'rb') as f:
             alldata = np.load(f, allow_pickle=True)
         datadict=alldata.item() #get the dict
+        if isinstance(datadict['allrxdata'], str):
+            #capture saved with savememmap: .npy file next to the dict
+            rxfile = os.path.join(os.path.dirname(datapath), os.path.basename(datadict['allrxdata']))
+            datadict['allrxdata'] = np.load(rxfile, mmap_mode='r')[:datadict['allrxdata_len']]
         print(datadict['allrxdata'].shape) #8192*100
         self.alldata = datadict['allrxdata']
         self.totallen=len(self.alldata)
@@ -295,8 +299,8 @@ class RadarData:
         return s_dbfs
     
     def cfar(self, s_dbfs, num_guard_cells, num_ref_cells, bias, cfar_method = 'average', use_cfar=True):
-        threshold, targets = cfar(s_dbfs, num_guard_cells, num_ref_cells, bias, cfar_method)
-        s_dbfs_cfar = targets.filled(-200)  # fill the values below the threshold with -200 dBFS
+        threshold, targets, detections, _ = cfar_fast(s_dbfs, num_guard_cells, num_ref_cells, bias, cfar_method)
+        s_dbfs_cfar = np.where(targets, s_dbfs, -200)  # fill the values below the threshold with -200 dBFS
         s_dbfs_threshold = threshold
         return s_dbfs_cfar, s_dbfs_threshold
     
@@ -444,7 +448,8 @@ class RadarDevice:
     def __init__(self, sdrurl, phaserurl, sdrdevice_name='ad9361', sample_rate=0.6e6, center_freq=2.1e9, \
                  rxbuffersize = 1024*8, sdr_bandwidth=1e6, rx_gain=20, Rx_CHANNEL = 2, Tx_CHANNEL = 2,\
                 signal_freq = 100e3, chirp_bandwidth = 4000000, output_freq = 10e9, ramp_time = 0.5e3, ramp_mode = "disabled", \
-                    num_chirps = 1, tddmode=False, savedata=False, savefolder="output", savefilename=None):
+                    num_chirps = 1, tddmode=False, savedata=False, savefolder="output", savefilename=None, \
+                        savebuffer_len=None, savememmap=False):
         #ramp_mode can be:  "disabled", "continuous_sawtooth", "continuous_triangular", "single_sawtooth_burst", "single_ramp_burst"
         self.sdrurl = sdrurl
         self.Rx_CHANNEL = Rx_CHANNEL
@@ -471,12 +476,20 @@ class RadarDevice:
             self.saveddatadict['chirp_bandwidth'] = chirp_bandwidth
             self.saveddatadict['output_freq'] = output_freq
 
-            self.allrxdata = np.empty(0, dtype=np.complex_) #Default is numpy.float64.
             self.savefolder = savefolder
             if savefilename is not None:
                 self.savefilename = savefilename
             else:
                 self.savefilename = f"Radarsaveddata_{datetime.today().strftime('%Y_%m_%d')}.npy"
+            self.allrxdata = None #continuous capture of sdronly_txrx
+            #receive() appends to a chunked store in RAM that keeps the whole capture (savebuffer_len: optional cap in samples),
+            #or with savememmap the first savebuffer_len (default 2**26) samples are written to a memory-mapped .npy file
+            #samples beyond the cap are counted in rx_dropped of the saved dict
+            if savememmap:
+                memmapfile = os.path.join(savefolder, self.savefilename.replace('.npy', '_rx.npy'))
+                self.rxcapture = CaptureBuffer(savebuffer_len or 2**26, dtype=np.complex128, filename=memmapfile)
+            else:
+                self.rxcapture = CaptureBuffer(savebuffer_len, dtype=np.complex128)
         self.mysdr = SDR(SDR_IP=sdrurl, SDR_FC=self.center_freq, \
                         SDR_SAMPLERATE=sample_rate, SDR_BANDWIDTH=sdr_bandwidth, \
                             Rx_CHANNEL=Rx_CHANNEL, Tx_CHANNEL=Tx_CHANNEL, device_name=sdrdevice_name)
@@ -755,9 +768,22 @@ class RadarDevice:
     def stop_device(self):
         if self.savedata:
             self.saveddatadict['closetime']=datetime.today().strftime('%Y-%m-%d %H:%M:%S')
-            self.saveddatadict['allrxdata']=self.allrxdata
+            if self.allrxdata is None:
+                self.rxcapture.flush()
+                self.saveddatadict['rx_total'] = self.rxcapture.total
+                self.saveddatadict['rx_dropped'] = self.rxcapture.dropped
+                if self.rxcapture.filename is not None:
+                    #the samples stay in the memory-mapped file, the dict only points to it
+                    self.saveddatadict['allrxdata'] = self.rxcapture.filename
+                    self.saveddatadict['allrxdata_len'] = len(self.rxcapture)
+                else:
+                    self.allrxdata = self.rxcapture.data()
+                    self.saveddatadict['allrxdata']=self.allrxdata
+            else:
+                self.saveddatadict['allrxdata']=self.allrxdata
             create_folder_and_save_array(self.savefolder, self.saveddatadict, filename=self.savefilename)
             #np.save(self.datapath, self.saveddatadict)
+        self.mysdr.SDR_RX_stop_stream()
         self.mysdr.SDR_TX_stop()
         if self.tddmode:
             # disable TDD and revert to non-TDD (standard) mode
@@ -774,20 +800,28 @@ class RadarDevice:
             self.myphaser.my_phaser._gpios.gpio_burst = 1
             self.myphaser.my_phaser._gpios.gpio_burst = 0
 
+    def start_stream(self, num_buffers=8):
+        #receive() then pulls from the background acquisition thread instead of blocking on sdr.rx()
+        self.mysdr.SDR_RX_start_stream(num_buffers=num_buffers, combinerule='plus', normalize=False)
+
     def receive(self):
         start = timer()
-        data = self.mysdr.SDR_RX_receive(combinerule='plus', normalize=False)
+        rxstream = self.mysdr.rxstream
+        if rxstream is not None:
+            data = rxstream.read()
+        else:
+            data = self.mysdr.SDR_RX_receive(combinerule='plus', normalize=False)
         #x = self.sdr.rx() #1024 size array of complex
         rxt = timer()
         timedelta=rxt-start
         datalen=len(data.real)
-        datarate=datalen*4/timedelta/1e6 #Mbps, complex data is 4bytes
-        print("Data rate at ", datarate, "Mbps.") #7-8Mbps in 10240 points, 10Mbps in 102400points, single channel in 19-20Mbps
+        if rxstream is None:
+            datarate=datalen*4/timedelta/1e6 #Mbps, complex data is 4bytes
+            print("Data rate at ", datarate, "Mbps.") #7-8Mbps in 10240 points, 10Mbps in 102400points, single channel in 19-20Mbps
         if self.savedata:
             self.saveddatadict['rx_num'].append(datalen)
             self.saveddatadict['timedelta'].append(timedelta)
-            #self.allrxdata = np.empty(0, dtype=np.complex_) #Default is numpy.float64.
-            self.allrxdata = np.concatenate((self.allrxdata, data))
+            self.rxcapture.append(data)
         return data, datalen
     
     def get_spectrum(self):
@@ -810,19 +844,10 @@ class RadarDevice:
         return s_vel
 
     def get_rangedoppler(self, data):
-        # Process data
-        N_frame = self.TDD_N_frame, 
-        num_bursts = self.num_bursts
-        good_ramp_samples = self.good_ramp_samples
-        start_offset_samples = self.start_offset_samples
-        # Make a 2D array of the chirps for each burst
-        rx_bursts = np.zeros((num_bursts, good_ramp_samples), dtype=complex)
-        for burst in range(num_bursts):
-            start_index = start_offset_samples + (burst) * N_frame
-            stop_index = start_index + good_ramp_samples
-            rx_bursts[burst] = data[start_index:stop_index]
-        
-        rx_bursts_fft = np.fft.fftshift(abs(np.fft.fft2(rx_bursts)))
+        # Make a 2D array of the chirps for each burst (zero-copy view of the TDD frame)
+        rx_bursts = extract_bursts(data, self.num_bursts, self.good_ramp_samples, \
+                                   self.start_offset_samples, self.num_samples_frame)
+        rx_bursts_fft = abs(bursts_rangedoppler(rx_bursts, window=None))
         range_doppler_data = np.log10(rx_bursts_fft).T
         radar_data = range_doppler_data
         #radar_data = np.clip(radar_data, 0, 6)  # clip the data to control the max spectrogram scale
@@ -831,11 +856,18 @@ class RadarDevice:
 
 
     def cfar(self, s_dbfs, num_guard_cells, num_ref_cells, bias, cfar_method = 'average', use_cfar=True):
-        threshold, targets = cfar(s_dbfs, num_guard_cells, num_ref_cells, bias, cfar_method)
-        s_dbfs_cfar = targets.filled(-200)  # fill the values below the threshold with -200 dBFS
+        threshold, targets, detections, _ = cfar_fast(s_dbfs, num_guard_cells, num_ref_cells, bias, cfar_method)
+        s_dbfs_cfar = np.where(targets, s_dbfs, -200)  # fill the values below the threshold with -200 dBFS
         s_dbfs_threshold = threshold
         return s_dbfs_cfar, s_dbfs_threshold
 
+    def cfar2d(self, radar_data, num_guard_cells=(2, 2), num_ref_cells=(4, 8), bias=1, cfar_method='average'):
+        #radar_data from get_rangedoppler is [range, doppler], cfar_2d expects [..., doppler, range]
+        threshold, targets, detections = cfar_2d(np.swapaxes(radar_data, -1, -2), num_guard_cells, num_ref_cells, bias, cfar_method)
+        radar_data_cfar = np.where(np.swapaxes(targets, -1, -2), radar_data, np.min(radar_data))
+        detections[:, [-2, -1]] = detections[:, [-1, -2]] #[..., range, doppler] indices
+        return radar_data_cfar, np.swapaxes(threshold, -1, -2), detections
+
 def create_folder_and_save_array(folder_path, array, filename='data.npy'):
     start_time = datetime.now() 
   
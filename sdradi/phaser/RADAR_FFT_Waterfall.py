@@ -174,6 +174,9 @@ fc = int(300e3 / (fs / N)) * (fs / N) #300KHz
 i = np.cos(2 * np.pi * t * fc) * 2 ** 14
 q = np.sin(2 * np.pi * t * fc) * 2 ** 14
 iq_300k = 1 * (i + 1j * q)
+#window and its normalization only depend on the buffer size, computed once instead of every update()
+win_funct = np.blackman(N)
+win_sum = np.sum(win_funct)
 
 # Send data
 my_sdr._ctx.set_timeout(0)
@@ -449,11 +452,10 @@ def update():
 
     data = my_sdr.rx() #16384
     data = data[0] + data[1]
-    win_funct = np.blackman(len(data))
     y = data * win_funct
     sp = np.absolute(np.fft.fft(y))
     sp = np.fft.fftshift(sp)
-    s_mag = np.abs(sp) / np.sum(win_funct)
+    s_mag = np.abs(sp) / win_sum
     s_mag = np.maximum(s_mag, 10 ** (-15))
     s_dbfs = 20 * np.log10(s_mag / (2 ** 11))
     """there's a scaling issue on the y-axis of the waterfallcthe data is off by 300kHz.  To fix, I'm just shifting the freq"""
@@ -461,7 +463,7 @@ def update():
     y = data_shift * win_funct
     sp = np.absolute(np.fft.fft(y))
     sp = np.fft.fftshift(sp)
-    s_mag = np.abs(sp) / np.sum(win_funct)
+    s_mag = np.abs(sp) / win_sum
     s_mag = np.maximum(s_mag, 10 ** (-15))
     s_dbfs_shift = 20 * np.log10(s_mag / (2 ** 11))
 
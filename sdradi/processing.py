@@ -1,4 +1,5 @@
 import numpy as np
+import scipy.fft
 from scipy import ndimage
 from timeit import default_timer as timer
 from scipy import signal
@@ -114,6 +115,40 @@ def signal_correlation(rx_samples_np, tx_samples_np, use_npconvolve=True):
     return TTI_corr
 
 
+#Complex cross-correlation via FFT, corr[..., k] = sum_n rx[..., k+n] * conj(tx[n])
+#rx: [..., N_rx], tx: [N_tx] or broadcastable [..., N_tx]; mode='valid' gives N_rx-N_tx+1 lags, index k is the TX start offset in rx
+def correlate_fft(rx_samples, tx_samples, mode='valid'):
+    rx_samples = np.asarray(rx_samples)
+    tx_samples = np.asarray(tx_samples)
+    len_rx = rx_samples.shape[-1]
+    len_tx = tx_samples.shape[-1]
+    nfft = scipy.fft.next_fast_len(len_rx + (len_tx - 1 if mode == 'full' else 0))
+    corr = scipy.fft.ifft(scipy.fft.fft(rx_samples, n=nfft, axis=-1) * np.conj(scipy.fft.fft(tx_samples, n=nfft, axis=-1)), axis=-1)
+    if mode == 'full':
+        #negative lags wrap to the end of the circular correlation, same order as signal.correlate(rx, tx, 'full')
+        return np.concatenate((corr[..., nfft-len_tx+1:], corr[..., :len_rx]), axis=-1)
+    return corr[..., :len_rx-len_tx+1]
+
+#First index along the last axis where correlation > threshold, argmax of the correlation for rows without any crossing
+#threshold: scalar or broadcastable [..., 1], returns (index [...], found [...])
+def first_crossing(correlation, threshold):
+    exceed = correlation > threshold
+    found = exceed.any(axis=-1)
+    index = np.where(found, np.argmax(exceed, axis=-1), np.argmax(correlation, axis=-1))
+    return index, found
+
+#TTI synchronization: offset of tx_samples inside rx_samples ([N_rx] or a batch [..., N_rx])
+#first lag with |corr| > threshold*mean(|corr|), threshold=0 uses the correlation peak
+#returns (offset, abs correlation [..., N_rx-N_tx+1])
+def sync_offset(rx_samples, tx_samples, threshold=6, leadingzeros=0):
+    rx_samples = np.asarray(rx_samples)[..., leadingzeros:]
+    correlation = np.abs(correlate_fft(rx_samples, tx_samples, mode='valid'))
+    if threshold == 0:
+        offset = np.argmax(correlation, axis=-1)
+    else:
+        offset, _ = first_crossing(correlation, np.mean(correlation, axis=-1, keepdims=True) * threshold)
+    return offset + leadingzeros, correlation
+
 def check_corrcondition(final_correlation, SINR, corr_threshold, minSINR=5, maxSINR=30):
     # final_correlation, self.corr_threshold, SINR, minSINR, maxSINR
     condition1 = np.greater(final_correlation, corr_threshold)
@@ -156,37 +191,27 @@ def detect_signaloffsetv2(rx_samples, tx_samples, num_samples, threshold=0, lead
     else:
         rx_samples_normalized = rx_samples
 
-    # Calculate the correlation between TX and RX signal
-    correlation = signal_correlation(rx_samples, tx_samples, use_npconvolve=True)
-    correlation_mean = np.mean(correlation)
-    TTI_corr = correlation #correlation output
+    # Calculate the complex correlation between TX and RX signal (FFT, valid lags: index = TTI start)
     len_tx = len(tx_samples)
     len_rx = len(rx_samples)
-
-    def find_max_offset():
-        TTI_offset_max = np.argmax(correlation) - len_tx // 2 + 1
-        return TTI_offset_max
-
-    def find_first_exceeding_threshold():
-        exceed_mask = correlation > correlation_mean * threshold
-        first_exceeding_index = np.argmax(exceed_mask)
-        # Adjust the index based on the search window and offset
-        return first_exceeding_index - len_tx // 2 + 1
+    correlation = np.abs(correlate_fft(rx_samples, tx_samples, mode='valid'))
+    correlation_mean = np.mean(correlation)
+    # keep the previous 'same' layout for TTI_corr: lag k is stored at k + len_tx//2 - 1
+    TTI_corr = np.zeros(len_rx, dtype=correlation.dtype) #correlation output
+    TTI_corr[len_tx//2 - 1:len_tx//2 - 1 + len(correlation)] = correlation
 
     # Decide which offset to use based on the threshold
     if threshold == 0:
-        TTI_offset = find_max_offset()
-        #find the index of the max value of absolute values of the first half of the correlation signal. 
-        #TTI_offset is initially set to the alignment position (index). we subtract the length of flat_samples and add 1 to get the correct offset.
-        TTI_offset = np.argmax(np.abs(correlation[0:int(len(rx_samples) / 2)])) - len(tx_samples) + 1
-        
+        #find the index of the max value of the correlation in the first half of the received signal
+        TTI_offset = int(np.argmax(correlation[0:max(len_rx//2 - len_tx + 1, 1)]))
     else:
-        TTI_offset = find_first_exceeding_threshold()
+        TTI_offset, _ = first_crossing(correlation, correlation_mean * threshold)
+        TTI_offset = int(TTI_offset)
         if (TTI_offset < leadingzeros) or (TTI_offset > (len_rx - leadingzeros)):
-            TTI_offset = find_max_offset()
+            TTI_offset = int(np.argmax(correlation))
 
     # Access the correlation value at the found offset
-    final_correlation = correlation[TTI_offset + len_tx // 2 - 1] / correlation_mean
+    final_correlation = correlation[TTI_offset] / correlation_mean
     print("final_correlation:", final_correlation)
 
     # Calculate rx_noise
@@ -405,48 +430,118 @@ def extenddata(data, zoom=(20,5)):
     resampled_data=ndimage.zoom(data, zoom=(20,5))
     return resampled_data
 
+_WINDOWS = {'blackman': np.blackman, 'hanning': np.hanning, 'hamming': np.hamming, 'none': np.ones}
+
+def extract_bursts(data, num_bursts, good_ramp_samples, start_offset_samples, num_samples_frame):
+    #zero-copy [num_bursts, good_ramp_samples] view of the TDD buffer, burst k starts at
+    #start_offset_samples + k*num_samples_frame (read-only, it shares memory with data)
+    data = np.asarray(data)
+    stop_index = start_offset_samples + (num_bursts - 1) * num_samples_frame + good_ramp_samples
+    if data.ndim != 1 or stop_index > data.size:
+        raise ValueError(f"buffer of {data.size} samples is too short for {num_bursts} bursts (needs {stop_index})")
+    step = data.strides[0]
+    return np.lib.stride_tricks.as_strided(data[start_offset_samples:], shape=(num_bursts, good_ramp_samples),
+                                           strides=(num_samples_frame * step, step), writeable=False)
+
+def bursts_rangedoppler(rx_bursts, window='blackman', range_fft_size=None, doppler_fft_size=None):
+    #window every burst (chirp) and run the range FFT (axis 1) and Doppler FFT (axis 0) on the whole burst matrix
+    #returns the fftshifted complex range-Doppler map [doppler, range]
+    num_bursts, good_ramp_samples = rx_bursts.shape
+    if window is not None:
+        rx_bursts = rx_bursts * _WINDOWS[window](good_ramp_samples)
+    rd_fft = np.fft.fft2(rx_bursts, s=(doppler_fft_size or num_bursts, range_fft_size or good_ramp_samples))
+    return np.fft.fftshift(rd_fft)
+
 def select_chirp(sum_data, num_chirps, good_ramp_samples, start_offset_samples, num_samples_frame, fft_size):
     # select just the linear portion of the last chirp
-    rx_bursts = np.zeros((num_chirps, good_ramp_samples), dtype=complex)
-    for burst in range(num_chirps):
-        start_index = start_offset_samples + burst*num_samples_frame
-        stop_index = start_index + good_ramp_samples
-        rx_bursts[burst] = sum_data[start_index:stop_index]
-        burst_data = np.ones(fft_size, dtype=complex)*1e-10
-        #win_funct = np.blackman(len(rx_bursts[burst]))
-        win_funct = np.ones(len(rx_bursts[burst]))
-        burst_data[start_offset_samples:(start_offset_samples+good_ramp_samples)] = rx_bursts[burst]*win_funct
+    rx_bursts = extract_bursts(sum_data, num_chirps, good_ramp_samples, start_offset_samples, num_samples_frame)
+    burst_data = np.ones(fft_size, dtype=complex)*1e-10
+    #win_funct = np.blackman(good_ramp_samples)
+    win_funct = np.ones(good_ramp_samples)
+    burst_data[start_offset_samples:(start_offset_samples+good_ramp_samples)] = rx_bursts[-1]*win_funct
     return burst_data, win_funct
 
+class SpectrumProcessor:
+    #dBFS spectrum of N-sample frames with everything that does not depend on the data computed once:
+    #window, window normalization, mixer tone (shift_freq) and the zero padded input/magnitude buffers.
+    #Use get_spectrum_processor() to share one instance per (N, fft_size, window, shift_freq, fs).
+    def __init__(self, N, fft_size=None, window='blackman', shift_freq=None, fs=None, scale=2**11):
+        self.N = int(N)
+        self.fft_size = self.N if fft_size is None else int(fft_size)
+        self.window = window
+        self.scale = scale
+        self.win_funct = _WINDOWS['none' if window is None else window](self.N)
+        #normalization accounts for the window’s effect
+        self.win_sum = np.sum(self.win_funct)
+        #np.fft.fft(y, n=fft_size) crops or zero pads y to fft_size samples
+        self.num_used = min(self.N, self.fft_size)
+        self._x = np.zeros(self.fft_size, dtype=np.complex128) #zero padded FFT input
+        self._mag = np.empty(self.fft_size, dtype=np.float64) #shifted magnitude
+        self.tone = None
+        if shift_freq is not None:
+            #mixer tone on an exact FFT bin, same as showspectrum()
+            fc = int(shift_freq / (fs / self.N)) * (fs / self.N)
+            t = np.arange(self.N) / fs
+            self.tone = np.exp(1j * 2 * np.pi * t * fc) * 2 ** 14
+
+    def process(self, data, apply_window=True, mix=False, norm=None, out=None):
+        #data: N complex/real samples
+        #apply_window=False for data that is already windowed (get_spectrum with win_funct)
+        #mix: multiply by the cached mixer tone before the FFT
+        #norm: normalization, defaults to the sum of the cached window
+        #returns s_dbfs (fftshifted, dBFS), written to out if given
+        n = self.num_used
+        x = self._x
+        if mix:
+            np.multiply(data[:n], self.tone[:n], out=x[:n])
+            if apply_window:
+                x[:n] *= self.win_funct[:n]
+        elif apply_window:
+            np.multiply(data[:n], self.win_funct[:n], out=x[:n])
+        else:
+            x[:n] = data[:n]
+        data_fft = np.fft.fft(x)
+
+        #fftshift written straight into the magnitude buffer
+        mag = self._mag
+        half = self.fft_size // 2
+        np.abs(data_fft[:self.fft_size - half], out=mag[half:])
+        np.abs(data_fft[self.fft_size - half:], out=mag[:half])
+
+        if out is None:
+            out = np.empty(self.fft_size, dtype=np.float64)
+        np.divide(mag, self.win_sum if norm is None else norm, out=out)
+        #To avoid division by zero, any values in s_mag below a threshold (here, 10 ** (-15)) are replaced with this minimum value.
+        np.maximum(out, 10 ** (-15), out=out)
+        #Divided by (2^11) to match the range of SDR radio (same to transmit).
+        out /= self.scale
+        np.log10(out, out=out)
+        out *= 20
+        return out
+
+_spectrum_processors = {}
+
+def get_spectrum_processor(N, fft_size=None, window='blackman', shift_freq=None, fs=None):
+    #shared SpectrumProcessor per (N, fft_size, window, shift_freq, fs), the live GUIs call this every frame
+    key = (int(N), fft_size, window, shift_freq, fs)
+    processor = _spectrum_processors.get(key)
+    if processor is None:
+        processor = SpectrumProcessor(N, fft_size=fft_size, window=window, shift_freq=shift_freq, fs=fs)
+        _spectrum_processors[key] = processor
+    return processor
+
 def get_spectrum(data, fft_size=None, win_funct=None):
+    #creates a Blackman window of the same length as the input data array data (cached in SpectrumProcessor)
+    #reduce spectral leakage when performing Fourier transforms. 
+    # It smoothly tapers the edges of the data to minimize artifacts in the frequency domain.
     if win_funct is None:
-        #creates a Blackman window of the same length as the input data array data
-        #reduce spectral leakage when performing Fourier transforms. 
-        # It smoothly tapers the edges of the data to minimize artifacts in the frequency domain.
-        win_funct = np.blackman(len(data))
-        #the input data data is multiplied element-wise with the Blackman window
-        #emphasizing the central portion while attenuating the edges
-        y = data * win_funct
-    else:
-        y = data
-    #The Fast Fourier Transform (FFT) is applied to the windowed data y. 
-    # The result contains the complex-valued spectrum of the signal. 
-    if fft_size is None:
-        data_fft = np.fft.fft(y)
+        processor = get_spectrum_processor(len(data), fft_size=fft_size, window='blackman')
+        s_dbfs = processor.process(data)
     else:
-        data_fft = np.fft.fft(y, n=fft_size)
-    # Taking the absolute value ensures we have the magnitude spectrum.
-    sp = np.absolute(data_fft)
-    #The FFT result is shifted so that the zero frequency component (DC component) is at the center of the spectrum. 
-    # This is useful for visualization and further processing.
-    sp = np.fft.fftshift(sp)
-    #normalization accounts for the window’s effect
-    s_mag = np.abs(sp) / np.sum(win_funct)
-    #To avoid division by zero, any values in s_mag below a threshold (here, 10 ** (-15)) are replaced with this minimum value.
-    s_mag = np.maximum(s_mag, 10 ** (-15))
+        #data is already windowed by the caller (select_chirp), only the normalization uses win_funct
+        processor = get_spectrum_processor(len(data), fft_size=fft_size, window=None)
+        s_dbfs = processor.process(data, apply_window=False, norm=np.sum(win_funct))
     #The magnitude spectrum is converted to decibels (dBFS, or decibels relative to full scale). 
-    # Divided by (2^11) to match the range of SDR radio (same to transmit).
-    s_dbfs = 20 * np.log10(s_mag / (2 ** 11))
     return s_dbfs
 
 def estimate_velocity(s_dbfs, N_frame, signal_freq, sample_rate):
@@ -498,45 +593,20 @@ def plot_rangedoppler_spectrum(radar_data, dist, max_doppler_vel):
     
 
 def showspectrum(data, fs):
-    # fc = int(100e3 / (fs / N_frame)) * (fs / N_frame) #300KHz
-    # ts =1.0/fs
-    # t = np.arange(0, N_frame * ts, ts)
-    # i = np.cos(2 * np.pi * t * fc) * 2 ** 14
-    # q = np.sin(2 * np.pi * t * fc) * 2 ** 14
-    # iq_100k = 1 * (i + 1j * q)
-    #data=data[0:N_frame] #* iq_100k
     N_frame = len(data)
-    win_funct = np.blackman(len(data))
-    y = data * win_funct
-    sp = np.absolute(np.fft.fft(y))
-    sp = np.fft.fftshift(sp)
-    s_mag = np.abs(sp) / np.sum(win_funct)
-    s_mag = np.maximum(s_mag, 10 ** (-15))
-    s_dbfs = 20 * np.log10(s_mag / (2 ** 11))
+    processor = get_spectrum_processor(N_frame, window='blackman', shift_freq=300e3, fs=fs)
+    s_dbfs = processor.process(data)
 
     """there's a scaling issue on the y-axis of the waterfallcthe data is off by 300kHz.  To fix, I'm just shifting the freq"""
-    fc = int(300e3 / (fs / N_frame)) * (fs / N_frame) #300KHz
-    ts =1.0/fs
-    t = np.arange(0, N_frame * ts, ts)
-    i = np.cos(2 * np.pi * t * fc) * 2 ** 14
-    q = np.sin(2 * np.pi * t * fc) * 2 ** 14
-    iq_300k = 1 * (i + 1j * q)
-    data_shift = data * iq_300k
-    y = data_shift * win_funct
-    sp = np.absolute(np.fft.fft(y))
-    sp = np.fft.fftshift(sp)
-    s_mag = np.abs(sp) / np.sum(win_funct)
-    s_mag = np.maximum(s_mag, 10 ** (-15))
-    s_dbfs_shift = 20 * np.log10(s_mag / (2 ** 11))
+    #the 300KHz tone is cached in the processor
+    s_dbfs_shift = processor.process(data, mix=True)
     return s_dbfs, s_dbfs_shift
 
 
 def rangedoppler(data, n_c=150, n_s=600, showdb=True):
     #n_s = 600
     #n_r = int(len(data)/n_s)-1
-    table = np.zeros((n_c, n_s), dtype=np.complex_) #150 chirps,1000 samples/chirp
-    for chirp_nr in range(n_c):
-        table[chirp_nr, :] = data[(chirp_nr*n_s):(n_s*(chirp_nr+1))]
+    table = extract_bursts(data, n_c, n_s, 0, n_s) #150 chirps,1000 samples/chirp, view of data
     #fft_output = np.fft.fft2(table)
     #2D FFT and Velocity-Distance Relationship
     Z_fft2 = abs(np.fft.fft2(table)) #
@@ -551,69 +621,241 @@ from scipy.interpolate import interp1d
 #interp1d is used for 1-D interpolation (linear or cubic) of data points.
 
 #ref: https://github.com/brunerm99/ADI_Radar_DSP
-def cfar(X_k, num_guard_cells, num_ref_cells, bias=1, cfar_method='average',
+def cfar_fast(X_k, num_guard_cells, num_ref_cells, bias=1, cfar_method='average',
     fa_rate=0.2):
-    #X_k: An array of input data (presumably radar signal values).
-    #num_guard_cells: The number of guard cells around the center cell.
-    #num_ref_cells: The number of reference cells around the center cell.
-    #bias: An optional bias value (default is 1).
-    #cfar_method: The CFAR (Constant False Alarm Rate) method to use (default is ‘average’).
-    #fa_rate: The desired false alarm rate (default is 0.2).
-
+    #Vectorized version of cfar(): all center cells are evaluated at once via cumulative sums,
+    #no Python loop over the FFT bins (fft_size=8192 is evaluated in well under a millisecond).
+    #X_k: An array of input data (spectrum in dBFS).
+    #num_guard_cells, num_ref_cells: guard/reference cells on each side of the center cell.
+    #cfar_method: 'average', 'greatest', 'smallest' or 'false_alarm'
+    #returns:
+    #   cfar_values (ndarray): threshold per cell, the edge cells are filled with the minimum threshold
+    #   targets (ndarray, bool): True where the cell is kept, same rule as the masked array of cfar()
+    #   detections (ndarray): indices where targets is True
+    #   noise_variance (ndarray): per cell noise variance for 'false_alarm', None otherwise
+    X_k = np.asarray(X_k)
     N = X_k.size
-    #cfar_values initialized as a masked array with the same shape as X_k.
-    #Return an empty masked array of the given shape and dtype, where all the data are masked.
-    cfar_values = np.ma.masked_all(X_k.shape)
-
-    #iterates over the center cells (excluding guard and reference cells) in the input array.
-    for center_index in range(num_guard_cells + num_ref_cells, N - (num_guard_cells + num_ref_cells)):
-        min_index = center_index - (num_guard_cells + num_ref_cells)
-        min_guard = center_index - num_guard_cells 
-        max_index = center_index + (num_guard_cells + num_ref_cells) + 1
-        max_guard = center_index + num_guard_cells + 1
-
-        lower_nearby = X_k[min_index:min_guard] #ref cells
-        upper_nearby = X_k[max_guard:max_index] #ref cells
-
-        #The mean values of the nearby/ref cells are computed.
-        lower_mean = np.mean(lower_nearby)
-        upper_mean = np.mean(upper_nearby)
+    num_side = num_guard_cells + num_ref_cells
+    cfar_values = np.zeros(N, dtype=np.float64)
+    noise_variance = None
+
+    #center cells that have a full set of reference cells on both sides
+    centers = np.arange(num_side, N - num_side)
+    if centers.size > 0:
+        x = X_k.astype(np.float64)
+        #window sum over x[a:b] is csum[b]-csum[a]
+        csum = np.concatenate(([0.0], np.cumsum(x)))
+        lower_sum = csum[centers - num_guard_cells] - csum[centers - num_side]
+        upper_sum = csum[centers + num_side + 1] - csum[centers + num_guard_cells + 1]
 
         if (cfar_method == 'average'):
-            mean = np.mean(np.concatenate((lower_nearby, upper_nearby)))
-            output = mean + bias
+            output = (lower_sum + upper_sum) / (2 * num_ref_cells) + bias
         elif (cfar_method == 'greatest'):
-            mean = max(lower_mean, upper_mean)
-            output = mean + bias
+            output = np.maximum(lower_sum, upper_sum) / num_ref_cells + bias
         elif (cfar_method == 'smallest'):
-            mean = min(lower_mean, upper_mean)
-            output = mean + bias
+            output = np.minimum(lower_sum, upper_sum) / num_ref_cells + bias
         elif (cfar_method == 'false_alarm'):
-            refs = np.concatenate((lower_nearby, upper_nearby))
-            noise_variance = np.sum(refs**2 / refs.size)
-            output = (noise_variance * -2 * np.log(fa_rate))**0.5
+            csum2 = np.concatenate(([0.0], np.cumsum(x**2)))
+            lower_sum2 = csum2[centers - num_guard_cells] - csum2[centers - num_side]
+            upper_sum2 = csum2[centers + num_side + 1] - csum2[centers + num_guard_cells + 1]
+            noise_variance = np.zeros(N, dtype=np.float64)
+            noise_variance[centers] = (lower_sum2 + upper_sum2) / (2 * num_ref_cells)
+            output = (noise_variance[centers] * -2 * np.log(fa_rate))**0.5
         else:
             raise Exception('No CFAR method received')
 
-        #The computed output value is assigned to the corresponding position in cfar_values.
-        cfar_values[center_index] = output
+        cfar_values[centers] = output
+        #cells without a full reference window get the minimum threshold (same as cfar())
+        edge_value = np.min(output)
+        cfar_values[:num_side] = edge_value
+        cfar_values[N - num_side:] = edge_value
+    elif cfar_method not in ('average', 'greatest', 'smallest', 'false_alarm'):
+        raise Exception('No CFAR method received')
 
-    #Any masked (invalid) values in cfar_values are replaced with the minimum value in the array.
-    cfar_values[np.where(cfar_values == np.ma.masked)] = np.min(cfar_values)
+    #cfar() masks the cells where abs(X_k) > abs(cfar_values), the remaining cells are the targets
+    targets = np.abs(X_k) <= np.abs(cfar_values)
+    detections = np.flatnonzero(targets)
+    return cfar_values, targets, detections, noise_variance
+
+def cfar(X_k, num_guard_cells, num_ref_cells, bias=1, cfar_method='average',
+    fa_rate=0.2):
+    #X_k: An array of input data (presumably radar signal values).
+    #num_guard_cells: The number of guard cells around the center cell.
+    #num_ref_cells: The number of reference cells around the center cell.
+    #bias: An optional bias value (default is 1).
+    #cfar_method: The CFAR (Constant False Alarm Rate) method to use (default is ‘average’).
+    #fa_rate: The desired false alarm rate (default is 0.2).
+    #the thresholds are computed by cfar_fast(), this keeps the masked array outputs
+
+    cfar_values, targets, detections, noise_variance = cfar_fast(X_k, num_guard_cells, num_ref_cells, \
+                                                                 bias=bias, cfar_method=cfar_method, fa_rate=fa_rate)
 
     #A masked array targets_only is created from a copy of X_k.
     targets_only = np.ma.masked_array(np.copy(X_k))
     #If the absolute value of a signal in X_k exceeds the corresponding value in cfar_values, it is masked in targets_only.
-    targets_only[np.where(abs(X_k) > abs(cfar_values))] = np.ma.masked
+    targets_only[~targets] = np.ma.masked
 
     if (cfar_method == 'false_alarm'):
-        return cfar_values, targets_only, noise_variance
+        #noise variance of the last center cell
+        num_side = num_guard_cells + num_ref_cells
+        return cfar_values, targets_only, noise_variance[X_k.size - num_side - 1]
     else:
         return cfar_values, targets_only
     
 
+def _box_sum_2d(S, start0, start1, size0, size1, out0, out1):
+    #sum over all windows of size (size0, size1) from the summed-area table S (leading zero row/col)
+    #window k,l covers rows start0+k ... start0+k+size0-1 and cols start1+l ... start1+l+size1-1
+    a0, b0 = start0, start0 + size0
+    a1, b1 = start1, start1 + size1
+    return S[..., b0:b0+out0, b1:b1+out1] - S[..., a0:a0+out0, b1:b1+out1] \
+        - S[..., b0:b0+out0, a1:a1+out1] + S[..., a0:a0+out0, a1:a1+out1]
+
+def cfar_2d(rd_map, num_guard_cells=(2, 2), num_ref_cells=(4, 8), bias=1, cfar_method='average',
+    os_rank=0.75, pad_mode=('wrap', 'edge'), max_cells=2**24):
+    #2D CFAR on range-Doppler maps (e.g., radar_data of RadarDevice.get_rangedoppler or processing.rangedoppler)
+    #rd_map: [doppler, range] map or a stack of maps [frames, doppler, range], all frames processed in one pass
+    #num_guard_cells, num_ref_cells: (doppler, range) cells on each side of the cell under test
+    #bias: added to the noise estimate, same convention as cfar() (dB maps)
+    #cfar_method: 'average' (CA-CFAR, summed-area table) or 'os' (OS-CFAR, os_rank quantile of the reference cells)
+    #pad_mode: np.pad mode for the (doppler, range) borders, Doppler is periodic so it wraps by default
+    #max_cells: OS-CFAR works on frame chunks with at most this many reference values in memory
+    #returns:
+    #   threshold (ndarray): same shape as rd_map
+    #   targets (ndarray, bool): rd_map > threshold
+    #   detections (ndarray): [num_detections, rd_map.ndim] indices of the targets
+    rd_map = np.asarray(rd_map)
+    single = rd_map.ndim == 2
+    maps = rd_map[np.newaxis] if single else rd_map
+    num_frames, num_doppler, num_range = maps.shape
+    gd, gr = num_guard_cells
+    rfd, rfr = num_ref_cells
+    hd, hr = gd + rfd, gr + rfr #half window size
+    wd, wr = 2*hd + 1, 2*hr + 1 #outer window size
+
+    if isinstance(pad_mode, str):
+        pad_mode = (pad_mode, pad_mode)
+    padded = maps.astype(np.float64)
+    padded = np.pad(padded, [(0, 0), (hd, hd), (0, 0)], mode=pad_mode[0])
+    padded = np.pad(padded, [(0, 0), (0, 0), (hr, hr)], mode=pad_mode[1])
+
+    if cfar_method == 'average':
+        #summed-area table with a leading zero row/column
+        S = np.zeros((num_frames, padded.shape[1] + 1, padded.shape[2] + 1), dtype=np.float64)
+        S[:, 1:, 1:] = padded.cumsum(axis=1).cumsum(axis=2)
+        outer = _box_sum_2d(S, 0, 0, wd, wr, num_doppler, num_range)
+        guard = _box_sum_2d(S, rfd, rfr, 2*gd + 1, 2*gr + 1, num_doppler, num_range)
+        num_ref = wd*wr - (2*gd + 1)*(2*gr + 1)
+        threshold = (outer - guard) / num_ref + bias
+    elif cfar_method == 'os':
+        #reference cells inside the flattened (wd, wr) window
+        ref_mask = np.ones((wd, wr), dtype=bool)
+        ref_mask[rfd:rfd + 2*gd + 1, rfr:rfr + 2*gr + 1] = False
+        ref_index = np.flatnonzero(ref_mask)
+        k = int(np.clip(round(os_rank * (ref_index.size - 1)), 0, ref_index.size - 1))
+        threshold = np.empty(maps.shape, dtype=np.float64)
+        windows = np.lib.stride_tricks.sliding_window_view(padded, (wd, wr), axis=(1, 2))
+        frames_per_chunk = max(1, int(max_cells // (num_doppler * num_range * ref_index.size)))
+        for start in range(0, num_frames, frames_per_chunk):
+            stop = min(start + frames_per_chunk, num_frames)
+            refs = windows[start:stop].reshape(stop - start, num_doppler, num_range, wd*wr)[..., ref_index]
+            threshold[start:stop] = np.partition(refs, k, axis=-1)[..., k] + bias
+    else:
+        raise Exception('No CFAR method received')
+
+    targets = maps > threshold
+    if single:
+        threshold = threshold[0]
+        targets = targets[0]
+    detections = np.argwhere(targets)
+    return threshold, targets, detections
+
 def calculateDoppler(vr=1, fc=100000):
     c = 3e8
     lambda_wave = c/fc
     fd=2*vr/lambda_wave
-    return fd
\ No newline at end of file
+    return fd
+
+
+class CaptureBuffer:
+    #store for continuous RX captures, every append is a copy into the storage
+    #(constant time per buffer) instead of the O(n^2) np.concatenate accumulation
+    #max_samples: capacity in samples, None grows without limit (chunked store, needs ring=False and no filename)
+    #ring: True keeps the latest max_samples, False stops storing once full (the rest is counted in dropped)
+    #filename: optional .npy file, the storage is then a memory-mapped array (spill-to-disk for long captures)
+    #chunk_size: samples per chunk of the growing in-RAM store, chunks are allocated when they are needed
+    def __init__(self, max_samples=None, dtype=np.complex128, ring=False, filename=None, chunk_size=2**20):
+        assert max_samples is not None or not (ring or filename), "ring and memmap captures need max_samples"
+        self.max_samples = None if max_samples is None else int(max_samples)
+        self.ring = ring
+        self.filename = filename
+        self.dtype = dtype
+        self.chunk_size = int(chunk_size) if max_samples is None else min(int(chunk_size), self.max_samples)
+        self.storage = None
+        if filename is not None:
+            folder = os.path.dirname(filename)
+            if folder and not os.path.exists(folder):
+                os.makedirs(folder)
+            self.storage = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype, shape=(self.max_samples,))
+        elif ring:
+            self.storage = np.empty(self.max_samples, dtype=dtype)
+        self.reset()
+
+    def reset(self):
+        self.write_index = 0 #next write position in storage
+        self.total = 0 #all samples passed to append
+        self.dropped = 0 #samples not stored (ring=False and full)
+        if self.storage is None:
+            self.chunks = [] #growing store, all chunks except the last are full
+
+    def __len__(self):
+        if self.ring:
+            return min(self.total, self.max_samples)
+        return self.write_index
+
+    def append(self, data):
+        data = np.ravel(data)
+        n = data.size
+        self.total += n
+        if self.ring:
+            if n >= self.max_samples: #only the tail fits
+                self.storage[:] = data[n - self.max_samples:]
+                self.write_index = 0
+                return
+            first = min(n, self.max_samples - self.write_index)
+            self.storage[self.write_index:self.write_index + first] = data[:first]
+            self.storage[:n - first] = data[first:]
+            self.write_index = (self.write_index + n) % self.max_samples
+            return
+        if self.max_samples is not None:
+            keep = min(n, self.max_samples - self.write_index)
+            self.dropped += n - keep
+            data = data[:keep]
+        if self.storage is not None:
+            self.storage[self.write_index:self.write_index + len(data)] = data
+            self.write_index += len(data)
+            return
+        start = 0
+        while start < len(data):
+            offset = self.write_index % self.chunk_size
+            if offset == 0:
+                self.chunks.append(np.empty(self.chunk_size, dtype=self.dtype))
+            m = min(len(data) - start, self.chunk_size - offset)
+            self.chunks[-1][offset:offset + m] = data[start:start + m]
+            self.write_index += m
+            start += m
+
+    def data(self):
+        #captured samples in time order, a view of the storage unless the ring has wrapped or the store is chunked
+        if self.storage is None:
+            if not self.chunks:
+                return np.empty(0, dtype=self.dtype)
+            last = self.write_index - (len(self.chunks) - 1)*self.chunk_size
+            return np.concatenate(self.chunks[:-1] + [self.chunks[-1][:last]])
+        if not self.ring or self.total < self.max_samples:
+            return self.storage[:len(self)]
+        return np.concatenate((self.storage[self.write_index:], self.storage[:self.write_index]))
+
+    def flush(self):
+        if isinstance(self.storage, np.memmap):
+            self.storage.flush()
@@ -0,0 +1,128 @@
+#Threaded RX acquisition: a background thread pulls sdr.rx() buffers into a bounded pool of preallocated arrays,
+#consumers (spectrum, CFAR, plotting, recording) pull them from a queue without blocking the receiver.
+import queue
+import threading
+from timeit import default_timer as timer
+import numpy as np
+
+
+class RXStreamer:
+    #sdr: any object with rx() and rx_buffer_size (adi device, or FakeSDR for offline tests)
+    #Rx_CHANNEL: 2 if sdr.rx() returns a list of two channels
+    #num_buffers: size of the preallocated buffer pool, the queue depth is bounded by it
+    #combinerule: 'drop' keeps channel 0, 'plus' adds both channels (same as SDR.SDR_RX_receive)
+    def __init__(self, sdr, Rx_CHANNEL=2, num_buffers=8, combinerule='drop', normalize=False, dtype=np.complex128):
+        self.sdr = sdr
+        self.Rx_CHANNEL = Rx_CHANNEL
+        self.combinerule = combinerule
+        self.normalize = normalize
+        self.buffer_size = int(sdr.rx_buffer_size)
+        self.buffers = np.zeros((num_buffers, self.buffer_size), dtype=dtype)
+        self.free_slots = queue.Queue()
+        for slot in range(num_buffers):
+            self.free_slots.put(slot)
+        self.filled = queue.Queue(maxsize=num_buffers) #(slot, sequence number, receive time)
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.error = None
+        self.received = 0 #buffers read from the device
+        self.dropped = 0 #buffers discarded because all slots were in use
+        self.max_depth = 0
+        self.rxtime = 0.0 #total time spent in sdr.rx()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="RXStreamer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=2.0):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        try:
+            while not self._stop_event.is_set():
+                start = timer()
+                x = self.sdr.rx()
+                self.rxtime += timer() - start
+                seq = self.received
+                self.received += 1
+                try:
+                    slot = self.free_slots.get_nowait()
+                except queue.Empty:
+                    #consumers are too slow, keep reading the device and drop this buffer
+                    self.dropped += 1
+                    continue
+                out = self.buffers[slot]
+                if self.Rx_CHANNEL == 2:
+                    if self.combinerule == 'plus':
+                        np.add(x[0], x[1], out=out)
+                    else:
+                        out[:] = x[0]
+                else:
+                    out[:] = x
+                if self.normalize:
+                    out /= np.max(np.abs(out))
+                self.filled.put((slot, seq, start))
+                self.max_depth = max(self.max_depth, self.filled.qsize())
+        except Exception as e:
+            self.error = e
+
+    def get(self, timeout=None):
+        #returns (slot, data, sequence number), data is a view of the pool until release(slot) is called
+        #gaps in the sequence numbers are dropped buffers
+        while True:
+            if self.error is not None:
+                raise self.error
+            try:
+                slot, seq, rxstart = self.filled.get(timeout=0.1 if timeout is None else timeout)
+                return slot, self.buffers[slot], seq
+            except queue.Empty:
+                if timeout is not None or self._thread is None:
+                    raise
+
+    def release(self, slot):
+        self.free_slots.put(slot)
+
+    def read(self, timeout=None):
+        #copy of the next buffer, the slot is released immediately
+        slot, data, seq = self.get(timeout=timeout)
+        data = data.copy()
+        self.release(slot)
+        return data
+
+    def queue_depth(self):
+        return self.filled.qsize()
+
+    def stats(self):
+        datarate = self.received * self.buffer_size * 4 / self.rxtime / 1e6 if self.rxtime > 0 else 0.0 #Mbps, complex data is 4bytes
+        return {'received': self.received, 'dropped': self.dropped, 'queue_depth': self.queue_depth(),
+                'max_queue_depth': self.max_depth, 'datarate': datarate}
+
+
+class FakeSDR:
+    #synthetic IQ source with the sdr.rx() interface, for running the RX pipeline without hardware
+    def __init__(self, sample_rate=1e6, rx_buffer_size=1024*8, Rx_CHANNEL=2, signal_freq=100e3, noise=0.01, realtime=True):
+        self.sample_rate = sample_rate
+        self.rx_buffer_size = rx_buffer_size
+        self.Rx_CHANNEL = Rx_CHANNEL
+        self.signal_freq = signal_freq
+        self.noise = noise
+        self.realtime = realtime #sleep for the buffer duration like the hardware does
+        self._n = 0
+        self._rng = np.random.default_rng()
+
+    def rx(self):
+        n = np.arange(self._n, self._n + self.rx_buffer_size)
+        self._n += self.rx_buffer_size
+        tone = np.exp(1j * 2 * np.pi * self.signal_freq / self.sample_rate * n) * 2 ** 11
+        if self.realtime:
+            threading.Event().wait(self.rx_buffer_size / self.sample_rate)
+        channels = [tone + self.noise * 2 ** 11 * (self._rng.standard_normal(n.size) + 1j * self._rng.standard_normal(n.size))
+                    for _ in range(self.Rx_CHANNEL)]
+        return channels if self.Rx_CHANNEL == 2 else channels[0]
@@ -12,6 +12,8 @@ from PyQt6 import QtWidgets
 #PLOT_SIZE = 128
 
 
+_hanning_windows = {} #Nsamp -> np.hanning(Nsamp), computed once per frame size
+
 #ref: https://github.com/pyrf/pyrf/blob/master/pyrf/numpy_util.py
 def compute_fft(data, hide_differential_dc_offset=True, apply_window=True, convert_to_dbm=True):
     Nsamp = len(data)
@@ -26,7 +28,10 @@ def compute_fft(data, hide_differential_dc_offset=True, apply_window=True, conve
     iq = data #i_data + 1j * q_data
 
     if apply_window:
-        iq = iq * np.hanning(Nsamp)
+        win = _hanning_windows.get(Nsamp)
+        if win is None:
+            win = _hanning_windows.setdefault(Nsamp, np.hanning(Nsamp))
+        iq = iq * win
     
     power_spectrum = np.abs(np.fft.fftshift(np.fft.fft(iq)))/Nsamp
 